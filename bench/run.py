@@ -0,0 +1,256 @@
+"""Benchmark de latence des processus WPS.
+
+Deux modes :
+  - inprocess : requêtes séquentielles via le client de test Flask
+    (pywps + processus, sans réseau) ;
+  - http : serveur Flask threadé sur un port local, requêtes concurrentes
+    sur /wps.
+
+Pour chaque scénario : p50 / p95 / p99, débit (req/s) et RSS max du
+processus. Les résultats peuvent être enregistrés comme référence puis
+comparés aux exécutions suivantes.
+
+    python -m bench.run --save-baseline
+    python -m bench.run --mode http --concurrency 16 --requests 200
+    WPS_DATA_DIR=/tmp/wps-bench python -m bench.run --baseline bench/baseline-synth.json
+
+Le cache de résultats est désactivé par défaut (--cache pour le mesurer).
+Au-delà de `parallelprocesses` (pywps.cfg) requêtes simultanées, pywps
+répond ServerBusy : ces refus sont comptés à part et exclus des
+percentiles.
+Lancer depuis la racine du dépôt (pywps.cfg, outputs/).
+"""
+import argparse
+import json
+import os
+import resource
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+import numpy as np
+
+DEFAULT_BASELINE = os.path.join('bench', 'baseline.json')
+PROCESSES = ('moyenne_era5', 'evolution_temperature', 'impact_climatique', 'indices_climatiques',
+             'anomalies_climatiques', 'stats_regions', 'surface_agricole')
+
+
+def scenarios(names, times):
+    """(nom, processus, [entrées par requête]) ; les régions tournent d'une requête à l'autre."""
+    first = np.datetime_as_string(times[0], unit='D')
+    last = np.datetime_as_string(times[-1], unit='D')
+    month_end = np.datetime_as_string(
+        min(times[-1], times[0] + np.timedelta64(30, 'D')), unit='D')
+    one_region = lambda extra='': [f'region={quote(n)}{extra}' for n in names]
+    return [
+        ('moyenne_era5:t2m', 'moyenne_era5', ['variable=t2m']),
+        ('moyenne_era5:tp', 'moyenne_era5', ['variable=tp']),
+        ('moyenne_era5:t2m+region', 'moyenne_era5', one_region(';variable=t2m')),
+        ('evolution_temperature:mois', 'evolution_temperature',
+         one_region(f';date_debut={first};date_fin={month_end}')),
+        ('evolution_temperature:complet', 'evolution_temperature',
+         one_region(f';date_debut={first};date_fin={last}')),
+        ('evolution_temperature:complet+auto', 'evolution_temperature',
+         one_region(f';date_debut={first};date_fin={last};resolution=auto')),
+        ('impact_climatique', 'impact_climatique', one_region()),
+        ('impact_climatique:toutes', 'impact_climatique', ['region=*']),
+        ('indices_climatiques', 'indices_climatiques', one_region()),
+        ('indices_climatiques:mois', 'indices_climatiques',
+         one_region(f';date_debut={first};date_fin={month_end}')),
+        ('indices_climatiques:toutes', 'indices_climatiques', ['region=*']),
+        ('anomalies_climatiques', 'anomalies_climatiques', one_region()),
+        ('stats_regions', 'stats_regions', one_region()),
+        ('surface_agricole', 'surface_agricole', one_region()),
+    ]
+
+
+def execute_url(process, inputs):
+    return (f'/wps?service=WPS&version=1.0.0&request=Execute&identifier={process}'
+            f'&DataInputs={inputs}&RawDataOutput=output')
+
+
+def peak_rss_mb():
+    # ru_maxrss est en Ko sous Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def summarize(latencies, outcomes, wall):
+    """Percentiles sur les requêtes traitées ; les refus ServerBusy sont comptés à part."""
+    outcomes = np.asarray(outcomes)
+    ms = np.asarray(latencies)[outcomes != 'busy'] * 1000
+    if len(ms) == 0:
+        ms = np.array([np.nan])
+    return {
+        'requests': len(latencies),
+        'errors': int(np.sum(outcomes == 'error')),
+        'busy': int(np.sum(outcomes == 'busy')),
+        'p50_ms': round(float(np.percentile(ms, 50)), 2),
+        'p95_ms': round(float(np.percentile(ms, 95)), 2),
+        'p99_ms': round(float(np.percentile(ms, 99)), 2),
+        'rps': round(len(latencies) / wall, 2) if wall else None,
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+    }
+
+
+def _outcome(status, body):
+    """'ok', 'busy' (pywps au maximum de parallelprocesses) ou 'error'."""
+    if status != 200:
+        return 'busy' if b'ServerBusy' in body else 'error'
+    try:
+        result = json.loads(body)
+    except ValueError:
+        return 'error'
+    return 'error' if isinstance(result, dict) and 'error' in result else 'ok'
+
+
+def run_inprocess(app, process, inputs, n_requests, warmup):
+    client = app.test_client()
+    for i in range(warmup):
+        client.get(execute_url(process, inputs[i % len(inputs)]))
+    latencies, outcomes = [], []
+    start = time.perf_counter()
+    for i in range(n_requests):
+        t0 = time.perf_counter()
+        r = client.get(execute_url(process, inputs[i % len(inputs)]))
+        latencies.append(time.perf_counter() - t0)
+        outcomes.append(_outcome(r.status_code, r.get_data()))
+    return summarize(latencies, outcomes, time.perf_counter() - start)
+
+
+def _fetch(base, url):
+    t0 = time.perf_counter()
+    try:
+        with urllib.request.urlopen(base + url, timeout=300) as r:
+            status, body = r.status, r.read()
+    except urllib.error.HTTPError as e:
+        status, body = e.code, e.read()
+    except OSError:
+        status, body = 0, b''
+    return time.perf_counter() - t0, _outcome(status, body)
+
+
+def run_http(base, process, inputs, n_requests, concurrency, warmup):
+    urls = [execute_url(process, inputs[i % len(inputs)]) for i in range(n_requests)]
+    for url in urls[:warmup]:
+        _fetch(base, url)
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        start = time.perf_counter()
+        results = list(pool.map(lambda u: _fetch(base, u), urls))
+        wall = time.perf_counter() - start
+    return summarize([r[0] for r in results], [r[1] for r in results], wall)
+
+
+def start_http_server(app, port=0):
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    server = make_server('127.0.0.1', port, app, threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, name='bench-http', daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_port}'
+
+
+def compare(results, baseline, tolerance):
+    """Affiche l'écart à la référence ; retourne la liste des régressions."""
+    regressions = []
+    for key, res in results.items():
+        ref = baseline.get(key)
+        if not ref:
+            print(f"  {key:<52} (pas de référence)")
+            continue
+        deltas = []
+        for metric in ('p50_ms', 'p95_ms', 'p99_ms'):
+            if ref.get(metric):
+                delta = res[metric] / ref[metric] - 1
+                deltas.append(f"{metric[:3]} {delta:+.0%}")
+                if metric == 'p95_ms' and delta > tolerance:
+                    regressions.append(key)
+        print(f"  {key:<52} {'  '.join(deltas)}")
+    return regressions
+
+
+def print_result(key, res):
+    print(f"  {key:<52} p50 {res['p50_ms']:>9.1f} ms  p95 {res['p95_ms']:>9.1f} ms  "
+          f"p99 {res['p99_ms']:>9.1f} ms  {res['rps']:>8.1f} req/s  "
+          f"RSS {res['peak_rss_mb']:>7.1f} Mo  erreurs {res['errors']}  refus {res['busy']}")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='python -m bench.run', description="Benchmark des processus WPS")
+    parser.add_argument('--mode', choices=('inprocess', 'http', 'both'), default='both')
+    parser.add_argument('--process', nargs='+', choices=PROCESSES, default=list(PROCESSES))
+    parser.add_argument('--requests', type=int, default=30, help="Requêtes par scénario")
+    parser.add_argument('--concurrency', type=int, default=8, help="Clients simultanés (mode http)")
+    parser.add_argument('--warmup', type=int, default=2)
+    parser.add_argument('--cache', action='store_true', help="Laisse le cache de résultats actif")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true', help="Enregistre les résultats comme référence")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="Hausse du p95 tolérée avant de signaler une régression")
+    parser.add_argument('--output', help="Écrit les résultats JSON dans ce fichier")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    sys.path.insert(0, os.getcwd())
+    # Import tardif : WPS_DATA_DIR doit être positionné avant le catalogue
+    from pywps import configuration
+
+    from core.catalog import DATA_DIR, get_catalog
+    from core.regions import get_region_index
+    from server import app
+
+    if not args.cache:
+        configuration.CONFIG.set('cache', 'enabled', 'false')
+
+    names = get_region_index().names
+    selected = [s for s in scenarios(names, get_catalog().era5().times) if s[1] in args.process]
+    modes = ['inprocess', 'http'] if args.mode == 'both' else [args.mode]
+    print(f"Données : {DATA_DIR}  |  cache : {'actif' if args.cache else 'désactivé'}")
+
+    results = {}
+    server = base = None
+    for mode in modes:
+        label = mode if mode == 'inprocess' else f'http x{args.concurrency}'
+        print(f"\n== {label} ==")
+        if mode == 'http' and server is None:
+            server, base = start_http_server(app)
+        for name, process, inputs in selected:
+            if mode == 'inprocess':
+                res = run_inprocess(app, process, inputs, args.requests, args.warmup)
+            else:
+                res = run_http(base, process, inputs, args.requests, args.concurrency, args.warmup)
+            key = f'{mode}/{name}'
+            results[key] = res
+            print_result(key, res)
+    if server is not None:
+        server.shutdown()
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nRéférence enregistrée : {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        print(f"\n== Écart à la référence ({args.baseline}) ==")
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"⚠️ Régression p95 > {args.tolerance:.0%} : {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,166 @@
+"""Test de charge concurrente des lectures ERA5 (core/readers.py).
+
+Lance en même temps des requêtes `impact_climatique` et `moyenne_era5`
+(zones GeoJSON, qui relisent l'archive, et variables t2m / tp) sur un
+serveur Flask threadé. Chaque réponse est comparée à la même requête
+exécutée seule : une lecture corrompue par des accès HDF5 simultanés se
+voit comme un écart, une erreur ou un worker tombé. Le test est répété
+pour chaque nombre de processus lecteurs demandé :
+
+    python -m bench.stress --lecteurs 0 2 4 --concurrency 5 --requests 100
+    WPS_DATA_DIR=/tmp/wps-bench python -m bench.stress --lecteurs 0 4
+
+Avec un instantané binaire à jour (core/snapshot.py), les flux ERA5 sont
+lus sans HDF5 : utiliser des données sans instantané (bench.synthetic)
+pour mesurer le pool de lecteurs. Le cache de résultats est désactivé.
+Lancer depuis la racine du dépôt (pywps.cfg, outputs/).
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+import numpy as np
+
+from bench.run import execute_url, print_result, start_http_server, summarize
+
+# Demi-côté (degrés) des zones carrées centrées sur les régions
+ZONE_HALF_SIZE = 0.3
+
+
+def zone_inputs(index):
+    """Entrées 'zone' : un carré autour du centroïde de chaque région."""
+    inputs = []
+    for lon, lat in index.centroids:
+        d = ZONE_HALF_SIZE
+        ring = [[lon - d, lat - d], [lon + d, lat - d], [lon + d, lat + d], [lon - d, lat + d], [lon - d, lat - d]]
+        zone = json.dumps({'type': 'Polygon', 'coordinates': [ring]}, separators=(',', ':'))
+        inputs.append(f'variable=t2m;zone={quote(zone)}')
+    return inputs
+
+
+def requests_mix(index, times, n_requests):
+    """URLs des requêtes : impact_climatique et moyenne_era5 en alternance, fenêtres variées."""
+    names = index.names
+    first = np.datetime64(times[0], 'D')
+    span = max(int((np.datetime64(times[-1], 'D') - first).astype(int)), 1)
+    zones = zone_inputs(index)
+    urls = []
+    for i in range(n_requests):
+        debut = first + (i * 37) % span
+        fin = min(debut + 60, np.datetime64(times[-1], 'D'))
+        dates = f';date_debut={debut};date_fin={fin}'
+        kind = i % 4
+        if kind == 0:
+            urls.append(execute_url('impact_climatique', f'region={quote(names[i % len(names)])}{dates}'))
+        elif kind == 1:
+            urls.append(execute_url('moyenne_era5', zones[i % len(zones)] + dates))
+        elif kind == 2:
+            urls.append(execute_url('moyenne_era5', f'variable=tp{dates}'))
+        else:
+            urls.append(execute_url('moyenne_era5', zones[i % len(zones)]))
+    return urls
+
+
+def fetch(base, url):
+    """(durée, statut, corps) d'une requête."""
+    t0 = time.perf_counter()
+    try:
+        with urllib.request.urlopen(base + url, timeout=300) as r:
+            status, body = r.status, r.read()
+    except urllib.error.HTTPError as e:
+        status, body = e.code, e.read()
+    except OSError:
+        status, body = 0, b''
+    return time.perf_counter() - t0, status, body
+
+
+def outcome(status, body, expected):
+    """'ok', 'busy' (pywps au maximum de parallelprocesses), 'error' ou 'ecart' (réponse différente)."""
+    if status != 200:
+        return 'busy' if b'ServerBusy' in body else 'error'
+    try:
+        result = json.loads(body)
+    except ValueError:
+        return 'error'
+    if isinstance(result, dict) and 'error' in result:
+        return 'error'
+    return 'ok' if result == expected else 'ecart'
+
+
+def run(base, urls, reference, concurrency):
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        start = time.perf_counter()
+        results = list(pool.map(lambda u: fetch(base, u), urls))
+        wall = time.perf_counter() - start
+    outcomes = [outcome(status, body, reference[url]) for url, (_t, status, body) in zip(urls, results)]
+    res = summarize([r[0] for r in results], ['error' if o == 'ecart' else o for o in outcomes], wall)
+    res['ecarts'] = outcomes.count('ecart')
+    return res
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='python -m bench.stress',
+                                     description="Test de charge concurrente des lectures ERA5")
+    parser.add_argument('--lecteurs', type=int, nargs='+', default=[0, 2],
+                        help="Nombres de processus lecteurs à tester (0 : lecture sous verrou)")
+    parser.add_argument('--requests', type=int, default=60)
+    parser.add_argument('--concurrency', type=int, default=5, help="Clients simultanés")
+    parser.add_argument('--output', help="Écrit les résultats JSON dans ce fichier")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    sys.path.insert(0, os.getcwd())
+    # Import tardif : WPS_DATA_DIR doit être positionné avant le catalogue
+    from pywps import configuration
+
+    from core.catalog import DATA_DIR
+    from core.readers import reset_reader_pool
+    from core.regions import get_region_index
+    from core.snapshot import load_era5
+    from core.zonal import get_zonal
+    from server import app
+
+    configuration.CONFIG.set('cache', 'enabled', 'false')
+    index = get_region_index()
+    urls = requests_mix(index, get_zonal('t2m').times, args.requests)
+    print(f"Données : {DATA_DIR}  |  {len(urls)} requêtes  |  {args.concurrency} clients")
+    if load_era5('instant') is not None:
+        print("⚠️ Instantané binaire à jour : les flux ERA5 sont lus sans HDF5 ni pool de lecteurs")
+
+    server, base = start_http_server(app)
+    # Référence : chaque requête distincte exécutée seule, lecture dans le thread
+    configuration.CONFIG.set('era5', 'lecteurs', '0')
+    reference = {}
+    for url in dict.fromkeys(urls):
+        _t, status, body = fetch(base, url)
+        reference[url] = json.loads(body) if status == 200 else None
+
+    results = {}
+    for workers in args.lecteurs:
+        configuration.CONFIG.set('era5', 'lecteurs', str(workers))
+        reset_reader_pool()
+        # Démarrage des lecteurs hors mesure
+        fetch(base, urls[1 % len(urls)])
+        key = f'lecteurs={workers}'
+        results[key] = run(base, urls, reference, args.concurrency)
+        print_result(key, results[key])
+        print(f"  {'':<52} réponses différentes de la référence : {results[key]['ecarts']}")
+    reset_reader_pool()
+    server.shutdown()
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    return 1 if any(r['errors'] for r in results.values()) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
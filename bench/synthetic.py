@@ -0,0 +1,164 @@
+"""Générateur de données synthétiques pour les benchmarks.
+
+Produit un répertoire au format de data/ (Shapefile des régions, JSON
+agricole, cubes ERA5 instantané et cumulé) à utiliser via WPS_DATA_DIR :
+
+    python -m bench.synthetic /tmp/wps-bench --years 10 --resolution 0.1 --vertices 20000
+    python -m bench.synthetic /tmp/wps-hourly --step-hours 1
+    python -m bench.synthetic /tmp/wps-archive --years 30 --start-year 1995 --layout annual
+    WPS_DATA_DIR=/tmp/wps-bench python -m bench.run
+
+Les régions sont celles de data/regions.shp, densifiées jusqu'au nombre
+de sommets demandé (mêmes noms : le JSON agricole reste valable). Les
+cubes ERA5 couvrent l'emprise des régions ; ils sont écrits année par
+année pour ne jamais tenir l'archive complète en mémoire.
+"""
+import argparse
+import os
+import shutil
+import time
+
+import netCDF4
+import numpy as np
+import shapely
+
+from core.catalog import AGRI_FILE, REGIONS_FILE, _read_shapefile
+
+# Noms de fichiers attendus par core.catalog
+ERA5_NAMES = {
+    'instant': ('era5_maroc_2024_real.nc', 't2m', 'K', '2 metre temperature'),
+    'accum': ('data_stream-oper_stepType-accum.nc', 'tp', 'm', 'Total precipitation'),
+}
+# 'single' : un fichier par flux (noms historiques) ; 'annual' : data/era5/<flux>/<année>.nc
+LAYOUTS = ('single', 'annual')
+
+
+def densify_regions(gdf, vertices=None):
+    """Régions dont chaque polygone compte au moins `vertices` sommets."""
+    gdf = gdf.copy()
+    if vertices:
+        geoms = gdf.geometry.values
+        lengths = shapely.length(geoms)
+        gdf['geometry'] = shapely.segmentize(geoms, np.maximum(lengths / vertices, 1e-6))
+    return gdf
+
+
+def _grid(bounds, resolution):
+    minx, miny, maxx, maxy = bounds
+    lats = np.arange(np.ceil(maxy / resolution), np.floor(miny / resolution) - 1, -1) * resolution
+    lons = np.arange(np.floor(minx / resolution), np.ceil(maxx / resolution) + 1) * resolution
+    return lats, lons
+
+
+def _year_times(year, step_hours):
+    """Pas de temps d'une année : midi pour un pas journalier (comme les fichiers CDS), sinon toutes les step_hours."""
+    if step_hours >= 24:
+        days = np.arange(f'{year}-01-01', f'{year + 1}-01-01', dtype='datetime64[D]')
+        return days.astype('datetime64[s]') + np.timedelta64(12, 'h')
+    return np.arange(f'{year}-01-01T00', f'{year + 1}-01-01T00', np.timedelta64(step_hours, 'h'),
+                     dtype='datetime64[h]').astype('datetime64[s]')
+
+
+def _year_values(var_name, times, lats, rng):
+    """Champ plausible (saison + cycle diurne + gradient nord-sud + bruit) pour une année."""
+    days = times.astype('datetime64[D]')
+    doy = (days - times.astype('datetime64[Y]')).astype(np.int64)
+    hours = (times - days).astype('timedelta64[h]').astype(np.int64)
+    season = np.sin(2 * np.pi * (doy - 105) / 365.25)[:, None, None]
+    lat = lats[None, :, None]
+    shape = (len(times), len(lats), 1)
+    if var_name == 't2m':
+        diurnal = 6.0 * np.sin(2 * np.pi * (hours - 9) / 24)[:, None, None]
+        base = 295.0 + 10.0 * season + diurnal - 0.4 * (lat - 30.0)
+        return (base + rng.normal(0, 2.5, shape)).astype(np.float32)
+    # Pluie (m sur l'heure précédente, comme ERA5 du CDS) : rare, plus fréquente au nord et en hiver
+    wet = rng.random(shape) < np.clip(0.25 - 0.15 * season + 0.02 * (lat - 30.0), 0.02, 0.6)
+    return (wet * rng.gamma(0.8, 0.004 / 24, shape)).astype(np.float32)
+
+
+def stream_type(var_name):
+    return next(stream for stream, names in ERA5_NAMES.items() if names[1] == var_name)
+
+
+def write_era5(path, var_name, units, long_name, lats, lons, start_year, years, seed, step_hours=24):
+    rng = np.random.default_rng(seed)
+    with netCDF4.Dataset(path, 'w', format='NETCDF4') as nc:
+        nc.createDimension('valid_time', None)
+        nc.createDimension('latitude', len(lats))
+        nc.createDimension('longitude', len(lons))
+        t = nc.createVariable('valid_time', 'i8', ('valid_time',))
+        t.units = 'seconds since 1970-01-01'
+        t.calendar = 'proleptic_gregorian'
+        nc.createVariable('latitude', 'f8', ('latitude',))[:] = lats
+        nc.createVariable('longitude', 'f8', ('longitude',))[:] = lons
+        var = nc.createVariable(var_name, 'f4', ('valid_time', 'latitude', 'longitude'),
+                                zlib=True, complevel=1,
+                                chunksizes=(1, len(lats), len(lons)))
+        var.units = units
+        var.long_name = long_name
+        var.GRIB_stepType = stream_type(var_name)
+        offset = 0
+        for year in range(start_year, start_year + years):
+            times = _year_times(year, step_hours)
+            shape = (len(times), len(lats), len(lons))
+            values = _year_values(var_name, times, lats, rng)
+            if var_name == 't2m':
+                # Variabilité locale d'un pixel à l'autre
+                values = values + rng.normal(0, 0.3, shape).astype(np.float32)
+            else:
+                values = np.broadcast_to(values, shape)
+            t[offset:offset + len(times)] = times.astype(np.int64)
+            var[offset:offset + len(times)] = values
+            offset += len(times)
+
+
+def generate(out_dir, years=1, start_year=2024, resolution=0.25, vertices=None, seed=0, step_hours=24,
+             layout='single'):
+    """Écrit un jeu de données complet dans out_dir et retourne la liste des fichiers."""
+    os.makedirs(out_dir, exist_ok=True)
+    gdf = densify_regions(_read_shapefile(REGIONS_FILE), vertices)
+    regions_path = os.path.join(out_dir, 'regions.shp')
+    gdf.to_file(regions_path, encoding='utf-8')
+    agri_path = os.path.join(out_dir, os.path.basename(AGRI_FILE))
+    shutil.copyfile(AGRI_FILE, agri_path)
+
+    lats, lons = _grid(gdf.total_bounds, resolution)
+    written = [regions_path, agri_path]
+    for k, (stream, (name, var_name, units, long_name)) in enumerate(ERA5_NAMES.items()):
+        if layout == 'single':
+            path = os.path.join(out_dir, name)
+            write_era5(path, var_name, units, long_name, lats, lons, start_year, years, seed + k, step_hours)
+            written.append(path)
+            continue
+        os.makedirs(os.path.join(out_dir, 'era5', stream), exist_ok=True)
+        for year in range(start_year, start_year + years):
+            path = os.path.join(out_dir, 'era5', stream, f'{year}.nc')
+            write_era5(path, var_name, units, long_name, lats, lons, year, 1, seed + k * 10000 + year, step_hours)
+            written.append(path)
+    return written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m bench.synthetic',
+                                     description="Génère un jeu de données synthétique (format data/)")
+    parser.add_argument('out_dir')
+    parser.add_argument('--years', type=int, default=1, help="Nombre d'années (défaut : %(default)s)")
+    parser.add_argument('--start-year', type=int, default=2024)
+    parser.add_argument('--step-hours', type=int, default=24, help="Pas de temps en heures (défaut : journalier)")
+    parser.add_argument('--resolution', type=float, default=0.25, help="Pas de grille en degrés")
+    parser.add_argument('--vertices', type=int, default=None,
+                        help="Sommets minimum par région (défaut : géométries d'origine)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--layout', choices=LAYOUTS, default='single',
+                        help="Un fichier par flux ou un fichier par année sous era5/<flux>/")
+    args = parser.parse_args(argv)
+
+    t0 = time.time()
+    for path in generate(args.out_dir, args.years, args.start_year, args.resolution,
+                         args.vertices, args.seed, args.step_hours, args.layout):
+        print(f"✅ {path} ({os.path.getsize(path) / 1024 ** 2:.1f} Mo)")
+    print(f"Terminé en {time.time() - t0:.1f} s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+"""Archive ERA5 multi-fichiers vue comme un seul cube logique.
+
+Un flux ERA5 ('instant', 'accum') est formé du fichier historique de
+data/ (s'il existe) et de tous les NetCDF rangés sous data/era5/<flux>/
+(un fichier par année ou par mois, sous-dossiers acceptés) :
+
+    data/era5/instant/2023.nc
+    data/era5/instant/2025/01.nc
+    data/era5/accum/2023.nc
+
+À l'ouverture, seuls les en-têtes et l'axe temps de chaque fichier sont
+lus. Les valeurs sont ensuite lues par blocs d'au plus BLOCK_STEPS pas de
+temps (`iter_blocks`) : les réductions parcourent l'archive sans jamais
+la charger en entier. Si plusieurs fichiers couvrent le même instant, le
+dernier de la liste l'emporte (data/era5/ prime sur le fichier historique).
+
+Chaque instant garde l'identifiant du fichier qui le fournit, dans son état
+(chemin, mtime, taille) : `source_ids()` permet aux données dérivées de
+ne recalculer que les instants apportés ou modifiés par de nouveaux
+fichiers (core/incremental.py).
+"""
+import hashlib
+import os
+from collections import namedtuple
+
+import numpy as np
+
+from core.readers import open_source, read_blocks
+
+# Pas de temps lus à la fois (~32 Mo en float32 sur la grille 0,25° du Maroc)
+BLOCK_STEPS = 2048
+
+Part = namedtuple('Part', 'path variables local glob')
+Header = namedtuple('Header', 'times variables lats lons attrs')
+
+
+def file_state(path):
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size
+
+
+def stable_id(*parts):
+    """Entier 64 bits d'une suite de valeurs, identique d'un processus à l'autre."""
+    digest = hashlib.sha1(repr(parts).encode('utf-8')).digest()
+    return np.frombuffer(digest[:8], dtype=np.int64)[0]
+
+
+def combine_ids(ids, other):
+    """Identifiants (int64) combinés élément par élément avec `other` (tableau ou scalaire)."""
+    a = np.asarray(ids, dtype=np.int64).view(np.uint64)
+    b = np.asarray(other, dtype=np.int64).view(np.uint64)
+    return (a * np.uint64(0x9E3779B97F4A7C15) ^ b).view(np.int64)
+
+
+def read_header(stream, path):
+    """En-tête d'un fichier du flux : axe temps, attributs des variables, grille."""
+    with open_source(stream, path) as ds:
+        return Header(ds['time'].values.astype('datetime64[ns]'),
+                      {name: dict(ds[name].attrs) for name in ds.data_vars},
+                      ds['latitude'].values, ds['longitude'].values, dict(ds.attrs))
+
+
+class Era5Archive:
+    """Cube logique (temps, latitude, longitude) d'un flux ERA5 réparti en fichiers.
+
+    `headers` ({chemin: (état, Header)}, ex. ceux d'une version précédente
+    de l'archive) évite de rouvrir les fichiers inchangés.
+    """
+
+    def __init__(self, stream, paths, headers=None):
+        self.stream = stream
+        self.paths = list(paths)
+        if not self.paths:
+            raise FileNotFoundError(f"Aucun fichier ERA5 pour le flux '{stream}'")
+
+        self.headers = {}
+        for path in self.paths:
+            state = file_state(path)
+            cached = (headers or {}).get(path)
+            header = cached[1] if cached is not None and cached[0] == state else read_header(stream, path)
+            if not self.headers:
+                self.lats, self.lons, self.attrs = header.lats, header.lons, header.attrs
+            elif not (np.array_equal(header.lats, self.lats) and np.array_equal(header.lons, self.lons)):
+                raise ValueError(f"Grille ERA5 différente dans {path}")
+            self.headers[path] = (state, header)
+        headers = [self.headers[path][1] for path in self.paths]
+
+        # Axe temps global : instants triés, le fichier le plus loin dans la liste gagne
+        times = np.concatenate([h.times for h in headers])
+        part_ids = np.concatenate([np.full(len(h.times), k) for k, h in enumerate(headers)])
+        local = np.concatenate([np.arange(len(h.times)) for h in headers])
+        order = np.lexsort((-part_ids, times))
+        _, first = np.unique(times[order], return_index=True)
+        keep = order[first]
+        self.times = times[keep]
+
+        self.parts = []
+        for k, (path, header) in enumerate(zip(self.paths, headers)):
+            mine = np.flatnonzero(part_ids[keep] == k)
+            self.parts.append(Part(path, header.variables, local[keep][mine], mine))
+        self.variables = {}
+        for part in self.parts:
+            for name, attrs in part.variables.items():
+                self.variables.setdefault(name, attrs)
+        file_ids = np.array([stable_id(os.path.normpath(path), *self.headers[path][0]) for path in self.paths])
+        self._source_ids = file_ids[part_ids[keep]]
+
+    @property
+    def data_vars(self):
+        return list(self.variables)
+
+    def source_ids(self, var_name=None):
+        """Identifiant (int64) du fichier, dans son état actuel, qui fournit chaque instant."""
+        return self._source_ids
+
+    def iter_blocks(self, var_name, sl=slice(None), block_steps=BLOCK_STEPS, window=None):
+        """Blocs (indices globaux, valeurs (temps, lat, lon)) de la tranche `sl` de l'axe temps.
+
+        `window` = (tranche de latitudes, tranche de longitudes) limite la
+        lecture à une fenêtre de la grille. Les blocs sont lus par
+        core.readers (pool de processus lecteurs s'il est actif).
+        """
+        start, stop, _ = sl.indices(len(self.times))
+        tasks, targets = [], []
+        for part in self.parts:
+            if var_name not in part.variables:
+                continue
+            inside = (part.glob >= start) & (part.glob < stop)
+            if not inside.any():
+                continue
+            local, glob_idx = part.local[inside], part.glob[inside]
+            for i in range(0, len(local), block_steps):
+                idx = local[i:i + block_steps]
+                # Tranche contiguë si possible (lecture NetCDF plus efficace)
+                if idx[-1] - idx[0] == len(idx) - 1:
+                    times = slice(int(idx[0]), int(idx[-1]) + 1)
+                else:
+                    times = idx
+                tasks.append((self.stream, part.path, var_name, times, window))
+                targets.append(glob_idx[i:i + block_steps])
+        yield from zip(targets, read_blocks(tasks))
+
+
+def period_label(times):
+    """Libellé de période : '2024', '2020-2024' pour des années complètes, sinon 'début/fin'."""
+    if len(times) == 0:
+        return ''
+    first = np.datetime64(times[0], 'D')
+    last = np.datetime64(times[-1], 'D')
+    y0, y1 = first.astype('datetime64[Y]'), last.astype('datetime64[Y]')
+    if first == y0.astype('datetime64[D]') and last + 1 == (y1 + 1).astype('datetime64[D]'):
+        return str(y0) if y0 == y1 else f'{y0}-{y1}'
+    return f'{first}/{last}'
@@ -0,0 +1,177 @@
+"""Cache des résultats Execute.
+
+Les sorties des processus sont des fonctions déterministes des entrées et
+des fichiers de data/. La clé de cache combine donc l'identifiant du
+processus, les entrées normalisées et l'empreinte des fichiers sources
+et des réglages qui changent les résultats (DataCatalog.version()) :
+toute modification de data/, du cube fusionné, de l'instantané ou des
+sections [memoire] / [era5] concernées invalide le cache.
+
+Deux niveaux : un LRU borné en mémoire, puis (optionnel) un répertoire
+sur disque sous outputs/, partitionné par version des données.
+"""
+import functools
+import hashlib
+import json
+import os
+import shutil
+import threading
+from collections import OrderedDict
+
+from pywps import configuration
+
+from core import metrics
+from core.catalog import get_catalog
+from core.regions import normalize_name
+
+# Entrées qui n'influencent pas le résultat calculé
+IGNORED_INPUTS = {'debug_timings'}
+# Entrées dont la valeur est un nom de région (normalisé dans la clé)
+REGION_INPUTS = {'region'}
+
+
+def _config(option, default):
+    value = configuration.get_config_value('cache', option, default)
+    return default if value == '' else value
+
+
+class ResultCache:
+    """LRU en mémoire + niveau disque optionnel, clés liées à la version des données."""
+
+    def __init__(self, max_items=256, disk_path=None):
+        self.max_items = int(max_items)
+        self.disk_path = disk_path
+        self._lock = threading.Lock()
+        self._items = OrderedDict()
+        self._version = None
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _normalize(name, values):
+        if name in REGION_INPUTS:
+            return [normalize_name(v) for v in values]
+        return [str(v).strip() for v in values]
+
+    def key(self, process_id, inputs):
+        """Clé stable pour (processus, entrées, version des fichiers data/)."""
+        version = self._data_version()
+        normalized = {
+            name: self._normalize(name, [inp.data for inp in values])
+            for name, values in sorted(inputs.items()) if name not in IGNORED_INPUTS
+        }
+        raw = json.dumps([process_id, normalized], sort_keys=True, ensure_ascii=False)
+        return version + '-' + hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def _data_version(self):
+        raw = json.dumps(get_catalog().version())
+        version = hashlib.sha256(raw.encode('utf-8')).hexdigest()[:16]
+        if version != self._version:
+            # data/ a changé : on vide la mémoire et les anciennes partitions disque
+            with self._lock:
+                if version != self._version:
+                    self._items.clear()
+                    self._purge_disk(keep=version)
+                    self._version = version
+        return version
+
+    def _disk_file(self, key):
+        version, digest = key.split('-', 1)
+        return os.path.join(self.disk_path, version, digest + '.json')
+
+    def _purge_disk(self, keep):
+        if not self.disk_path or not os.path.isdir(self.disk_path):
+            return
+        for name in os.listdir(self.disk_path):
+            if name != keep:
+                shutil.rmtree(os.path.join(self.disk_path, name), ignore_errors=True)
+
+    def get(self, key):
+        with self._lock:
+            payload = self._items.get(key)
+            if payload is not None:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return payload
+        if self.disk_path:
+            try:
+                with open(self._disk_file(key), 'r', encoding='utf-8') as f:
+                    payload = f.read()
+            except FileNotFoundError:
+                payload = None
+            if payload is not None:
+                self._remember(key, payload)
+                self.hits += 1
+                return payload
+        self.misses += 1
+        return None
+
+    def put(self, key, payload):
+        self._remember(key, payload)
+        if self.disk_path:
+            path = self._disk_file(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                f.write(payload)
+            os.replace(tmp, path)
+
+    def _remember(self, key, payload):
+        with self._lock:
+            self._items[key] = payload
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._purge_disk(keep=None)
+
+
+_CACHE = None
+
+
+def get_result_cache():
+    """Cache partagé, configuré par la section [cache] de pywps.cfg."""
+    global _CACHE
+    if _CACHE is None:
+        disk = _config('disk', False)
+        _CACHE = ResultCache(
+            max_items=_config('memory_items', 256),
+            disk_path=_config('disk_path', 'outputs/cache') if disk else None)
+    return _CACHE
+
+
+def _is_error(payload):
+    try:
+        result = json.loads(payload)
+    except (TypeError, ValueError):
+        return True
+    return isinstance(result, dict) and 'error' in result
+
+
+def cached_execute(handler):
+    """Décorateur de `_handler` : renvoie le JSON mis en cache si les entrées et data/ sont identiques."""
+    @functools.wraps(handler)
+    def wrapper(self, request, response):
+        if not _config('enabled', True):
+            return handler(self, request, response)
+        metrics.mark_stage('cache')
+        cache = get_result_cache()
+        key = cache.key(self.identifier, request.inputs)
+        payload = cache.get(key)
+        metrics.record_cache(payload is not None)
+        if payload is not None:
+            response.outputs['output'].data = payload
+            return response
+        metrics.mark_stage(metrics.FIRST_STAGE)
+        response = handler(self, request, response)
+        payload = response.outputs['output'].data
+        if isinstance(payload, bytes):
+            payload = payload.decode('utf-8')
+        # Les erreurs ne sont jamais mises en cache
+        if not _is_error(payload):
+            cache.put(key, payload)
+        return response
+    return wrapper
@@ -0,0 +1,417 @@
+"""Catalogue de données partagé par les processus WPS.
+
+Chaque fichier de data/ (Shapefile des régions, JSON agricole, cubes ERA5)
+est lu une seule fois par processus serveur puis gardé en mémoire. À chaque
+accès on compare la date de modification des fichiers : si elle a changé,
+la donnée est rechargée. Les processus reçoivent des vues en lecture seule.
+
+Si l'instantané binaire de data/snapshot/ (voir core/snapshot.py) est à
+jour, les régions et les flux ERA5 sont relus depuis celui-ci, sans GDAL
+ni NetCDF. Les bibliothèques lourdes (geopandas, xarray) ne sont
+importées qu'au premier chargement qui en a besoin.
+
+Les objets dérivés (séries réduites, climatologies...) sont plafonnés par
+le budget mémoire de pywps.cfg (voir core/memory.py) : au-delà, les moins
+récemment utilisés sont libérés et recalculés à la demande.
+
+Une fois que l'ingestion incrémentale (core/incremental.py) a publié la
+liste des fichiers ERA5 d'un flux, seuls ces fichiers sont lus : un
+fichier déposé dans data/ n'est vu qu'après son intégration.
+"""
+import glob
+import hashlib
+import json
+import os
+import threading
+import time
+from types import MappingProxyType
+
+from core.memory import budget_bytes, encoding, footprint
+
+DATA_DIR = os.environ.get('WPS_DATA_DIR', 'data')
+
+REGIONS_FILE = os.path.join(DATA_DIR, 'regions.shp')
+AGRI_FILE = os.path.join(DATA_DIR, 'agriculture_maroc_2024.json')
+
+# Cubes ERA5 : variables instantanées (t2m) et cumulées (tp)
+ERA5_FILES = {
+    'instant': os.path.join(DATA_DIR, 'era5_maroc_2024_real.nc'),
+    'accum': os.path.join(DATA_DIR, 'data_stream-oper_stepType-accum.nc'),
+}
+
+# Archive multi-fichiers : data/era5/<flux>/**/*.nc (voir core/archive.py)
+ERA5_ARCHIVE_DIR = os.path.join(DATA_DIR, 'era5')
+
+# Cubes ERA5 réécrits pour la lecture de séries temporelles (voir core/store.py)
+STORE_DIR = os.path.join(DATA_DIR, 'store')
+# Cube fusionné température + précipitations désaccumulées (voir core/cube.py)
+CUBE_FILE = os.path.join(STORE_DIR, 'era5_climat.nc')
+# Instantané binaire pour un démarrage rapide (voir core/snapshot.py)
+SNAPSHOT_DIR = os.path.join(DATA_DIR, 'snapshot')
+
+# Fichiers annexes du Shapefile à surveiller en plus du .shp
+SHAPEFILE_SIDECARS = ('.dbf', '.shx', '.prj', '.cpg')
+
+
+def _signature(paths, optional=()):
+    """Empreinte (mtime, taille) d'un groupe de fichiers, None si un fichier requis manque."""
+    sig = []
+    for p in paths:
+        try:
+            st = os.stat(p)
+        except FileNotFoundError:
+            if p.endswith(SHAPEFILE_SIDECARS) or p in optional:
+                continue
+            return None
+        sig.append((p, st.st_mtime_ns, st.st_size))
+    return tuple(sig)
+
+
+def signature_digest(signatures):
+    """Empreinte courte d'une suite de signatures de fichiers."""
+    return hashlib.sha1(repr(tuple(signatures)).encode('utf-8')).hexdigest()[:16]
+
+
+def era5_store_path(stream):
+    return os.path.join(STORE_DIR, f'era5_{stream}.nc')
+
+
+def era5_list_path(stream):
+    """Liste des fichiers du flux publiée par l'ingestion incrémentale."""
+    return os.path.join(STORE_DIR, f'era5_{stream}_fichiers.json')
+
+
+def discover_era5_paths(stream):
+    """Fichiers du flux présents dans data/ : fichier historique puis data/era5/<flux>/ trié par chemin."""
+    paths = [ERA5_FILES[stream]] if os.path.exists(ERA5_FILES[stream]) else []
+    pattern = os.path.join(ERA5_ARCHIVE_DIR, stream, '**', '*.nc')
+    paths.extend(sorted(glob.glob(pattern, recursive=True)))
+    return paths
+
+
+# Listes publiées déjà lues : flux -> (état du fichier liste, {chemin: (mtime, taille)})
+_published = {}
+
+
+def published_era5_files(stream):
+    """{chemin: (mtime_ns, taille)} des fichiers publiés du flux, None sans liste publiée."""
+    path = era5_list_path(stream)
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    state = (st.st_mtime_ns, st.st_size)
+    cached = _published.get(stream)
+    if cached is None or cached[0] != state:
+        with open(path, 'r', encoding='utf-8') as f:
+            files = {item['chemin']: (item['mtime_ns'], item['taille']) for item in json.load(f)['fichiers']}
+        cached = _published[stream] = (state, files)
+    return cached[1]
+
+
+def era5_paths(stream):
+    """Fichiers du flux : liste publiée par l'ingestion incrémentale, sinon ceux de data/."""
+    published = published_era5_files(stream)
+    if published is None:
+        return discover_era5_paths(stream)
+    return [p for p in published if os.path.exists(p)]
+
+
+def regions_paths():
+    base = os.path.splitext(REGIONS_FILE)[0]
+    return [REGIONS_FILE] + [base + ext for ext in SHAPEFILE_SIDECARS]
+
+
+def source_paths(key):
+    """(fichiers, fichiers facultatifs) surveillés pour la source 'regions' ou ('era5', flux)."""
+    if key == 'regions':
+        return regions_paths(), ()
+    if isinstance(key, tuple) and key[0] == 'era5':
+        # Tous les fichiers de l'archive, plus le stockage rechunké (data/store/)
+        stream = key[1]
+        store = era5_store_path(stream)
+        return (era5_paths(stream) or [ERA5_FILES[stream]]) + [store], (store,)
+    raise KeyError(key)
+
+
+def _freeze(obj):
+    """Copie en lecture seule d'une structure JSON (dict -> mappingproxy, list -> tuple)."""
+    if isinstance(obj, dict):
+        return MappingProxyType({k: _freeze(v) for k, v in obj.items()})
+    if isinstance(obj, list):
+        return tuple(_freeze(v) for v in obj)
+    return obj
+
+
+class RegionLayer:
+    """Polygones des régions (tableau shapely, EPSG:4326) et leurs attributs.
+
+    `arrays` porte les superficies, emprises et centroïdes précalculés de
+    l'instantané (None si la couche vient du Shapefile).
+    """
+
+    def __init__(self, geometries, records, arrays=None):
+        self.geometries = geometries
+        self.records = records
+        self.arrays = arrays
+
+    def __len__(self):
+        return len(self.records)
+
+    def column(self, name, default=None):
+        return [r.get(name, default) for r in self.records]
+
+    def frame(self):
+        """GeoDataFrame équivalent (nouvelle copie à chaque appel)."""
+        # Import local : geopandas (et pandas) ne sont chargés qu'à la demande
+        import geopandas as gpd
+        return gpd.GeoDataFrame(list(self.records), geometry=list(self.geometries), crs='EPSG:4326')
+
+
+def _read_shapefile(path):
+    # Import local : geopandas (et GDAL) ne sont chargés que sans instantané à jour
+    import geopandas as gpd
+    gdf = gpd.read_file(path)
+    # Nettoyage des noms de colonnes (espaces parasites dans le .dbf)
+    gdf.columns = [c.strip() for c in gdf.columns]
+    if gdf.crs is None:
+        gdf = gdf.set_crs('EPSG:4326')
+    elif gdf.crs.to_epsg() != 4326:
+        gdf = gdf.to_crs('EPSG:4326')
+    return gdf
+
+
+def _load_regions(path):
+    # Import local : core.snapshot dépend des constantes de ce module
+    from core.snapshot import load_regions
+    layer = load_regions()
+    if layer is None:
+        gdf = _read_shapefile(path)
+        layer = RegionLayer(gdf.geometry.to_numpy(), gdf.drop(columns='geometry').to_dict('records'))
+    return layer
+
+
+def _load_agri(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return _freeze(json.load(f))
+
+
+def normalize_era5(ds):
+    """Harmonise les dimensions des fichiers ERA5 issus du CDS."""
+    # Les nouveaux fichiers CDS utilisent 'valid_time' au lieu de 'time'
+    if 'valid_time' in ds.variables or 'valid_time' in ds.coords:
+        ds = ds.rename({'valid_time': 'time'})
+    # Si 'expver' est une dimension, on garde la première version (données consolidées)
+    if 'expver' in ds.dims:
+        ds = ds.isel(expver=0)
+    return ds
+
+
+def _existing_path(path):
+    return path if os.path.exists(path) else None
+
+
+def _load_era5(arg):
+    # Import local : core.archive et core.snapshot dépendent des constantes de ce module
+    from core.archive import Era5Archive
+    from core.snapshot import load_era5
+    stream, paths, headers = arg
+    archive = load_era5(stream)
+    return archive if archive is not None else Era5Archive(stream, paths, headers)
+
+
+class _Entry:
+    __slots__ = ('signature', 'value', 'nbytes', 'used')
+
+    def __init__(self, signature, value):
+        self.signature = signature
+        self.value = value
+        self.nbytes = 0
+        self.used = time.monotonic()
+
+
+def _label(key):
+    parts = key if isinstance(key, tuple) else (key,)
+    return '/'.join(_label(p) if isinstance(p, tuple) else str(p) for p in parts if p is not None)
+
+
+class DataCatalog:
+    """Cache des jeux de données de data/, invalidé sur changement de mtime."""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._entries = {}
+        # Objets dérivés libérés pour tenir le budget mémoire
+        self.evictions = 0
+
+    def _get(self, key, paths, loader, arg=None, optional=()):
+        sig = _signature(paths, optional)
+        if sig is None:
+            raise FileNotFoundError(f"Fichier introuvable : {paths[0]}")
+        entry = self._entries.get(key)
+        if entry is not None and entry.signature == sig:
+            return entry.value
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.signature != sig:
+                entry = _Entry(sig, loader(paths[0] if arg is None else arg))
+                self._entries[key] = entry
+            return entry.value
+
+    def derived(self, key, sources, builder, update=None):
+        """Objet calculé à partir de sources du catalogue (ex. index des régions).
+
+        `sources` est une liste de clés ('regions', 'agri', ('era5', flux), 'cube') ;
+        `builder` reçoit les valeurs correspondantes. Le résultat est gardé
+        tant que les fichiers sources ne changent pas. Quand ils changent,
+        `update(ancienne valeur, *valeurs)`, s'il est fourni, remplace
+        `builder` : mise à jour incrémentale plutôt que recalcul complet.
+        Les requêtes voient l'ancienne valeur jusqu'au remplacement.
+        """
+        values = [self._source(s) for s in sources]
+        sig = tuple(self._entries[s].signature for s in sources)
+        entry = self._entries.get(('derived', key))
+        if entry is not None and entry.signature == sig:
+            entry.used = time.monotonic()
+            return entry.value
+        with self._lock:
+            entry = self._entries.get(('derived', key))
+            if entry is None or entry.signature != sig:
+                value = builder(*values) if entry is None or update is None else update(entry.value, *values)
+                entry = _Entry(sig, value)
+                entry.nbytes = footprint(entry.value, self._shared(entry.value))[0]
+                self._entries[('derived', key)] = entry
+                self._trim(('derived', key))
+            return entry.value
+
+    def _shared(self, value):
+        """Objets atteints depuis les autres données (déjà comptés dans leur empreinte)."""
+        seen = set()
+        for entry in list(self._entries.values()):
+            if entry.value is not value:
+                footprint(entry.value, seen)
+        return seen
+
+    def _trim(self, keep):
+        """Libère les objets dérivés les moins récemment utilisés au-delà du budget."""
+        budget = budget_bytes()
+        if not budget:
+            return
+        derived = [(k, e) for k, e in self._entries.items() if isinstance(k, tuple) and k[0] == 'derived']
+        total = sum(e.nbytes for _k, e in derived)
+        for k, e in sorted(derived, key=lambda item: item[1].used):
+            if total <= budget:
+                break
+            if k != keep:
+                del self._entries[k]
+                total -= e.nbytes
+                self.evictions += 1
+
+    def footprints(self):
+        """(libellé, dérivé, octets en mémoire, octets mappés, fichiers mappés) de chaque donnée chargée."""
+        with self._lock:
+            entries = list(self._entries.items())
+        # Sources d'abord : un objet partagé est compté pour la donnée dont il provient
+        entries.sort(key=lambda item: isinstance(item[0], tuple) and item[0][0] == 'derived')
+        result, seen = [], set()
+        for key, entry in entries:
+            if entry.value is None or isinstance(entry.value, str):
+                # Chemin de fichier (cube fusionné) : rien en mémoire
+                continue
+            derived = isinstance(key, tuple) and key[0] == 'derived'
+            heap, mapped, files = footprint(entry.value, seen)
+            result.append((_label(key[1] if derived else key), derived, heap, mapped, files))
+        return result
+
+    def fingerprint(self, sources):
+        """Empreinte courte des fichiers derrière `sources` (pour les caches écrits sur disque)."""
+        for s in sources:
+            self._source(s)
+        return signature_digest(self._entries[s].signature for s in sources)
+
+    def _source(self, key):
+        if key == 'regions':
+            return self._get('regions', regions_paths(), _load_regions)
+        if key == 'agri':
+            return self._get('agri', [AGRI_FILE], _load_agri)
+        if key == 'cube':
+            # Chemin du cube fusionné de data/store/ (None s'il n'a pas été écrit)
+            return self._get('cube', [CUBE_FILE], _existing_path, optional=(CUBE_FILE,))
+        if isinstance(key, tuple) and key[0] == 'era5':
+            paths, optional = source_paths(key)
+            # En-têtes des fichiers déjà ouverts : seuls les fichiers nouveaux ou modifiés sont relus
+            previous = self._entries.get(key)
+            headers = getattr(previous.value, 'headers', None) if previous is not None else None
+            return self._get(key, paths, _load_era5, arg=(key[1], paths[:-1], headers), optional=optional)
+        raise KeyError(key)
+
+    def regions(self):
+        """GeoDataFrame des régions (copie, le cache reste intact)."""
+        return self._source('regions').frame()
+
+    def region_layer(self):
+        """Couche des régions partagée (RegionLayer), sans geopandas."""
+        return self._source('regions')
+
+    def agriculture(self):
+        """Données agricoles par région, en lecture seule."""
+        return self._source('agri')
+
+    def era5(self, stream='instant'):
+        """Archive ERA5 du flux (core.archive.Era5Archive, en-têtes lus une seule fois)."""
+        return self._source(('era5', stream))
+
+    def stream_for(self, var_name):
+        """Nom du flux ERA5 ('instant', 'accum') qui contient la variable, ou None."""
+        for stream in ERA5_FILES:
+            if era5_paths(stream) and var_name in self._source(('era5', stream)).variables:
+                return stream
+        return None
+
+    def era5_for(self, var_name):
+        """Archive ERA5 contenant la variable demandée, ou None."""
+        stream = self.stream_for(var_name)
+        return None if stream is None else self.era5(stream)
+
+    def era5_variables(self):
+        variables = []
+        for stream in ERA5_FILES:
+            if era5_paths(stream):
+                variables.extend(self.era5(stream).data_vars)
+        return variables
+
+    def version(self):
+        """Empreinte de tout ce qui change les résultats des processus.
+
+        Fichiers sources de data/, cube fusionné et manifeste de
+        l'instantané binaire (réécrit à chaque instantané, float32 ou
+        int16), plus l'encodage [memoire] et l'accumulation [era5] de
+        pywps.cfg.
+        """
+        # Import local : core.cube et core.snapshot dépendent du catalogue
+        from core.cube import accumulation_settings
+        from core.snapshot import MANIFEST_FILE
+        paths = regions_paths() + [AGRI_FILE, CUBE_FILE, MANIFEST_FILE]
+        for stream in ERA5_FILES:
+            paths += era5_paths(stream)
+        files = _signature([p for p in paths if os.path.exists(p)])
+        try:
+            settings = [encoding(), accumulation_settings()]
+        except ValueError as e:
+            # Réglage invalide : erreur renvoyée par le processus, pas par la clé de cache
+            settings = str(e)
+        return files, settings
+
+
+_CATALOG = None
+_CATALOG_LOCK = threading.Lock()
+
+
+def get_catalog():
+    """Catalogue unique du processus serveur."""
+    global _CATALOG
+    if _CATALOG is None:
+        with _CATALOG_LOCK:
+            if _CATALOG is None:
+                _CATALOG = DataCatalog()
+    return _CATALOG
@@ -0,0 +1,152 @@
+"""Climatologies régionales et anomalies.
+
+La climatologie d'une variable est, pour chaque région, la valeur moyenne
+de chaque mois calendaire (ou de chaque jour de l'année) sur une période
+de référence, dont on peut retirer une fenêtre (la période analysée, pour
+ne pas la comparer à elle-même). Elle se calcule à partir des séries régionales réduites de
+core.zonal, sans relire l'archive ERA5, et reste en cache tant que les
+régions et l'archive ne changent pas.
+"""
+import numpy as np
+
+from core.archive import period_label
+from core.catalog import get_catalog
+from core.rollups import period_starts
+from core.zonal import get_zonal, zonal_sources
+
+FREQUENCIES = ('monthly', 'daily')
+# Valeur d'une période selon le flux : moyenne (instantané) ou total (taux
+# journalier désaccumulé, voir core.cube, multiplié par la durée en jours)
+AGGREGATIONS = {'instant': 'mean', 'accum': 'total'}
+# Part minimale des pas de temps attendus pour qu'une période compte comme complète
+COMPLETE_FRACTION = 0.99
+
+
+def aggregate(times, series, freq, how='mean'):
+    """Valeurs par période : (débuts de période (P,), valeurs (P, R), complet (P,))."""
+    keys = period_starts(times, freq)
+    if len(keys) == 0:
+        return keys, np.empty((0, series.shape[1])), np.zeros(0, dtype=bool)
+    change = np.flatnonzero(keys[1:] != keys[:-1]) + 1
+    bounds = np.concatenate([[0], change, [len(keys)]])
+    valid = ~np.isnan(series)
+    sums = np.add.reduceat(np.where(valid, series, 0.0), bounds[:-1], axis=0)
+    counts = np.add.reduceat(valid, bounds[:-1], axis=0)
+    periods = keys[bounds[:-1]]
+    lengths = period_lengths(periods, freq)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        values = sums / counts
+    if how == 'total':
+        values = values * lengths[:, None]
+
+    # Pas de temps attendus par période (pas médian de la série)
+    step = np.median(np.diff(times)) if len(times) > 1 else np.timedelta64(1, 'D')
+    expected = np.maximum(np.round(lengths / (step / np.timedelta64(1, 'D'))), 1)
+    complete = np.diff(bounds) >= COMPLETE_FRACTION * expected
+    return periods, values, complete
+
+
+def period_lengths(periods, freq):
+    """Durée en jours de chaque période (mois ou jour)."""
+    if freq == 'monthly':
+        ends = (periods.astype('datetime64[M]') + 1).astype('datetime64[D]')
+        return (ends - periods).astype(np.int64).astype(float)
+    return np.ones(len(periods))
+
+
+def calendar_keys(periods, freq):
+    """Mois (1-12) ou jour de l'année (MMJJ) de chaque début de période."""
+    months = periods.astype('datetime64[M]').astype(np.int64) % 12 + 1
+    if freq == 'monthly':
+        return months
+    days = (periods - periods.astype('datetime64[M]').astype('datetime64[D]')).astype(np.int64) + 1
+    return months * 100 + days
+
+
+class Climatology:
+    """Moyenne par mois / jour calendaire et par région sur une période de référence."""
+
+    def __init__(self, zonal, freq='monthly', how='mean', debut=None, fin=None, exclude=None):
+        self.freq = freq
+        self.how = how
+        sl = zonal.time_slice(debut, fin)
+        self.times = zonal.times[sl]
+        periods, values, complete = aggregate(self.times, zonal.region_series[sl], freq, how)
+        # Seules les périodes complètes entrent dans la référence
+        keep = complete
+        self.exclude = exclude
+        if exclude is not None:
+            # Périodes qui recoupent la fenêtre exclue [premier jour, dernier jour]
+            first, last = (np.datetime64(d, 'D') for d in exclude)
+            ends = periods + period_lengths(periods, freq).astype('timedelta64[D]')
+            keep = keep & ((ends <= first) | (periods > last))
+        periods, values = periods[keep], values[keep]
+        self.periods = periods
+        keys = calendar_keys(periods, freq)
+        self.keys = np.unique(keys)
+        self.means = np.full((len(self.keys), values.shape[1]), np.nan)
+        self.counts = np.zeros(len(self.keys), dtype=np.int64)
+        for k, key in enumerate(self.keys):
+            rows = values[keys == key]
+            self.means[k] = np.nanmean(rows, axis=0)
+            self.counts[k] = len(rows)
+
+    def lookup(self, periods, positions):
+        """Climatologie (P, régions) des périodes données (NaN si jamais observée)."""
+        out = np.full((len(periods), len(positions)), np.nan)
+        if len(self.keys) == 0:
+            return out
+        keys = calendar_keys(periods, self.freq)
+        idx = np.searchsorted(self.keys, keys)
+        found = (idx < len(self.keys)) & (self.keys[np.minimum(idx, len(self.keys) - 1)] == keys)
+        out[found] = self.means[idx[found]][:, positions]
+        return out
+
+    def daily_normals(self, times, positions):
+        """Valeur climatologique journalière (régions,) moyenne sur les instants donnés.
+
+        Pour une agrégation 'total', c'est le taux journalier attendu : le
+        cumul normal d'une période est ce taux multiplié par sa durée.
+        """
+        periods, counts = np.unique(period_starts(times, self.freq), return_counts=True)
+        clim = self.lookup(periods, positions)
+        if self.how == 'total':
+            clim = clim / period_lengths(periods, self.freq)[:, None]
+        # Moyenne pondérée par le nombre d'instants de chaque période connue
+        weights = ~np.isnan(clim) * counts[:, None]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.nansum(clim * weights, axis=0) / weights.sum(axis=0)
+
+    def reference_label(self):
+        """Libellé de la période de référence (périodes retenues), None si elle est vide."""
+        if len(self.periods) == 0:
+            return None
+        last = self.periods[-1] + period_lengths(self.periods[-1:], self.freq)[0].astype('timedelta64[D]') - 1
+        label = period_label(np.array([self.periods[0], last]))
+        if self.exclude is not None and self.periods[0] < np.datetime64(self.exclude[1], 'D') \
+                and last > np.datetime64(self.exclude[0], 'D'):
+            # Fenêtre exclue au milieu de la référence
+            label += f" hors {period_label(np.array(self.exclude, dtype='datetime64[D]'))}"
+        return label
+
+    def anomalies(self, zonal, sl, positions):
+        """(périodes, valeurs, climatologie, anomalies, complet) sur la tranche `sl`."""
+        periods, values, complete = aggregate(
+            zonal.times[sl], zonal.region_series[sl][:, positions], self.freq, self.how)
+        clim = self.lookup(periods, positions)
+        return periods, values, clim, values - clim, complete
+
+
+def get_climatology(var_name='t2m', freq='monthly', debut=None, fin=None, exclude=None):
+    """Climatologie partagée, recalculée seulement si les régions ou l'archive changent.
+
+    `exclude` : (premier jour, dernier jour) retirés de la référence.
+    """
+    catalog = get_catalog()
+    stream = catalog.stream_for(var_name)
+    if stream is None:
+        raise KeyError(f"Variable ERA5 '{var_name}' introuvable")
+    how = AGGREGATIONS[stream]
+    return catalog.derived(
+        ('climatology', var_name, freq, debut, fin, exclude), zonal_sources(var_name),
+        lambda *_: Climatology(get_zonal(var_name), freq, how, debut, fin, exclude))
@@ -0,0 +1,277 @@
+"""Cube climatique unifié : température et précipitations alignées.
+
+Les flux ERA5 'instant' (t2m) et 'accum' (tp) sont livrés séparément. Le
+cube les présente sur l'axe temps de la température et sa grille, avec
+des variables cumulées désaccumulées en taux journalier (m/jour) :
+
+  - mode 'pas' (ERA5 du CDS) : chaque valeur est le cumul des
+    `accumulation_heures` heures qui précèdent l'instant ;
+  - mode 'cumul' (ERA5-Land, prévisions) : les valeurs s'accumulent depuis
+    00 UTC ; le cumul d'un pas est l'écart avec le pas précédent de la
+    même fenêtre.
+
+Le mode est détecté sur les données ('auto') ou imposé dans pywps.cfg
+(section [era5]). En taux journalier, le total d'une période ne dépend
+plus de l'échantillonnage : c'est le taux moyen multiplié par la durée
+de la période en jours.
+
+`python -m core.ingest cube` écrit le cube fusionné dans data/store/
+(float32 compressé, blocs de pas de temps) ; il est lu à la place des
+deux flux tant qu'il correspond aux fichiers sources.
+"""
+import os
+
+import numpy as np
+from pywps import configuration
+
+from core.archive import BLOCK_STEPS, Era5Archive, combine_ids, stable_id
+from core.catalog import CUBE_FILE, STORE_DIR, get_catalog
+from core.readers import netcdf_lock
+
+ACCUMULATIONS = ('auto', 'pas', 'cumul')
+# Flux sources du cube (clés du catalogue)
+SOURCES = [('era5', 'instant'), ('era5', 'accum')]
+# Pas de temps examinés pour détecter le mode d'accumulation
+DETECT_STEPS = 336
+# Pas de temps par bloc NetCDF du cube fusionné
+CHUNK_STEPS = 64
+
+
+def _config(option, default):
+    value = configuration.get_config_value('era5', option, default)
+    return default if value == '' else value
+
+
+def accumulation_settings():
+    """(mode, heures) d'accumulation des précipitations configurés (section [era5])."""
+    mode = _config('accumulation', 'auto')
+    if mode not in ACCUMULATIONS:
+        raise ValueError(f"Mode d'accumulation inconnu : {mode}")
+    return mode, float(_config('accumulation_heures', 1))
+
+
+def accumulation_windows(times):
+    """Jour de remise à zéro (00 UTC) du cumul de chaque instant ; 00 UTC clôt la veille."""
+    return (times - np.timedelta64(1, 'ns')).astype('datetime64[D]')
+
+
+def detect_accumulation(archive, var_name, steps=DETECT_STEPS):
+    """'cumul' si la moyenne spatiale croît dans chaque fenêtre journalière, sinon 'pas'."""
+    n = min(steps, len(archive.times))
+    means = np.full(n, np.nan)
+    for idx, block in archive.iter_blocks(var_name, slice(0, n)):
+        means[idx] = np.nanmean(block.reshape(len(block), -1), axis=1)
+    windows = accumulation_windows(archive.times[:n])
+    diffs = np.diff(means)[windows[1:] == windows[:-1]]
+    diffs = diffs[diffs != 0]
+    # Un échantillon sec ou trop court ne permet pas de trancher
+    if len(diffs) < 4:
+        return 'pas'
+    return 'cumul' if np.mean(diffs > 0) >= 0.95 else 'pas'
+
+
+def deaccumulate(values, times, mode, hours=1.0, prev=None):
+    """Taux journaliers d'un bloc (temps, ...) de valeurs ERA5 cumulées.
+
+    `prev` = (instant, valeurs) du pas qui précède le bloc, utile en mode
+    'cumul' quand le bloc commence au milieu d'une fenêtre.
+    """
+    values = np.asarray(values, dtype=np.float32)
+    if mode == 'pas':
+        return values * np.float32(24.0 / hours)
+
+    windows = accumulation_windows(times)
+    if prev is None:
+        prev = (np.datetime64('NaT', 'ns'), np.full(values.shape[1:], np.nan, dtype=np.float32))
+    prev_times = np.concatenate([[prev[0]], times[:-1]]).astype('datetime64[ns]')
+    prev_values = np.concatenate([np.asarray(prev[1], dtype=np.float32)[None], values[:-1]])
+    same = accumulation_windows(prev_times) == windows
+    expand = (slice(None),) + (None,) * (values.ndim - 1)
+    amounts = np.where(same[expand], values - prev_values, values)
+    # Durée couverte : depuis le pas précédent, ou depuis la remise à zéro
+    begin = np.where(same, prev_times, windows.astype('datetime64[ns]'))
+    covered = (times - begin) / np.timedelta64(1, 'h')
+    # Les écarts négatifs (arrondis d'encodage GRIB) sont ramenés à zéro
+    return np.maximum(amounts, 0) * (24.0 / covered)[expand].astype(np.float32)
+
+
+class ClimateCube:
+    """Température et variables cumulées désaccumulées sur l'axe temps de la température.
+
+    Même interface que core.archive.Era5Archive (times, lats, lons,
+    variables, iter_blocks) : core.zonal la réduit comme un flux ordinaire.
+    """
+
+    def __init__(self, instant, accum, stored=None, previous=None):
+        self.instant = instant
+        self.accum = accum
+        self.times = instant.times
+        self.lats = instant.lats
+        self.lons = instant.lons
+        self.attrs = dict(instant.attrs)
+        if not (np.array_equal(accum.lats, self.lats) and np.array_equal(accum.lons, self.lons)):
+            raise ValueError("Grilles ERA5 différentes entre les flux instantané et cumulé")
+
+        mode, self.hours = accumulation_settings()
+        cumulated = [name for name in accum.variables if name not in instant.variables]
+        # Début du flux cumulé examiné par la détection : inchangé, le mode du cube précédent reste valable
+        ids = accum.source_ids()
+        n = min(DETECT_STEPS, len(accum.times))
+        self.detection = None if ids is None else (tuple(cumulated[:1]), accum.times[:n].tobytes(), ids[:n].tobytes())
+        if mode == 'auto':
+            if previous is not None and self.detection is not None and previous.detection == self.detection:
+                mode = previous.mode
+            else:
+                mode = detect_accumulation(accum, cumulated[0]) if cumulated else 'pas'
+        self.mode = mode
+
+        # Position de chaque instant du cube sur l'axe du flux cumulé (-1 : absent)
+        pos = np.minimum(np.searchsorted(accum.times, self.times), len(accum.times) - 1)
+        self.accum_index = np.where(accum.times[pos] == self.times, pos, -1)
+
+        self.variables = dict(instant.variables)
+        for name in cumulated:
+            attrs = dict(accum.variables[name])
+            attrs.update(units='m day-1', accumulation=self.mode)
+            self.variables[name] = attrs
+
+        # Cube fusionné de data/store/, s'il couvre le même axe temps
+        self.stored = None
+        if stored is not None and np.array_equal(stored.times, self.times):
+            self.stored = stored
+
+    @property
+    def data_vars(self):
+        return list(self.variables)
+
+    def source_ids(self, var_name):
+        """Provenance de chaque instant (voir Era5Archive.source_ids), None si inconnue.
+
+        Le taux désaccumulé d'un instant dépend du fichier cumulé qui le
+        fournit, du mode d'accumulation et, en mode 'cumul', du pas précédent.
+        """
+        if var_name in self.instant.variables:
+            return self.instant.source_ids(var_name)
+        accum = self.accum.source_ids(var_name)
+        if accum is None:
+            return None
+        found = self.accum_index >= 0
+        ids = np.where(found, accum[np.maximum(self.accum_index, 0)], 0)
+        if self.mode == 'cumul':
+            prev = np.where(found & (self.accum_index > 0), accum[np.maximum(self.accum_index - 1, 0)], 0)
+            ids = combine_ids(ids, prev)
+        return combine_ids(ids, stable_id(self.mode, self.hours))
+
+    def iter_blocks(self, var_name, sl=slice(None), block_steps=BLOCK_STEPS, window=None):
+        """Blocs (indices du cube, valeurs (temps, lat, lon)) ; tp en m/jour."""
+        if self.stored is not None:
+            yield from self.stored.iter_blocks(var_name, sl, block_steps, window)
+        elif var_name in self.instant.variables:
+            yield from self.instant.iter_blocks(var_name, sl, block_steps, window)
+        elif var_name in self.variables:
+            yield from self._iter_accumulated(var_name, sl, block_steps, window)
+        else:
+            raise KeyError(var_name)
+
+    def _iter_accumulated(self, var_name, sl, block_steps, window):
+        start, stop, _ = sl.indices(len(self.times))
+        wanted = self.accum_index[start:stop]
+        found = wanted >= 0
+        if not found.any():
+            return
+        # Indice du cube de chaque pas du flux cumulé (-1 : hors de la tranche)
+        target = np.full(len(self.accum.times), -1)
+        target[wanted[found]] = np.arange(start, stop)[found]
+
+        last = None
+        read = slice(int(wanted[found].min()), int(wanted[found].max()) + 1)
+        for idx, block in self.accum.iter_blocks(var_name, read, block_steps, window):
+            times = self.accum.times[idx]
+            prev = None
+            if self.mode == 'cumul' and idx[0] > 0:
+                prev = (last[1] if last is not None and last[0] == idx[0] - 1
+                        else self._step(var_name, idx[0] - 1, window))
+            rates = deaccumulate(block, times, self.mode, self.hours, prev)
+            last = (idx[-1], (times[-1], block[-1]))
+            keep = target[idx] >= 0
+            if keep.any():
+                yield target[idx][keep], rates[keep]
+
+    def _step(self, var_name, i, window=None):
+        for _idx, block in self.accum.iter_blocks(var_name, slice(i, i + 1), window=window):
+            return self.accum.times[i], block[0]
+        return None
+
+
+def is_fresh(path, fingerprint):
+    """Vrai si le cube fusionné `path` a été écrit à partir des fichiers sources actuels."""
+    if not path or not os.path.exists(path):
+        return False
+    # Import local : netCDF4 n'est chargé que si le cube fusionné existe
+    import netCDF4
+    # Verrou d'xarray : la bibliothèque HDF5 n'est pas sûre entre threads
+    with netcdf_lock(), netCDF4.Dataset(path) as nc:
+        return getattr(nc, 'cube_sources', None) == fingerprint
+
+
+def get_cube():
+    """Cube partagé, reconstruit si un des flux ou le cube fusionné change."""
+    catalog = get_catalog()
+
+    def build(instant, accum, stored_path, previous=None):
+        stored = None
+        if is_fresh(stored_path, catalog.fingerprint(SOURCES)):
+            stored = Era5Archive('cube', [stored_path])
+        return ClimateCube(instant, accum, stored, previous)
+
+    return catalog.derived(('cube',), SOURCES + ['cube'], build,
+                           update=lambda previous, *values: build(*values, previous=previous))
+
+
+def write_cube(complevel=1, block_steps=BLOCK_STEPS):
+    """Écrit le cube fusionné (t2m, tp désaccumulé) dans data/store/, bloc par bloc."""
+    import netCDF4
+    catalog = get_catalog()
+    fingerprint = catalog.fingerprint(SOURCES)
+    cube = ClimateCube(catalog.era5('instant'), catalog.era5('accum'))
+    os.makedirs(STORE_DIR, exist_ok=True)
+    tmp = f'{CUBE_FILE}.{os.getpid()}.tmp'
+
+    with netCDF4.Dataset(tmp, 'w', format='NETCDF4') as nc:
+        nc.createDimension('time', None)
+        nc.createDimension('latitude', len(cube.lats))
+        nc.createDimension('longitude', len(cube.lons))
+        t = nc.createVariable('time', 'i8', ('time',))
+        t.units = 'seconds since 1970-01-01'
+        t.calendar = 'proleptic_gregorian'
+        t[:] = cube.times.astype('datetime64[s]').astype(np.int64)
+        nc.createVariable('latitude', 'f8', ('latitude',))[:] = cube.lats
+        nc.createVariable('longitude', 'f8', ('longitude',))[:] = cube.lons
+        nc.setncatts({k: v for k, v in cube.attrs.items() if isinstance(v, (str, int, float))})
+        nc.cube_sources = fingerprint
+        nc.accumulation = cube.mode
+
+        chunk_steps = min(CHUNK_STEPS, len(cube.times))
+        for name, attrs in cube.variables.items():
+            var = nc.createVariable(name, 'f4', ('time', 'latitude', 'longitude'),
+                                    zlib=True, complevel=complevel, fill_value=np.float32(np.nan),
+                                    chunksizes=(chunk_steps, len(cube.lats), len(cube.lons)))
+            var.setncatts({k: v for k, v in attrs.items()
+                           if k != '_FillValue' and isinstance(v, (str, int, float, np.number))})
+            for idx, block in cube.iter_blocks(name):
+                if idx[-1] - idx[0] == len(idx) - 1:
+                    var[int(idx[0]):int(idx[-1]) + 1] = block
+                else:
+                    for k, i in enumerate(idx):
+                        var[int(i)] = block[k]
+    # Remplacement atomique : un lecteur voit l'ancienne ou la nouvelle version
+    os.replace(tmp, CUBE_FILE)
+    return CUBE_FILE, cube.mode
+
+
+def period_days(times):
+    """Durée couverte par des instants régulièrement espacés, en jours."""
+    if len(times) == 0:
+        return 0.0
+    step = np.median(np.diff(times)) if len(times) > 1 else np.timedelta64(1, 'D')
+    return len(times) * (step / np.timedelta64(1, 'D'))
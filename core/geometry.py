@@ -0,0 +1,168 @@
+"""Géométries des régions simplifiées par niveau de zoom.
+
+Le navigateur téléchargeait regions.zip (425 Ko) ou regions.geojson
+(1,6 Mo) à pleine précision. Ici, les polygones sont simplifiés une fois
+par niveau de zoom avec `shapely.coverage_simplify` (les frontières
+communes restent communes, pas de trous ni de chevauchements entre
+régions), puis sérialisés en TopoJSON (coordonnées quantifiées et
+codées en delta) ou en GeoJSON arrondi. Chaque variante est gardée en
+mémoire, déjà compressée en gzip, avec son ETag. L'instantané binaire
+(core/snapshot.py) contient toutes les variantes déjà sérialisées : le
+service démarre alors sans rien simplifier.
+"""
+import gzip
+import hashlib
+import json
+import math
+import threading
+from collections import namedtuple
+
+import numpy as np
+
+from core.catalog import get_catalog
+from core.snapshot import load_geometry
+
+# Tolérance de simplification (degrés) par niveau de zoom Leaflet
+ZOOM_TOLERANCES = {4: 0.05, 5: 0.02, 6: 0.01, 7: 0.005, 8: 0.002}
+DEFAULT_ZOOM = 5
+FORMATS = {
+    'topojson': 'application/json',
+    'geojson': 'application/geo+json',
+}
+PROPERTIES = ('CODE_REGIO', 'nom_region', 'nom_arabe')
+
+Payload = namedtuple('Payload', 'body gzip etag mimetype')
+
+
+def clamp_zoom(z):
+    zooms = sorted(ZOOM_TOLERANCES)
+    return min(max(int(z), zooms[0]), zooms[-1])
+
+
+def _quantization(tolerance):
+    """Nombre de pas de quantification : environ 4 pas par tolérance de simplification."""
+    return 10 ** max(4, math.ceil(math.log10(4 / tolerance)) + 2)
+
+
+def _rings(geom):
+    polygons = getattr(geom, 'geoms', [geom])
+    return [[p.exterior] + list(p.interiors) for p in polygons if not p.is_empty]
+
+
+def _properties(row):
+    props = {}
+    for key in PROPERTIES:
+        value = row.get(key)
+        if value is None:
+            continue
+        props[key] = value.item() if hasattr(value, 'item') else value
+    return props
+
+
+def to_topojson(geometries, records, tolerance):
+    """Topologie TopoJSON (un arc par anneau, coordonnées quantifiées en delta)."""
+    # Import local : shapely n'est chargé qu'au premier calcul de variante
+    import shapely
+    minx, miny, maxx, maxy = shapely.total_bounds(geometries)
+    q = _quantization(tolerance)
+    sx, sy = (maxx - minx) / (q - 1) or 1, (maxy - miny) / (q - 1) or 1
+    arcs, objects = [], []
+    for geom, row in zip(geometries, records):
+        polys = []
+        for rings in _rings(geom):
+            refs = []
+            for ring in rings:
+                coords = np.asarray(ring.coords)
+                pts = np.column_stack([np.round((coords[:, 0] - minx) / sx),
+                                       np.round((coords[:, 1] - miny) / sy)]).astype(np.int64)
+                # Points consécutifs confondus après quantification
+                keep = np.concatenate([[True], np.any(pts[1:] != pts[:-1], axis=1)])
+                pts = pts[keep]
+                if len(pts) < 4:
+                    continue
+                deltas = np.vstack([pts[:1], np.diff(pts, axis=0)])
+                refs.append(len(arcs))
+                arcs.append(deltas.tolist())
+            if refs:
+                polys.append(refs)
+        if not polys:
+            continue
+        obj = {'type': 'Polygon', 'arcs': polys[0]} if len(polys) == 1 else \
+              {'type': 'MultiPolygon', 'arcs': polys}
+        obj['properties'] = _properties(row)
+        if 'CODE_REGIO' in obj['properties']:
+            obj['id'] = obj['properties']['CODE_REGIO']
+        objects.append(obj)
+    return {
+        'type': 'Topology',
+        'bbox': [minx, miny, maxx, maxy],
+        'transform': {'scale': [sx, sy], 'translate': [minx, miny]},
+        'objects': {'regions': {'type': 'GeometryCollection', 'geometries': objects}},
+        'arcs': arcs,
+    }
+
+
+def to_geojson(geometries, records, tolerance):
+    """FeatureCollection GeoJSON aux coordonnées arrondies selon la tolérance."""
+    import shapely
+    decimals = max(3, math.ceil(-math.log10(tolerance)) + 1)
+    geometries = shapely.set_precision(geometries, 10 ** -decimals)
+    features = []
+    for geom, row in zip(geometries, records):
+        features.append({
+            'type': 'Feature',
+            'properties': _properties(row),
+            'geometry': shapely.geometry.mapping(geom),
+        })
+    return {'type': 'FeatureCollection', 'features': features}
+
+
+class GeometryService:
+    """Variantes simplifiées (par zoom et format) du Shapefile des régions."""
+
+    def __init__(self, layer, bodies=None):
+        self.geometries = layer.geometries
+        self.records = layer.records
+        self._simplified = {}
+        self._payloads = {}
+        self._lock = threading.Lock()
+        # Variantes de l'instantané : {(format, zoom): (corps, corps gzip)}
+        for (fmt, z), (body, compressed) in (bodies or {}).items():
+            self._payloads[(fmt, z)] = Payload(body, compressed, _etag(body), FORMATS[fmt])
+        # Précalcul de toutes les variantes (quelques dizaines de Ko chacune)
+        for z in ZOOM_TOLERANCES:
+            for fmt in FORMATS:
+                self.payload(fmt, z)
+
+    def simplified(self, z):
+        z = clamp_zoom(z)
+        if z not in self._simplified:
+            import shapely
+            self._simplified[z] = shapely.coverage_simplify(self.geometries, ZOOM_TOLERANCES[z])
+        return self._simplified[z]
+
+    def payload(self, fmt, z):
+        if fmt not in FORMATS:
+            raise KeyError(fmt)
+        key = (fmt, clamp_zoom(z))
+        payload = self._payloads.get(key)
+        if payload is None:
+            with self._lock:
+                payload = self._payloads.get(key)
+                if payload is None:
+                    encode = to_topojson if fmt == 'topojson' else to_geojson
+                    doc = encode(self.simplified(key[1]), self.records, ZOOM_TOLERANCES[key[1]])
+                    body = json.dumps(doc, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+                    payload = Payload(body, gzip.compress(body, 9), _etag(body), FORMATS[fmt])
+                    self._payloads[key] = payload
+        return payload
+
+
+def _etag(body):
+    return hashlib.sha1(body).hexdigest()[:20]
+
+
+def get_geometry_service():
+    """Service partagé, reconstruit si le Shapefile change."""
+    return get_catalog().derived(
+        'geometry', ['regions'], lambda layer: GeometryService(layer, load_geometry(ZOOM_TOLERANCES)))
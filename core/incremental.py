@@ -0,0 +1,216 @@
+"""Ingestion incrémentale des fichiers ERA5 déposés dans data/.
+
+Le pipeline ajoute de nouveaux mois sous data/era5/<flux>/ (voir
+core/archive.py). `python -m core.ingest append` (une fois) ou
+`python -m core.ingest watch` (en continu) :
+
+  1. repère les fichiers nouveaux, modifiés ou retirés depuis la dernière
+     ingestion (mtime, taille) ; un fichier modifié depuis moins de
+     `--stabilite` secondes est encore en cours d'écriture et attend le
+     passage suivant, un fichier illisible est signalé puis ignoré ;
+  2. réduit seulement les pas de temps qu'ils apportent (séries régionales
+     de core.zonal) ; les autres sont repris de l'état précédent ;
+  3. écrit ces séries dans data/store/etat_<variable>.npz, publie la liste
+     des fichiers du flux (data/store/era5_<flux>_fichiers.json) puis les
+     agrégats temporels (core.rollups), dont seules les périodes touchées
+     sont recalculées. Chaque fichier est remplacé atomiquement.
+
+Les serveurs en cours ne lisent que les fichiers de la liste publiée
+(core.catalog) : ils passent d'une version à l'autre au remplacement de
+la liste, sans redémarrage. Leurs séries en mémoire sont alors complétées
+par l'état écrit à l'étape 3, sans relire l'archive ; climatologies,
+agrégats temporels et indices sont dérivés des nouvelles séries.
+"""
+import json
+import os
+import time
+
+import numpy as np
+
+from core import rollups
+from core.archive import Era5Archive, file_state, read_header
+from core.catalog import (DATA_DIR, ERA5_FILES, STORE_DIR, discover_era5_paths, era5_list_path,
+                          era5_paths, get_catalog, published_era5_files)
+from core.cube import ClimateCube
+from core.regions import get_region_index
+from core.zonal import SERIES, ZonalVariable
+
+# Version du format des états enregistrés : un état d'un autre format est ignoré
+STATE_FORMAT = 1
+# Ancienneté minimale (s) d'un fichier avant son intégration
+STABLE_SECONDS = 30
+# Intervalle (s) entre deux passages de `watch`
+WATCH_INTERVAL = 60
+
+
+def state_path(var_name):
+    return os.path.join(STORE_DIR, f'etat_{var_name}.npz')
+
+
+class ZonalState:
+    """Séries réduites (core.zonal.SERIES) d'une variable, relues de data/store/."""
+
+    def __init__(self, npz):
+        self.times = npz['times']
+        self.keys = npz['keys']
+        for name in SERIES:
+            setattr(self, name, npz[name])
+
+
+def save_state(var_name, zonal):
+    """Écrit les séries réduites de la variable (remplacement atomique)."""
+    arrays = {name: getattr(zonal, name) for name in SERIES}
+    arrays.update(format=np.array(STATE_FORMAT), variable=np.array(var_name), times=zonal.times, keys=zonal.keys)
+    path = state_path(var_name)
+    os.makedirs(STORE_DIR, exist_ok=True)
+    tmp = f'{path}.{os.getpid()}.tmp.npz'
+    np.savez(tmp, **arrays)
+    os.replace(tmp, path)
+    return path
+
+
+def load_state(var_name):
+    """État enregistré de la variable (ZonalState), ou None."""
+    path = state_path(var_name)
+    if not os.path.exists(path):
+        return None
+    try:
+        with np.load(path) as npz:
+            if int(npz['format']) != STATE_FORMAT or str(npz['variable']) != var_name:
+                return None
+            return ZonalState(npz)
+    except (OSError, ValueError, KeyError):
+        # État illisible (écriture interrompue) : séries recalculées
+        return None
+
+
+def pending_files(stream, stable=STABLE_SECONDS):
+    """Fichiers du flux dans data/ par rapport à la liste publiée : (nouveaux, modifiés, retirés, en écriture)."""
+    published = published_era5_files(stream) or {}
+    added, changed, waiting = [], [], []
+    now = time.time()
+    for path in discover_era5_paths(stream):
+        st = os.stat(path)
+        if published.get(path) == (st.st_mtime_ns, st.st_size):
+            continue
+        if now - st.st_mtime < stable:
+            waiting.append(path)
+        else:
+            (changed if path in published else added).append(path)
+    removed = [path for path in published if not os.path.exists(path)]
+    return added, changed, removed, waiting
+
+
+def publish(archive):
+    """Publie la liste des fichiers de l'archive (états intégrés), vue par les serveurs à leur requête suivante."""
+    files = [{'chemin': path, 'mtime_ns': state[0], 'taille': state[1]}
+             for path, (state, _header) in archive.headers.items()]
+    path = era5_list_path(archive.stream)
+    os.makedirs(STORE_DIR, exist_ok=True)
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump({'fichiers': files}, f, ensure_ascii=False, indent=1)
+    os.replace(tmp, path)
+
+
+# Messages déjà affichés par `watch` : (chemin, état du fichier) -> message
+_reported = {}
+
+
+def _report_once(log, path, message):
+    """Affiche le message une seule fois par état du fichier (passages répétés de `watch`)."""
+    try:
+        key = (path, file_state(path))
+    except FileNotFoundError:
+        key = (path, None)
+    if _reported.get(key) != message:
+        _reported[key] = message
+        log(message)
+
+
+def _candidate(stream, current, stable, log):
+    """Archive du flux avec les fichiers à intégrer, ou None si rien n'a changé."""
+    added, changed, removed, waiting = pending_files(stream, stable)
+    for path in waiting:
+        _report_once(log, path, f"⏳ {path} : en cours d'écriture, intégré au passage suivant")
+    published = published_era5_files(stream)
+    if published is not None and not (added or changed or removed):
+        return None
+    headers = dict(getattr(current, 'headers', None) or {})
+    grid = (current.lats, current.lons) if current is not None else None
+    accepted = set()
+    for path in added + changed:
+        try:
+            header = read_header(stream, path)
+        except (OSError, ValueError, KeyError) as e:
+            _report_once(log, path, f"⚠️ {path} illisible, ignoré : {e}")
+            continue
+        grid = grid or (header.lats, header.lons)
+        if not (np.array_equal(header.lats, grid[0]) and np.array_equal(header.lons, grid[1])):
+            _report_once(log, path, f"⚠️ {path} : grille ERA5 différente, ignoré")
+            continue
+        headers[path] = (file_state(path), header)
+        accepted.add(path)
+    # Fichiers publiés inchangés + fichiers acceptés, dans l'ordre de data/ (le dernier l'emporte)
+    unchanged = set(published or {}) - set(changed) - set(waiting)
+    paths = [p for p in discover_era5_paths(stream) if p in accepted or p in unchanged]
+    if not accepted and not removed:
+        return None
+    for path in sorted(accepted):
+        log(f"📥 {stream} : {path}")
+    for path in removed:
+        log(f"🗑️ {stream} : {path} retiré")
+    return Era5Archive(stream, paths, headers) if paths else None
+
+
+def ingest(stable=STABLE_SECONDS, log=print):
+    """Intègre les fichiers ERA5 nouveaux ou modifiés de data/ ; retourne les variables mises à jour."""
+    catalog = get_catalog()
+    current, candidates = {}, {}
+    for stream in ERA5_FILES:
+        # Version servie actuellement (en-têtes déjà lus, grille de référence)
+        current[stream] = catalog.era5(stream) if era5_paths(stream) else None
+        archive = _candidate(stream, current[stream], stable, log)
+        if archive is not None:
+            candidates[stream] = archive
+    if not candidates:
+        return []
+
+    archives = {s: candidates.get(s) or current[s] for s in ERA5_FILES if candidates.get(s) or current[s]}
+    index = get_region_index()
+    updated = []
+    for stream, archive in archives.items():
+        cube = stream == 'accum' and 'instant' in archives
+        # Variable cumulée : désaccumulée sur l'axe de la température, qui peut aussi avoir changé
+        if stream not in candidates and not (cube and 'instant' in candidates):
+            continue
+        source = ClimateCube(archives['instant'], archive) if cube else archive
+        for var_name in archive.variables:
+            if cube and var_name in archives['instant'].variables:
+                continue
+            t0 = time.time()
+            state = load_state(var_name)
+            zonal = ZonalVariable(source, var_name, index, [state])
+            save_state(var_name, zonal)
+            updated.append(var_name)
+            log(f"✅ {var_name} : {zonal.reduced}/{len(zonal.times)} pas de temps réduits ({time.time() - t0:.1f} s)")
+
+    # Publication : les serveurs passent à la nouvelle version à leur requête suivante
+    for archive in candidates.values():
+        publish(archive)
+    for var_name in updated:
+        rollups.save_rollups(var_name)
+    return updated
+
+
+def watch(interval=WATCH_INTERVAL, stable=STABLE_SECONDS, log=print):
+    """Intègre en continu les fichiers ERA5 déposés dans data/ (Ctrl+C pour arrêter)."""
+    log(f"👀 Surveillance de {DATA_DIR} (flux {', '.join(ERA5_FILES)}) toutes les {interval} s")
+    while True:
+        try:
+            ingest(stable, log)
+        except Exception as e:
+            # Passage interrompu (fichier retiré pendant la lecture...) : repris au suivant
+            log(f"⚠️ Ingestion interrompue : {e}")
+        time.sleep(interval)
+
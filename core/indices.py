@@ -0,0 +1,184 @@
+"""Indices agro-climatiques de toutes les régions sur une fenêtre de dates.
+
+Les indices sont calculés en une passe vectorisée (jours x régions) sur les
+agrégats journaliers (core.rollups) des séries régionales réduites
+(core.zonal) : l'archive ERA5 n'est pas relue.
+
+  - jours où la température max journalière dépasse 30 / 35 / 40 °C ;
+  - plus longue vague de chaleur (jours consécutifs au-dessus de 35 °C)
+    et nombre de vagues d'au moins 3 jours ;
+  - nuits tropicales (min journalière au-dessus de 20 °C) ;
+  - degrés-jours de croissance (base 10 °C) et de chauffage (base 18 °C) ;
+  - percentiles 90 et 99 de la température régionale ;
+  - si les précipitations sont disponibles : jours de pluie (>= 1 mm),
+    plus longue période sèche et cumul journalier maximal.
+
+Les températures journalières sont le min, la moyenne et le max sur la
+journée de la moyenne régionale pondérée. Avec moins de
+PAS_MIN_EXTREMES pas de temps par jour (ERA5 à 12 UTC seulement), les
+trois sont égales : les nuits tropicales, qui demandent un vrai minimum
+journalier, ne sont pas calculées (null) et les degrés-jours, estimés
+sur la seule température disponible, sont signalés comme approximatifs.
+Les indices d'une fenêtre sont gardés par le
+catalogue (budget mémoire de core.memory) et partagés par les processus
+indices_climatiques et impact_climatique.
+"""
+import warnings
+
+import numpy as np
+
+from core.catalog import get_catalog
+from core.rollups import get_rollups
+from core.zonal import get_zonal, zonal_sources
+
+KELVIN = 273.15
+# Seuils (°C) de la température max journalière comptés en jours chauds
+SEUILS_CHALEUR = (30, 35, 40)
+# Vague de chaleur : au moins VAGUE_MIN_JOURS jours consécutifs au-dessus de SEUIL_VAGUE
+SEUIL_VAGUE = 35
+VAGUE_MIN_JOURS = 3
+SEUIL_NUIT_TROPICALE = 20
+BASE_CROISSANCE = 10
+BASE_CHAUFFAGE = 18
+PERCENTILES = (90, 99)
+# Pas de temps par jour en dessous desquels min / max journaliers ne sont pas de vrais extrêmes
+PAS_MIN_EXTREMES = 2
+# Cumul journalier (mm) à partir duquel un jour compte comme pluvieux
+SEUIL_PLUIE_MM = 1.0
+
+
+def run_lengths(mask):
+    """Longueur de la suite de True en cours à chaque jour d'un tableau (jours, régions)."""
+    day = np.arange(1, len(mask) + 1)[:, None]
+    # Dernier jour False rencontré (0 avant le premier)
+    last_break = np.maximum.accumulate(np.where(mask, 0, day), axis=0)
+    return day - last_break
+
+
+def longest_run(mask):
+    """Plus longue suite de True de chaque région."""
+    return run_lengths(mask).max(axis=0, initial=0)
+
+
+def _daily(zonal, sl):
+    """(min, moyenne, max) journaliers (jours, régions) de la variable sur la tranche."""
+    _days, vmin, vmean, vmax = get_rollups(zonal.var_name)['daily'].select(
+        zonal.region_series, sl, slice(None))
+    return vmin, vmean, vmax
+
+
+class ClimateIndices:
+    """Indices de toutes les régions sur une fenêtre : `values` = {nom: tableau (régions,)}."""
+
+    def __init__(self, temperature, sl, rainfall=None, rain_sl=None):
+        tmin, tmean, tmax = (v - KELVIN for v in _daily(temperature, sl))
+        self.days = len(tmax)
+        self.rainfall = rainfall is not None
+        # Pas de temps moyens par jour : un seul (12 UTC) ne donne ni Tmin ni Tmax journaliers
+        self.steps_per_day = len(temperature.times[sl]) / self.days if self.days else 0.0
+        self.daily_extremes = self.steps_per_day >= PAS_MIN_EXTREMES
+        values = {}
+        with np.errstate(invalid='ignore'), warnings.catch_warnings():
+            # Régions ou jours sans données : NaN attendu
+            warnings.simplefilter('ignore', RuntimeWarning)
+            for seuil in SEUILS_CHALEUR:
+                values[f'jours_sup_{seuil}'] = np.count_nonzero(tmax > seuil, axis=0)
+            # Pic de la même série (max journalier de la moyenne régionale), à citer avec les jours chauds
+            values['tmax_pic_C'] = (np.nanmax(tmax, axis=0) if len(tmax)
+                                    else np.full(tmax.shape[1], np.nan))
+            runs = run_lengths(tmax > SEUIL_VAGUE)
+            values['vague_chaleur_max_jours'] = runs.max(axis=0, initial=0)
+            # Une vague compte une fois, le jour où elle atteint la durée minimale
+            values['vagues_chaleur'] = np.count_nonzero(runs == VAGUE_MIN_JOURS, axis=0)
+            if self.daily_extremes:
+                values['nuits_tropicales'] = np.count_nonzero(tmin > SEUIL_NUIT_TROPICALE, axis=0)
+            else:
+                values['nuits_tropicales'] = np.full(tmin.shape[1], np.nan)
+            values['degres_jours_croissance'] = np.nansum(
+                np.maximum((tmin + tmax) / 2 - BASE_CROISSANCE, 0), axis=0)
+            values['degres_jours_chauffage'] = np.nansum(np.maximum(BASE_CHAUFFAGE - tmean, 0), axis=0)
+            series = temperature.region_series[sl] - KELVIN
+            quantiles = (np.nanpercentile(series, PERCENTILES, axis=0) if len(series)
+                         else np.full((len(PERCENTILES), series.shape[1]), np.nan))
+            for q, row in zip(PERCENTILES, quantiles):
+                values[f'p{q}_C'] = row
+
+            if rainfall is not None:
+                # Taux journalier moyen (m/jour, core.cube) = cumul de la journée
+                pluie = _daily(rainfall, rain_sl)[1] * 1000
+                values['jours_pluie'] = np.count_nonzero(pluie >= SEUIL_PLUIE_MM, axis=0)
+                values['jours_secs_max'] = longest_run(pluie < SEUIL_PLUIE_MM)
+                values['pluie_max_jour_mm'] = (np.nanmax(pluie, axis=0) if len(pluie)
+                                               else np.full(pluie.shape[1], np.nan))
+        self.values = values
+
+    def select(self, positions):
+        """Indices des régions `positions` : {nom: tableau (len(positions),)}."""
+        return {name: values[positions] for name, values in self.values.items()}
+
+
+def get_indices(debut=None, fin=None):
+    """Indices partagés de la fenêtre [debut, fin], calculés une fois pour toutes les régions."""
+    catalog = get_catalog()
+    temperature = get_zonal('t2m')
+    sl = temperature.time_slice(debut, fin)
+    rain = catalog.stream_for('tp') is not None
+    sources = zonal_sources('t2m')
+    if rain:
+        sources += [s for s in zonal_sources('tp') if s not in sources]
+
+    def build(*_):
+        rainfall = get_zonal('tp') if rain else None
+        rain_sl = rainfall.time_slice(debut, fin) if rain else None
+        return ClimateIndices(temperature, sl, rainfall, rain_sl)
+
+    # Clé : bornes de la tranche, des dates équivalentes partagent les mêmes indices
+    return catalog.derived(('indices', sl.start, sl.stop), sources, build)
+
+
+DEFINITIONS = {
+    'jours_tmax_sup': f"Jours où la température max journalière dépasse {', '.join(map(str, SEUILS_CHALEUR))} °C",
+    'vague_chaleur_max_jours': f"Plus longue suite de jours au-dessus de {SEUIL_VAGUE} °C",
+    'vagues_chaleur': f"Suites d'au moins {VAGUE_MIN_JOURS} jours au-dessus de {SEUIL_VAGUE} °C",
+    'nuits_tropicales': f"Jours dont la température min dépasse {SEUIL_NUIT_TROPICALE} °C",
+    'degres_jours_croissance': f"Somme de max(0, (Tmin + Tmax) / 2 - {BASE_CROISSANCE} °C)",
+    'degres_jours_chauffage': f"Somme de max(0, {BASE_CHAUFFAGE} °C - Tmoy)",
+    'percentiles_C': f"Percentiles {', '.join(map(str, PERCENTILES))} de la température régionale",
+    'jours_pluie': f"Jours de pluie (>= {SEUIL_PLUIE_MM:g} mm)",
+    'jours_secs_max': f"Plus longue suite de jours à moins de {SEUIL_PLUIE_MM:g} mm",
+}
+
+
+def region_indices(values, rainfall=True, daily_extremes=True):
+    """Indices d'une région (valeurs scalaires) mis en forme JSON.
+
+    Sans vrais extrêmes journaliers (`ClimateIndices.daily_extremes`), les
+    nuits tropicales valent null et les degrés-jours sont signalés approximatifs.
+    """
+    temperature = {
+        'jours_tmax_sup': {str(s): int(values[f'jours_sup_{s}']) for s in SEUILS_CHALEUR},
+        'vague_chaleur_max_jours': int(values['vague_chaleur_max_jours']),
+        'vagues_chaleur': int(values['vagues_chaleur']),
+        'nuits_tropicales': None if not daily_extremes else int(values['nuits_tropicales']),
+        'degres_jours_croissance': _rounded(values['degres_jours_croissance'], 1),
+        'degres_jours_chauffage': _rounded(values['degres_jours_chauffage'], 1),
+        'degres_jours_approximatifs': not daily_extremes,
+        'percentiles_C': {f'p{q}': _rounded(values[f'p{q}_C'], 2) for q in PERCENTILES},
+    }
+    if not daily_extremes:
+        temperature['avertissement'] = (
+            f"Moins de {PAS_MIN_EXTREMES} pas de temps par jour : pas de Tmin / Tmax journaliers. Nuits tropicales "
+            "non calculées, degrés-jours estimés sur la seule température disponible.")
+    if rainfall:
+        precipitations = {
+            'jours_pluie': int(values['jours_pluie']),
+            'jours_secs_max': int(values['jours_secs_max']),
+            'pluie_max_jour_mm': _rounded(values['pluie_max_jour_mm'], 1),
+        }
+    else:
+        precipitations = "Non analysé (données de précipitations absentes)"
+    return {'temperature': temperature, 'precipitations': precipitations}
+
+
+def _rounded(value, digits):
+    return None if np.isnan(value) else round(float(value), digits) + 0.0
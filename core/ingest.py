@@ -0,0 +1,134 @@
+"""Commandes d'ingestion des données ERA5.
+
+Usage :
+    python -m core.ingest rechunk [--stream instant|accum|all] [--pixel-chunk 4]
+    python -m core.ingest rollups [--variable t2m]
+    python -m core.ingest cube
+    python -m core.ingest snapshot [--encodage float32|int16]
+    python -m core.ingest append [--stabilite 30]
+    python -m core.ingest watch [--intervalle 60] [--stabilite 30]
+    python -m core.ingest static
+"""
+import argparse
+import os
+import time
+
+from pywps import configuration
+
+from core import cube, incremental, memory, rollups, snapshot, static, store
+from core.catalog import ERA5_FILES, era5_paths
+
+
+def cmd_rechunk(args):
+    streams = list(ERA5_FILES) if args.stream == 'all' else [args.stream]
+    for stream in streams:
+        if not os.path.exists(ERA5_FILES[stream]):
+            print(f"⚠️ {ERA5_FILES[stream]} absent, flux '{stream}' ignoré")
+            continue
+        if store.is_fresh(stream) and not args.force:
+            print(f"✅ {stream} : stockage déjà à jour")
+            continue
+        t0 = time.time()
+        path = store.rechunk(stream, pixel_chunk=args.pixel_chunk)
+        size_mb = os.path.getsize(path) / 1024 ** 2
+        print(f"✅ {stream} -> {path} ({size_mb:.1f} Mo, {time.time() - t0:.1f} s)")
+
+
+def cmd_rollups(args):
+    for var_name in args.variable:
+        t0 = time.time()
+        path = rollups.save_rollups(var_name)
+        print(f"✅ Agrégats {var_name} ({', '.join(rollups.FREQUENCIES)}) -> {path} ({time.time() - t0:.1f} s)")
+
+
+def cmd_cube(args):
+    missing = [stream for stream in ERA5_FILES if not era5_paths(stream)]
+    if missing:
+        print(f"⚠️ Flux absent(s) : {', '.join(missing)}, cube non écrit")
+        return
+    t0 = time.time()
+    path, mode = cube.write_cube()
+    size_mb = os.path.getsize(path) / 1024 ** 2
+    print(f"✅ Cube t2m + tp (accumulation '{mode}') -> {path} ({size_mb:.1f} Mo, {time.time() - t0:.1f} s)")
+
+
+def cmd_snapshot(args):
+    t0 = time.time()
+    parts = snapshot.write_snapshot(args.encodage)
+    size_mb = snapshot.snapshot_size() / 1024 ** 2
+    print(f"✅ Instantané ({', '.join(parts)}) -> {snapshot.SNAPSHOT_DIR} ({size_mb:.1f} Mo, {time.time() - t0:.1f} s)")
+
+
+def cmd_append(args):
+    t0 = time.time()
+    updated = incremental.ingest(args.stabilite)
+    if updated:
+        print(f"✅ Ingestion incrémentale ({', '.join(updated)}) en {time.time() - t0:.1f} s")
+    else:
+        print("✅ Aucun fichier ERA5 nouveau ou modifié")
+
+
+def cmd_watch(args):
+    try:
+        incremental.watch(args.intervalle, args.stabilite)
+    except KeyboardInterrupt:
+        print("Surveillance arrêtée")
+
+
+def cmd_static(args):
+    t0 = time.time()
+    assets = static.prepare_all()
+    variants = sum(len(asset.variants) for asset in assets)
+    print(f"✅ {len(assets)} fichiers statiques, {variants} variantes compressées -> {static.STATIC_DIR} "
+          f"({time.time() - t0:.1f} s)")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='python -m core.ingest', description="Ingestion ERA5")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('rechunk', help="Réécrit les cubes ERA5 en blocs temporels contigus (data/store/)")
+    p.add_argument('--stream', choices=list(ERA5_FILES) + ['all'], default='all')
+    p.add_argument('--pixel-chunk', type=int, default=store.DEFAULT_PIXEL_CHUNK,
+                   help="Taille des blocs spatiaux en pixels (défaut : %(default)s)")
+    p.add_argument('--force', action='store_true', help="Réécrit même si le stockage est à jour")
+    p.set_defaults(func=cmd_rechunk)
+
+    p = sub.add_parser('rollups', help="Précalcule les agrégats jour/semaine/mois par région")
+    p.add_argument('--variable', nargs='+', default=['t2m'])
+    p.set_defaults(func=cmd_rollups)
+
+    p = sub.add_parser('cube', help="Fusionne température et précipitations désaccumulées (data/store/)")
+    p.set_defaults(func=cmd_cube)
+
+    p = sub.add_parser('snapshot', help="Écrit l'instantané binaire de démarrage rapide (data/snapshot/)")
+    p.add_argument('--encodage', choices=memory.ENCODINGS,
+                   help="Type des flux ERA5 (défaut : [memoire] encodage de pywps.cfg)")
+    p.set_defaults(func=cmd_snapshot)
+
+    p = sub.add_parser('append', help="Intègre les fichiers ERA5 nouveaux ou modifiés (séries et agrégats)")
+    p.add_argument('--stabilite', type=float, default=incremental.STABLE_SECONDS,
+                   help="Ancienneté minimale (s) d'un fichier avant intégration (défaut : %(default)s)")
+    p.set_defaults(func=cmd_append)
+
+    p = sub.add_parser('watch', help="Surveille data/ et intègre les fichiers ERA5 au fil de l'eau")
+    p.add_argument('--intervalle', type=float, default=incremental.WATCH_INTERVAL,
+                   help="Secondes entre deux passages (défaut : %(default)s)")
+    p.add_argument('--stabilite', type=float, default=incremental.STABLE_SECONDS,
+                   help="Ancienneté minimale (s) d'un fichier avant intégration (défaut : %(default)s)")
+    p.set_defaults(func=cmd_watch)
+
+    p = sub.add_parser('static', help="Empreintes et variantes gzip / brotli des fichiers servis (data/store/statique/)")
+    p.set_defaults(func=cmd_static)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    # Mêmes réglages que le serveur (sections [era5], [memoire])
+    configuration.load_configuration(['pywps.cfg'])
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
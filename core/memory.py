@@ -0,0 +1,210 @@
+"""Budget mémoire du catalogue et rapport d'empreinte par jeu de données.
+
+Section [memoire] de pywps.cfg :
+
+  - budget_mo : plafond (Mo) des objets dérivés que le catalogue garde en
+    mémoire (séries régionales réduites, climatologies, agrégats, index).
+    Au-delà, les moins récemment utilisés sont libérés puis recalculés à
+    la demande. 0 = pas de plafond ;
+  - encodage : type des flux ERA5 écrits dans l'instantané binaire
+    (core/snapshot.py) : 'float32', ou 'int16' quantifié (échelle et
+    décalage par variable, décodé bloc par bloc à la lecture).
+
+Les tableaux mappés de l'instantané ne comptent pas dans le budget : le
+noyau charge leurs pages à la demande, les partage entre processus et
+peut les libérer. Leur part résidente est lue dans /proc/self/smaps
+(Linux) ; elle est exposée avec le reste par /memory et /metrics.
+"""
+import mmap
+import os
+import sys
+import threading
+from types import MappingProxyType
+
+import numpy as np
+from pywps import configuration
+
+ENCODINGS = ('float32', 'int16')
+# Valeur int16 réservée aux valeurs manquantes
+INT16_FILL = -32768
+INT16_MAX = 32767
+
+SMAPS_FILE = '/proc/self/smaps'
+STATM_FILE = '/proc/self/statm'
+
+
+def _config(option, default):
+    value = configuration.get_config_value('memoire', option, default)
+    return default if value == '' else value
+
+
+def budget_bytes():
+    """Plafond des objets dérivés du catalogue en octets (0 : illimité)."""
+    return int(float(_config('budget_mo', 0)) * 1024 ** 2)
+
+
+def encoding():
+    value = str(_config('encodage', 'float32')).lower()
+    if value not in ENCODINGS:
+        raise ValueError(f"Encodage inconnu : {value} ({', '.join(ENCODINGS)})")
+    return value
+
+
+def int16_codec(vmin, vmax):
+    """(échelle, décalage, min, max) qui répartit [vmin, vmax] sur les valeurs int16 non réservées."""
+    if not np.isfinite(vmin) or not np.isfinite(vmax):
+        return 1.0, 0.0, 0.0, 0.0
+    vmin, vmax = float(vmin), float(vmax)
+    scale = (vmax - vmin) / (2 * INT16_MAX) or 1.0
+    return scale, (vmax + vmin) / 2, vmin, vmax
+
+
+def encode_int16(values, codec):
+    scale, offset = codec[:2]
+    coded = np.round((np.asarray(values, dtype=np.float64) - offset) / scale)
+    coded = np.clip(np.nan_to_num(coded, nan=INT16_FILL), INT16_FILL, INT16_MAX)
+    return coded.astype(np.int16)
+
+
+def decode_int16(coded, codec):
+    scale, offset, vmin, vmax = codec
+    values = coded.astype(np.float32) * np.float32(scale) + np.float32(offset)
+    # Bornes exactes : un zéro (pluie nulle) reste un zéro malgré l'arrondi float32
+    np.clip(values, np.float32(vmin), np.float32(vmax), out=values)
+    values[coded == INT16_FILL] = np.nan
+    return values
+
+
+def _buffer(array):
+    """(propriétaire du tampon, fichier mappé ou None) d'un tableau NumPy."""
+    owner, filename = array, None
+    while isinstance(owner, np.ndarray) and owner.base is not None:
+        if isinstance(owner, np.memmap) and owner.filename:
+            filename = owner.filename
+        owner = owner.base
+    return owner, filename
+
+
+def footprint(obj, seen=None):
+    """(octets en mémoire, octets mappés, fichiers mappés) de `obj` et de ce qu'il référence.
+
+    Parcourt tableaux NumPy, conteneurs et attributs des objets de core.* ;
+    les tampons partagés entre vues ne comptent qu'une fois. `seen`
+    (identifiants d'objets déjà comptés) est complété au passage : un
+    objet partagé par plusieurs données n'est compté que pour la première.
+    """
+    # shapely n'est consulté que s'il a déjà été importé
+    shapely = sys.modules.get('shapely')
+    heap = mapped = 0
+    files = set()
+    seen = set() if seen is None else seen
+    stack = [obj]
+    while stack:
+        o = stack.pop()
+        if id(o) in seen:
+            continue
+        seen.add(id(o))
+        if isinstance(o, np.ndarray):
+            owner, filename = _buffer(o)
+            if owner is not o and id(owner) in seen:
+                continue
+            seen.add(id(owner))
+            size = owner.nbytes if isinstance(owner, np.ndarray) else len(owner)
+            if filename or isinstance(owner, mmap.mmap):
+                mapped += size
+                if filename:
+                    files.add(os.path.abspath(filename))
+            else:
+                heap += size
+                if o.dtype == object:
+                    stack.extend(o.ravel().tolist())
+        elif isinstance(o, (dict, MappingProxyType)):
+            heap += sys.getsizeof(o)
+            stack.extend(o.keys())
+            stack.extend(o.values())
+        elif isinstance(o, (list, tuple, set, frozenset)):
+            heap += sys.getsizeof(o)
+            stack.extend(o)
+        elif isinstance(o, (str, bytes, bytearray, int, float)):
+            heap += sys.getsizeof(o)
+        elif shapely is not None and isinstance(o, shapely.Geometry):
+            # Coordonnées GEOS (2 flottants par sommet), invisibles pour sys.getsizeof
+            heap += 16 * int(shapely.get_num_coordinates(o))
+        elif type(o).__module__.startswith('core.'):
+            attrs = getattr(o, '__dict__', None)
+            if attrs is None:
+                attrs = {name: getattr(o, name) for name in getattr(o, '__slots__', ()) if hasattr(o, name)}
+            heap += sys.getsizeof(o)
+            stack.extend(attrs.values())
+    return heap, mapped, files
+
+
+def mapped_resident():
+    """Octets résidents par fichier mappé dans le processus ({} hors Linux)."""
+    resident = {}
+    try:
+        with open(SMAPS_FILE, 'r') as f:
+            path = None
+            for line in f:
+                fields = line.split()
+                if not fields:
+                    continue
+                if '-' in fields[0] and len(fields) >= 5 and not fields[0].endswith(':'):
+                    # En-tête de zone : adresse, droits, décalage, périphérique, inode, chemin
+                    path = fields[5] if len(fields) > 5 else None
+                elif fields[0] == 'Rss:' and path:
+                    resident[path] = resident.get(path, 0) + int(fields[1]) * 1024
+    except OSError:
+        return {}
+    return resident
+
+
+def process_rss():
+    """Mémoire résidente du processus en octets (None hors Linux)."""
+    try:
+        with open(STATM_FILE, 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def report(catalog):
+    """Empreinte de chaque donnée du catalogue, du budget et du processus (dict JSON)."""
+    resident = mapped_resident()
+    datasets = []
+    for label, derived, heap, mapped, files in catalog.footprints():
+        datasets.append({
+            'donnee': label,
+            'derivee': derived,
+            'memoire_o': heap,
+            'mappe_o': mapped,
+            'mappe_resident_o': sum(resident.get(path, 0) for path in files),
+        })
+    return {
+        'budget_o': budget_bytes(),
+        'derivees_o': sum(d['memoire_o'] for d in datasets if d['derivee']),
+        'liberations': catalog.evictions,
+        'processus_rss_o': process_rss(),
+        'donnees': sorted(datasets, key=lambda d: -(d['memoire_o'] + d['mappe_resident_o'])),
+    }
+
+
+# Jauge wps_dataset_bytes : type d'empreinte -> clé du rapport
+GAUGE_KINDS = {'heap': 'memoire_o', 'mapped': 'mappe_o', 'mapped_resident': 'mappe_resident_o'}
+
+_lock = threading.Lock()
+
+
+def publish(catalog, registry):
+    """Met à jour les jauges d'empreinte du registre de métriques."""
+    data = report(catalog)
+    with _lock:
+        registry.clear('wps_dataset_bytes')
+        for d in data['donnees']:
+            for kind, key in GAUGE_KINDS.items():
+                registry.set('wps_dataset_bytes', {'dataset': d['donnee'], 'kind': kind}, d[key])
+        registry.set('wps_memory_budget_bytes', {}, data['budget_o'])
+        registry.set('wps_catalog_evictions', {}, data['liberations'])
+        if data['processus_rss_o'] is not None:
+            registry.set('wps_process_resident_bytes', {}, data['processus_rss_o'])
+    return data
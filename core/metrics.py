@@ -0,0 +1,241 @@
+"""Instrumentation légère des processus et export /metrics (format Prometheus).
+
+Chaque exécution est chronométrée par étapes : les appels existants à
+core.progress.report() marquent le début de chaque étape, le cache de
+résultats marque sa consultation. On mesure aussi les octets lus dans
+les cubes ERA5 et la taille de la sortie JSON. Le tout alimente des
+histogrammes exposés en texte Prometheus par la route /metrics ;
+l'entrée `debug_timings=true` ajoute le détail au résultat JSON.
+
+Les compteurs sont propres à chaque processus serveur : les jobs
+asynchrones, exécutés par pywps dans un sous-processus, n'y figurent pas.
+"""
+import bisect
+import functools
+import json
+import threading
+import time
+
+from pywps import LiteralInput
+
+from core.outputs import dumps_compact
+
+# Bornes des histogrammes (secondes, octets)
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+# Nom -> (type, description, bornes)
+METRICS = {
+    'wps_process_seconds': ('histogram', "Durée d'exécution des processus (cache compris)", DURATION_BUCKETS),
+    'wps_stage_seconds': ('histogram', "Durée des étapes des processus", DURATION_BUCKETS),
+    'wps_http_request_seconds': ('histogram', "Durée des requêtes /wps (XML pywps compris)", DURATION_BUCKETS),
+    'wps_output_bytes': ('histogram', "Taille des sorties JSON des processus", SIZE_BUCKETS),
+    'wps_cache_requests_total': ('counter', "Consultations du cache de résultats", None),
+    'wps_era5_bytes_read_total': ('counter', "Octets lus dans les cubes ERA5", None),
+    # Jauges d'empreinte mémoire, mises à jour à chaque export (core/memory.py)
+    'wps_dataset_bytes': ('gauge', "Empreinte des données du catalogue (heap, mapped, mapped_resident)", None),
+    'wps_memory_budget_bytes': ('gauge', "Budget mémoire des objets dérivés (0 = illimité)", None),
+    'wps_catalog_evictions': ('gauge', "Objets dérivés libérés pour tenir le budget", None),
+    'wps_process_resident_bytes': ('gauge', "Mémoire résidente du processus serveur", None),
+}
+
+# Opérations WPS retenues comme label (le reste est regroupé)
+OPERATIONS = {'getcapabilities', 'describeprocess', 'execute'}
+
+# Étape ouverte au début de chaque exécution
+FIRST_STAGE = 'preparation'
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    """Compteurs et histogrammes étiquetés, protégés par un verrou."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = {name: {} for name in METRICS}
+
+    def inc(self, name, labels, amount=1):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            values = self._values[name]
+            values[key] = values.get(key, 0) + amount
+
+    def set(self, name, labels, value):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[name][key] = value
+
+    def clear(self, name):
+        with self._lock:
+            self._values[name] = {}
+
+    def observe(self, name, labels, value):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            hist = self._values[name].get(key)
+            if hist is None:
+                hist = self._values[name][key] = Histogram(METRICS[name][2])
+            hist.observe(value)
+
+    def render(self):
+        """Texte d'exposition Prometheus (version 0.0.4)."""
+        lines = []
+        with self._lock:
+            for name, (kind, help_text, buckets) in METRICS.items():
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} {kind}')
+                for key, value in sorted(self._values[name].items()):
+                    if kind in ('counter', 'gauge'):
+                        lines.append(f'{name}{_labels(key)} {value}')
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(buckets + ('+Inf',), value.counts):
+                        cumulative += count
+                        lines.append(f'{name}_bucket{_labels(key + (("le", str(bound)),))} {cumulative}')
+                    lines.append(f'{name}_sum{_labels(key)} {value.sum:.6f}')
+                    lines.append(f'{name}_count{_labels(key)} {value.count}')
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(key):
+    if not key:
+        return ''
+    parts = []
+    for name, value in key:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{name}="{value}"')
+    return '{' + ','.join(parts) + '}'
+
+
+REGISTRY = Registry()
+_local = threading.local()
+
+
+class Timer:
+    """Mesures d'une exécution de processus (thread courant)."""
+
+    def __init__(self, process):
+        self.process = process
+        self.start = time.perf_counter()
+        self.stages = {}
+        self.cache = None
+        self.era5_bytes = 0
+        self.output_bytes = None
+        self.total = None
+        self._stage, self._stage_start = FIRST_STAGE, self.start
+
+    def mark(self, stage):
+        now = time.perf_counter()
+        self.stages[self._stage] = self.stages.get(self._stage, 0.0) + now - self._stage_start
+        self._stage, self._stage_start = stage, now
+
+    def finish(self):
+        self.mark(None)
+        self.total = time.perf_counter() - self.start
+
+    def breakdown(self):
+        return {
+            'total_ms': round(self.total * 1000, 2),
+            'etapes_ms': {k: round(v * 1000, 2) for k, v in self.stages.items()},
+            'cache': self.cache,
+            'octets_era5_lus': self.era5_bytes,
+            'octets_sortie': self.output_bytes,
+        }
+
+
+def current():
+    return getattr(_local, 'timer', None)
+
+
+def mark_stage(stage):
+    """Début d'une étape de l'exécution en cours (sans effet hors processus instrumenté)."""
+    timer = current()
+    if timer is not None:
+        timer.mark(stage)
+
+
+def record_cache(hit):
+    result = 'hit' if hit else 'miss'
+    timer = current()
+    process = timer.process if timer else ''
+    if timer is not None:
+        timer.cache = result
+    REGISTRY.inc('wps_cache_requests_total', {'process': process, 'result': result})
+
+
+def record_era5_read(var_name, nbytes):
+    timer = current()
+    if timer is not None:
+        timer.era5_bytes += int(nbytes)
+    REGISTRY.inc('wps_era5_bytes_read_total', {'variable': var_name}, int(nbytes))
+
+
+def observe_http(args, seconds, processes=()):
+    """Durée d'une requête /wps ; le processus n'est étiqueté que s'il est connu."""
+    lowered = {k.lower(): v for k, v in args.items()}
+    operation = lowered.get('request', 'post').lower()
+    if operation not in OPERATIONS and operation != 'post':
+        operation = 'autre'
+    process = lowered.get('identifier', '')
+    REGISTRY.observe('wps_http_request_seconds',
+                     {'operation': operation, 'process': process if process in processes else ''},
+                     seconds)
+
+
+def render():
+    return REGISTRY.render()
+
+
+def debug_timings_input():
+    """Entrée optionnelle `debug_timings` commune à tous les processus."""
+    return LiteralInput('debug_timings', 'Inclure le detail des temps dans le resultat',
+                        data_type='boolean', default=False, min_occurs=0)
+
+
+def _debug_requested(request):
+    values = request.inputs.get('debug_timings')
+    return bool(values) and bool(values[0].data)
+
+
+def instrumented(handler):
+    """Décorateur de `_handler` (au-dessus de @cached_execute) : mesures + debug_timings."""
+    @functools.wraps(handler)
+    def wrapper(self, request, response):
+        timer = Timer(self.identifier)
+        _local.timer = timer
+        try:
+            response = handler(self, request, response)
+        finally:
+            _local.timer = None
+            timer.finish()
+        payload = response.outputs['output'].data
+        if isinstance(payload, str):
+            payload = payload.encode('utf-8')
+        timer.output_bytes = len(payload or b'')
+
+        labels = {'process': self.identifier}
+        REGISTRY.observe('wps_process_seconds', labels, timer.total)
+        REGISTRY.observe('wps_output_bytes', labels, timer.output_bytes)
+        for stage, seconds in timer.stages.items():
+            REGISTRY.observe('wps_stage_seconds', dict(labels, stage=stage), seconds)
+
+        if _debug_requested(request):
+            result = json.loads(payload)
+            if isinstance(result, dict):
+                result['debug_timings'] = timer.breakdown()
+                # Resérialisé compact : l'indentation multiplierait la taille des sorties en colonnes
+                response.outputs['output'].data = dumps_compact(result)
+        return response
+    return wrapper
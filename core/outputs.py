@@ -0,0 +1,174 @@
+"""Sorties des processus et nettoyage du dossier outputs/.
+
+Les résultats JSON sont placés directement dans `ComplexOutput.data` :
+pywps les renvoie depuis la mémoire pour une requête synchrone
+(RawDataOutput) et les écrit lui-même dans un fichier unique par job
+(outputs/<uuid>/...) quand la sortie est demandée par référence. Plus
+aucun chemin fixe partagé entre requêtes concurrentes.
+
+Les séries temporelles peuvent être produites en colonnes (un tableau par
+grandeur au lieu d'un objet par pas de temps) et sérialisées sans
+indentation par orjson s'il est installé.
+
+Le « janitor » est un thread de fond qui supprime les sorties trop
+anciennes puis les plus vieilles tant que outputs/ dépasse sa taille max.
+"""
+import json
+import os
+import threading
+import time
+
+import numpy as np
+from pywps import configuration
+
+try:
+    import orjson
+except ImportError:  # encodeur standard en repli
+    orjson = None
+
+OUTPUTS_DIR = 'outputs'
+# Fichiers de fonctionnement de pywps jamais supprimés
+PROTECTED = {'pywps.log', 'pywps-logs.sqlite3'}
+# Formats des séries temporelles : un objet par pas, colonnes, colonnes + axe début/pas
+SERIES_FORMATS = ('objets', 'colonnes', 'colonnes_compactes')
+
+
+def _numpy_default(obj):
+    if isinstance(obj, np.ndarray):
+        if obj.dtype.kind == 'f':
+            # NaN -> null, comme orjson
+            return np.where(np.isnan(obj), None, obj).tolist()
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f"Type non sérialisable : {type(obj).__name__}")
+
+
+def dumps_compact(result):
+    """JSON sans espaces ; accepte les tableaux NumPy (orjson si disponible)."""
+    if orjson is not None:
+        return orjson.dumps(result, option=orjson.OPT_SERIALIZE_NUMPY).decode('utf-8')
+    return json.dumps(result, ensure_ascii=False, separators=(',', ':'), default=_numpy_default)
+
+
+def json_output(response, result, indent=None, output='output', compact=False):
+    """Place le résultat JSON en mémoire dans la sortie de la réponse WPS."""
+    if compact:
+        response.outputs[output].data = dumps_compact(result)
+    else:
+        response.outputs[output].data = json.dumps(result, ensure_ascii=False, indent=indent)
+    return response
+
+
+def date_strings(times):
+    """Dates ISO vectorisées : jour seul pour des pas d'un jour ou plus, sinon à la minute."""
+    times = np.asarray(times)
+    if times.dtype.kind != 'M':
+        times = times.astype('datetime64[D]')
+    step = np.diff(times).min() if len(times) > 1 else np.timedelta64(1, 'D')
+    unit = 'D' if step >= np.timedelta64(1, 'D') else 'm'
+    return np.datetime_as_string(times, unit=unit)
+
+
+def time_axis(times, dates, compact=False):
+    """Axe temporel d'une série en colonnes.
+
+    `compact` remplace la liste des dates par début + pas (secondes) quand
+    les pas de temps sont réguliers.
+    """
+    if compact and len(times) > 1:
+        seconds = np.asarray(times).astype('datetime64[s]').astype(np.int64)
+        steps = np.diff(seconds)
+        if np.all(steps == steps[0]):
+            return {'debut': str(dates[0]), 'pas_s': int(steps[0])}
+    return {'dates': list(dates)}
+
+
+def _config(option, default):
+    value = configuration.get_config_value('outputs', option, default)
+    return default if value == '' else value
+
+
+def _entries(root):
+    """(mtime, taille, chemin) de chaque fichier de outputs/, hors fichiers protégés."""
+    entries = []
+    for dirpath, _dirnames, filenames in os.walk(root):
+        for name in filenames:
+            if dirpath == root and (name in PROTECTED or name.startswith('pywps-logs.sqlite3')):
+                continue
+            path = os.path.join(dirpath, name)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+    return entries
+
+
+def _remove_empty_dirs(root):
+    for dirpath, dirnames, filenames in os.walk(root, topdown=False):
+        if dirpath != root and not dirnames and not filenames:
+            try:
+                os.rmdir(dirpath)
+            except OSError:
+                pass
+
+
+def clean_outputs(root=OUTPUTS_DIR, max_age_s=24 * 3600, max_bytes=200 * 1024 ** 2, now=None):
+    """Supprime les sorties plus vieilles que max_age_s, puis les plus anciennes
+    jusqu'à repasser sous max_bytes. Retourne (fichiers supprimés, octets libérés)."""
+    now = time.time() if now is None else now
+    entries = sorted(_entries(root))
+    total = sum(size for _mtime, size, _path in entries)
+    removed = freed = 0
+    for mtime, size, path in entries:
+        if now - mtime <= max_age_s and total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        removed += 1
+        freed += size
+    _remove_empty_dirs(root)
+    return removed, freed
+
+
+class OutputJanitor(threading.Thread):
+    """Thread de fond qui applique clean_outputs() à intervalle régulier."""
+
+    def __init__(self, root=OUTPUTS_DIR, interval_s=600, max_age_s=24 * 3600, max_bytes=200 * 1024 ** 2):
+        super().__init__(name='outputs-janitor', daemon=True)
+        self.root = root
+        self.interval_s = interval_s
+        self.max_age_s = max_age_s
+        self.max_bytes = max_bytes
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                clean_outputs(self.root, self.max_age_s, self.max_bytes)
+            except OSError as e:
+                print(f"⚠️ Nettoyage outputs/ : {e}")
+            self._stop_event.wait(self.interval_s)
+
+    def stop(self):
+        self._stop_event.set()
+
+
+_JANITOR = None
+
+
+def start_janitor():
+    """Démarre le janitor (une fois par processus) selon la section [outputs] de pywps.cfg."""
+    global _JANITOR
+    if _JANITOR is None and _config('janitor', True):
+        _JANITOR = OutputJanitor(
+            root=configuration.get_config_value('server', 'outputpath') or OUTPUTS_DIR,
+            interval_s=float(_config('janitor_interval_s', 600)),
+            max_age_s=float(_config('max_age_hours', 24)) * 3600,
+            max_bytes=float(_config('max_size_mb', 200)) * 1024 ** 2)
+        _JANITOR.start()
+    return _JANITOR
@@ -0,0 +1,31 @@
+"""Progression par étapes des processus, publiée dans le document de statut WPS.
+
+En mode asynchrone (storeExecute=true&status=true), pywps exécute le job
+dans un processus séparé (mode 'default' = multiprocessing, au plus
+`parallelprocesses` jobs simultanés, les suivants attendent en file
+jusqu'à `maxprocesses`) et le client interroge statusLocation. Chaque
+étape met à jour ce document. En mode synchrone le statut n'est pas
+publié : on évite une écriture SQLite inutile par étape.
+
+Chaque étape sert aussi de borne au chronométrage de core.metrics.
+"""
+from core import metrics
+
+# Étape -> (pourcentage atteint au début de l'étape, message)
+STAGES = {
+    'chargement': (10, "Chargement des données"),
+    'selection': (30, "Sélection spatiale"),
+    'reduction': (60, "Réduction des données ERA5"),
+    'serialisation': (90, "Sérialisation du résultat"),
+}
+
+
+def report(response, stage, detail=None):
+    """Publie l'étape `stage` dans le statut du job (uniquement pour un job asynchrone)."""
+    metrics.mark_stage(stage)
+    if not getattr(response, 'store_status_file', False):
+        return
+    percent, message = STAGES[stage]
+    if detail:
+        message = f"{message} ({detail})"
+    response.update_status(message, percent)
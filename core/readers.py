@@ -0,0 +1,177 @@
+"""Lecture concurrente des NetCDF ERA5.
+
+La bibliothèque netCDF4 / HDF5 n'est pas sûre entre threads, même sur des
+fichiers distincts : xarray sérialise toutes les lectures d'un processus
+derrière un verrou global (`netcdf_lock`), que les accès directs à netCDF4
+doivent aussi prendre. Des requêtes simultanées qui relisent l'archive
+(zone GeoJSON, percentiles) avancent donc une à une. Deux façons de lire
+en parallèle :
+
+  - l'instantané binaire (core/snapshot.py) : tableaux .npy mappés, sans
+    HDF5, lus sans verrou par tous les threads ;
+  - le pool de lecteurs : `lecteurs` processus (section [era5] de
+    pywps.cfg), démarrés à la première lecture. Chacun a sa propre
+    bibliothèque HDF5 et garde ses fichiers ouverts ; les threads des
+    requêtes leur envoient les blocs à lire et reçoivent les tableaux.
+
+Les lecteurs sont démarrés en 'spawn' : le module principal du serveur
+(gunicorn, flask) y est réimporté, il doit protéger son code de lancement
+par `if __name__ == '__main__'`.
+
+Sans pool (lecteurs = 0), les blocs sont lus dans le thread de la requête,
+sous le verrou d'xarray. Dans les deux cas les fichiers restent ouverts
+d'une lecture à l'autre (rouverts si le fichier change sur disque).
+"""
+import multiprocessing
+import os
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from itertools import islice
+
+from pywps import configuration
+
+from core.catalog import ERA5_FILES, era5_store_path, normalize_era5
+
+# Cache de blocs HDF5 par variable ouverte (64 Mo par défaut) : les fichiers
+# restant ouverts, il est réduit ; les lectures par blocs de temps ne
+# relisent de toute façon jamais deux fois le même bloc
+CHUNK_CACHE_BYTES = 4 * 1024 ** 2
+
+# Fichiers ouverts par processus : (flux, chemin) -> (état des fichiers, Dataset)
+_handles = {}
+_handles_lock = threading.Lock()
+
+# Pool du processus courant : (pid, ReaderPool) ; un fork (gunicorn) en recrée un
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _config(option, default):
+    value = configuration.get_config_value('era5', option, default)
+    return default if value == '' else value
+
+
+def netcdf_lock():
+    """Verrou global d'xarray autour de la bibliothèque netCDF4 / HDF5."""
+    # Import local : xarray n'est chargé qu'à la lecture des NetCDF
+    from xarray.backends.netCDF4_ import NETCDF4_PYTHON_LOCK
+    return NETCDF4_PYTHON_LOCK
+
+
+def open_source(stream, path):
+    """Dataset xarray (paresseux) d'un fichier du flux ; le fichier historique passe par data/store/."""
+    _set_chunk_cache()
+    if path == ERA5_FILES.get(stream):
+        # Import local : core.store dépend du catalogue
+        from core.store import open_era5
+        return open_era5(stream)
+    import xarray as xr
+    return normalize_era5(xr.open_dataset(path, engine='netcdf4', decode_times=True))
+
+
+_chunk_cache_set = False
+
+
+def _set_chunk_cache():
+    """Taille du cache de blocs HDF5 des fichiers ouverts ensuite (une fois par processus)."""
+    global _chunk_cache_set
+    if not _chunk_cache_set:
+        import netCDF4
+        with netcdf_lock():
+            netCDF4.set_chunk_cache(CHUNK_CACHE_BYTES)
+        _chunk_cache_set = True
+
+
+def _state(stream, path):
+    paths = [path, era5_store_path(stream)] if path == ERA5_FILES.get(stream) else [path]
+    state = []
+    for p in paths:
+        try:
+            st = os.stat(p)
+            state.append((st.st_mtime_ns, st.st_size))
+        except FileNotFoundError:
+            state.append(None)
+    return tuple(state)
+
+
+def dataset(stream, path):
+    """Dataset du fichier, ouvert une fois par processus et partagé par les threads."""
+    key, state = (stream, path), _state(stream, path)
+    with _handles_lock:
+        cached = _handles.get(key)
+        if cached is None or cached[0] != state:
+            # L'ancien handle est fermé par le ramasse-miettes (une lecture en cours le garde)
+            cached = (state, open_source(stream, path))
+            _handles[key] = cached
+    return cached[1]
+
+
+def read_block(stream, path, var_name, times, window=None):
+    """Valeurs (temps, lat, lon) de `var_name` aux indices `times` (tranche ou tableau) du fichier."""
+    da = dataset(stream, path)[var_name].transpose('time', 'latitude', 'longitude')
+    if window is not None:
+        da = da.isel(latitude=window[0], longitude=window[1])
+    return da.isel(time=times).values
+
+
+class ReaderPool:
+    """Processus lecteurs : chacun ouvre ses propres fichiers et lit les blocs demandés."""
+
+    def __init__(self, workers):
+        self.workers = workers
+        # 'spawn' : processus neufs, sans l'état HDF5 ni les threads du serveur
+        self.executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'))
+
+    def read(self, tasks):
+        """Blocs des tâches (arguments de read_block), dans l'ordre, `workers` lectures d'avance."""
+        tasks = iter(tasks)
+        pending = deque(self.executor.submit(read_block, *task) for task in islice(tasks, self.workers))
+        while pending:
+            future = pending.popleft()
+            task = next(tasks, None)
+            if task is not None:
+                pending.append(self.executor.submit(read_block, *task))
+            yield future.result()
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def get_reader_pool():
+    """Pool de lecteurs du processus, ou None si `lecteurs` vaut 0."""
+    global _pool
+    workers = int(_config('lecteurs', 0))
+    if workers <= 0:
+        return None
+    with _pool_lock:
+        if _pool is None or _pool[0] != os.getpid() or _pool[1].workers != workers:
+            if _pool is not None and _pool[0] == os.getpid():
+                _pool[1].shutdown()
+            _pool = (os.getpid(), ReaderPool(workers))
+        return _pool[1]
+
+
+def reset_reader_pool():
+    """Arrête le pool du processus (recréé à la lecture suivante)."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None and _pool[0] == os.getpid():
+            _pool[1].shutdown()
+        _pool = None
+
+
+def read_blocks(tasks):
+    """Blocs des tâches (arguments de read_block), par le pool s'il est actif."""
+    pool = get_reader_pool()
+    if pool is None:
+        for task in tasks:
+            yield read_block(*task)
+        return
+    try:
+        yield from pool.read(tasks)
+    except BrokenProcessPool:
+        # Lecteur tué (mémoire, signal) : pool recréé à la requête suivante
+        reset_reader_pool()
+        raise
@@ -0,0 +1,197 @@
+"""Index des régions construit une seule fois à partir du Shapefile.
+
+Remplace la recherche `gdf['nom_region'].str.contains(...)` + `to_crs('EPSG:3857')`
+de chaque requête : les noms (français, arabe, code) sont normalisés et
+indexés dans un dictionnaire, et les superficies sont calculées une fois
+sur l'ellipsoïde WGS84 (aires géodésiques, sans la déformation de Mercator).
+Un arbre STRtree sur les polygones rattache un point à sa région
+(`locate`) sans parcourir le GeoDataFrame. Superficies, emprises et
+centroïdes sont repris de l'instantané binaire (core/snapshot.py)
+quand il est à jour.
+"""
+import re
+import unicodedata
+from collections import namedtuple
+from functools import lru_cache
+
+import numpy as np
+
+from core.catalog import get_catalog
+
+Region = namedtuple('Region', 'pos code nom nom_arabe area_km2 bounds centroid')
+
+# Valeur de l'entrée 'region' qui sélectionne toutes les régions
+ALL_REGIONS = '*'
+# Nombre maximal de valeurs 'region' dans une même requête
+MAX_REGIONS = 20
+
+# Préfixes administratifs ignorés lors de la recherche
+_PREFIXES = ('region de la ', 'region de l ', 'region du ', 'region de ', 'region d ', 'region ')
+_PREFIX_AR = 'جهة '
+
+_ALEF = str.maketrans({'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا', 'ى': 'ي'})
+_SEP = re.compile(r"[\s\-'’_,.]+")
+
+
+def normalize_name(text):
+    """Clé de recherche : sans accents ni casse, séparateurs unifiés."""
+    text = unicodedata.normalize('NFKD', str(text))
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    text = text.translate(_ALEF).lower()
+    return _SEP.sub(' ', text).strip()
+
+
+def _short_name(key):
+    for prefix in _PREFIXES + (_PREFIX_AR,):
+        if key.startswith(prefix):
+            return key[len(prefix):]
+    return key
+
+
+def region_arrays(layer):
+    """Superficies géodésiques (km²), emprises et centroïdes (lon, lat) des régions."""
+    # Import local : pyproj et geopandas ne servent que sans instantané à jour
+    import shapely
+    from pyproj import Geod
+    geod = Geod(ellps='WGS84')
+    areas_km2 = np.array([abs(geod.geometry_area_perimeter(g)[0]) / 1e6 for g in layer.geometries])
+    # Centroïdes calculés en projection équivalente (EPSG:6933) puis ramenés en degrés
+    centroids = layer.frame().geometry.to_crs('EPSG:6933').centroid.to_crs('EPSG:4326')
+    return {
+        'areas_km2': areas_km2,
+        'bounds': shapely.bounds(layer.geometries),
+        'centroids': np.column_stack([centroids.x.to_numpy(), centroids.y.to_numpy()]),
+    }
+
+
+class RegionIndex:
+    """Résolution O(1) d'un nom de région + superficies précalculées."""
+
+    def __init__(self, layer):
+        # Import local : shapely n'est chargé qu'à la construction de l'index
+        import shapely
+        from shapely import STRtree
+
+        self.geometries = layer.geometries
+        self.names = [str(n) for n in layer.column('nom_region')]
+        self.names_ar = [str(n) if n is not None else '' for n in layer.column('nom_arabe', '')]
+        codes = layer.column('CODE_REGIO')
+        self.codes = [int(c) for c in codes] if None not in codes else list(range(1, len(layer) + 1))
+        self._records = layer.records
+
+        arrays = layer.arrays if layer.arrays is not None else region_arrays(layer)
+        self.areas_km2 = arrays['areas_km2']
+        self.bounds = arrays['bounds']
+        self.centroids = arrays['centroids']
+        # Arbre spatial sur les polygones préparés (tests point-dans-polygone rapides)
+        shapely.prepare(self.geometries)
+        self.tree = STRtree(self.geometries)
+
+        self._keys = {}
+        self._short = []
+        parts = {}
+        for pos, (nom, nom_ar, code) in enumerate(zip(self.names, self.names_ar, self.codes)):
+            key, key_ar = normalize_name(nom), normalize_name(nom_ar)
+            short = _short_name(key)
+            self._short.append(short)
+            for k in (key, short, key_ar, _short_name(key_ar), str(code)):
+                if k:
+                    self._keys.setdefault(k, pos)
+            # Chaque composante du nom ("souss", "massa", "al hoceima"...)
+            for part in re.split(r'-', nom) + re.split(r'-', nom_ar):
+                part = _short_name(normalize_name(part))
+                if part:
+                    parts.setdefault(part, set()).add(pos)
+        for part, positions in parts.items():
+            if len(positions) == 1:
+                self._keys.setdefault(part, next(iter(positions)))
+        self.resolve_pos = lru_cache(maxsize=1024)(self._resolve_pos)
+
+    def _resolve_pos(self, query):
+        key = normalize_name(query)
+        if not key:
+            return None
+        pos = self._keys.get(key)
+        if pos is None:
+            pos = self._keys.get(_short_name(key))
+        if pos is None:
+            # Dernier recours : sous-chaîne, comme l'ancien str.contains
+            for i, short in enumerate(self._short):
+                if key in short:
+                    return i
+        return pos
+
+    def locate(self, lon, lat):
+        """Position de la région qui contient le point (lon, lat en degrés), ou None.
+
+        Sur une frontière commune, la première région du Shapefile l'emporte.
+        """
+        hits = self.tree.query(_point(lon, lat), predicate='intersects')
+        return int(hits.min()) if len(hits) else None
+
+    def __len__(self):
+        return len(self.names)
+
+    def region(self, pos):
+        return Region(pos, self.codes[pos], self.names[pos], self.names_ar[pos],
+                      float(self.areas_km2[pos]), tuple(self.bounds[pos]),
+                      tuple(self.centroids[pos]))
+
+    def resolve(self, query):
+        """Région correspondant à `query` (nom, nom arabe ou code), ou None."""
+        if query is None:
+            return None
+        pos = self.resolve_pos(str(query))
+        return None if pos is None else self.region(pos)
+
+    def resolve_many(self, queries):
+        """Résout une liste de requêtes ('*' = toutes les régions).
+
+        Retourne (régions trouvées sans doublon, requêtes non trouvées).
+        """
+        found, missing, seen = [], [], set()
+        for query in queries:
+            query = str(query).strip()
+            if query == ALL_REGIONS:
+                positions = range(len(self))
+            else:
+                pos = self.resolve_pos(query)
+                if pos is None:
+                    missing.append(query)
+                    continue
+                positions = [pos]
+            for pos in positions:
+                if pos not in seen:
+                    seen.add(pos)
+                    found.append(self.region(pos))
+        return found, missing
+
+    def attributes(self, pos):
+        """Attributs de la région sans la géométrie."""
+        return dict(self._records[pos])
+
+    def geometry(self, pos):
+        return self.geometries[pos]
+
+
+def _point(lon, lat):
+    # Import local : shapely n'est chargé qu'avec l'index des régions
+    import shapely
+    return shapely.Point(lon, lat)
+
+
+def region_inputs(request, name='region'):
+    """Valeurs brutes de l'entrée 'region' d'une requête WPS (répétée ou non)."""
+    if name not in request.inputs:
+        return []
+    return [inp.data for inp in request.inputs[name]]
+
+
+def is_batch(queries):
+    """Vrai si la requête demande plusieurs régions (résultat combiné)."""
+    return len(queries) > 1 or any(str(q).strip() == ALL_REGIONS for q in queries)
+
+
+def get_region_index():
+    """Index partagé, reconstruit seulement si le Shapefile change."""
+    return get_catalog().derived('region_index', ['regions'], RegionIndex)
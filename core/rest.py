@@ -0,0 +1,131 @@
+"""Exécution directe des processus en JSON (style OGC API - Processes).
+
+`POST /processes/<id>/execution` reçoit `{"inputs": {"region": "Fès",
+"date_debut": "2024-01-01"}}` (liste pour une entrée répétée, objet
+GeoJSON pour `zone`) et renvoie le résultat JSON dans la même réponse :
+ni XML Execute à construire et analyser, ni fichier écrit dans outputs/
+à relire. Les entrées sont validées par les définitions pywps du
+processus (types, valeurs permises, occurrences) puis le handler est
+appelé directement : cache de résultats et métriques sont les mêmes que
+pour /wps. `GET` accepte les entrées en paramètres de requête (réponse
+réutilisable par le navigateur grâce à l'ETag).
+
+Comme pywps, au plus `parallelprocesses` exécutions simultanées par
+processus serveur ; au-delà la requête est refusée (503).
+"""
+import json
+import threading
+
+from pywps import ComplexInput, LiteralInput, configuration
+from pywps.exceptions import InvalidParameterValue, MissingParameterValue, NoApplicableCode
+
+
+class InputError(ValueError):
+    """Entrées de la requête invalides (réponse 400)."""
+
+
+class _Output:
+    data = None
+
+
+class _Request:
+    """Partie de WPSRequest lue par les handlers : les entrées validées."""
+
+    def __init__(self, inputs):
+        self.inputs = inputs
+
+
+class _Response:
+    """Partie d'ExecuteResponse lue par les handlers ; pas de document de statut."""
+
+    store_status_file = False
+
+    def __init__(self):
+        self.outputs = {'output': _Output()}
+
+
+_slots = None
+_slots_lock = threading.Lock()
+
+
+def execution_slots():
+    """Sémaphore des exécutions simultanées (section [server], parallelprocesses)."""
+    global _slots
+    with _slots_lock:
+        if _slots is None:
+            limit = int(configuration.get_config_value('server', 'parallelprocesses') or 0)
+            _slots = threading.BoundedSemaphore(limit if limit > 0 else 1)
+    return _slots
+
+
+def body_inputs(body):
+    """Entrées {nom: [valeurs]} d'un corps JSON {"inputs": {...}}."""
+    if not isinstance(body, dict) or not isinstance(body.get('inputs', {}), dict):
+        raise InputError("Corps JSON attendu : {\"inputs\": {\"nom\": valeur, ...}}")
+    return {name: value if isinstance(value, list) else [value]
+            for name, value in body.get('inputs', {}).items()}
+
+
+def query_inputs(args):
+    """Entrées {nom: [valeurs]} des paramètres d'une requête GET (paramètre répétable)."""
+    return {name: args.getlist(name) for name in args}
+
+
+def _raw(value, definition):
+    if isinstance(definition, ComplexInput):
+        # GeoJSON envoyé comme objet ou comme texte
+        return {'data': value if isinstance(value, str) else json.dumps(value)}
+    if isinstance(value, (dict, list)):
+        raise InputError(f"Entrée '{definition.identifier}' : valeur simple attendue")
+    return {'data': str(value).lower() if isinstance(value, bool) else value}
+
+
+def parse_inputs(service, process, inputs):
+    """Entrées pywps (LiteralInput / ComplexInput clonés et validés) du processus.
+
+    Mêmes règles que pywps pour un Execute XML : valeurs converties au
+    type déclaré, défauts pour les entrées absentes, occurrences minimales.
+    """
+    definitions = {inp.identifier: inp for inp in process.inputs}
+    unknown = sorted(set(inputs) - set(definitions))
+    if unknown:
+        raise InputError(f"Entrée(s) inconnue(s) : {', '.join(unknown)}")
+    data_inputs = {}
+    try:
+        for name, definition in definitions.items():
+            values = inputs.get(name)
+            if not values:
+                if definition.min_occurs > 0:
+                    raise InputError(f"Entrée obligatoire manquante : {name}")
+                if definition._default is not None:
+                    data_inputs[name] = [definition.clone()]
+                continue
+            if len(values) > definition.max_occurs:
+                raise InputError(f"Entrée '{name}' : au plus {definition.max_occurs} valeur(s)")
+            raw = [_raw(v, definition) for v in values]
+            if isinstance(definition, ComplexInput):
+                data_inputs[name] = service.create_complex_inputs(definition, raw)
+            elif isinstance(definition, LiteralInput):
+                data_inputs[name] = service.create_literal_inputs(definition, raw)
+    except (InvalidParameterValue, MissingParameterValue, NoApplicableCode, ValueError, TypeError) as e:
+        if isinstance(e, InputError):
+            raise
+        raise InputError(f"Entrée invalide : {getattr(e, 'description', None) or e}")
+    return data_inputs
+
+
+def execute(service, process, inputs):
+    """JSON (texte) du résultat du processus pour des entrées {nom: [valeurs]}.
+
+    Retourne None si toutes les exécutions simultanées sont occupées.
+    """
+    request = _Request(parse_inputs(service, process, inputs))
+    slots = execution_slots()
+    if not slots.acquire(blocking=False):
+        return None
+    try:
+        response = process.handler(request, _Response())
+    finally:
+        slots.release()
+    payload = response.outputs['output'].data
+    return payload.decode('utf-8') if isinstance(payload, bytes) else payload
@@ -0,0 +1,204 @@
+"""Agrégats temporels (pyramide jour / semaine / mois) et sous-échantillonnage.
+
+Pour chaque région, les séries moyennes pondérées (core.zonal) sont
+résumées en min / moyenne / max par jour, semaine ISO et mois. Ces
+agrégats sont construits à l'ingestion (`python -m core.ingest rollups`,
+fichier .npz dans data/store/) ou, à défaut, au premier accès ; ils sont
+ensuite servis sans repasser sur la série brute. Quand de nouveaux
+instants arrivent, seules les périodes à partir du premier instant
+modifié sont recalculées.
+
+`lttb()` réduit une série à un nombre cible de points en préservant sa
+forme (Largest-Triangle-Three-Buckets, Steinarsson 2013).
+"""
+import os
+
+import numpy as np
+
+from core.catalog import STORE_DIR, get_catalog
+from core.zonal import get_zonal, zonal_sources
+
+FREQUENCIES = ('daily', 'weekly', 'monthly')
+RESOLUTIONS = ('raw',) + FREQUENCIES + ('auto',)
+# Nombre de points visé par la résolution 'auto' si max_points n'est pas fourni
+AUTO_TARGET_POINTS = 400
+
+
+def period_starts(times, freq):
+    """Début de période (datetime64[D]) de chaque instant."""
+    days = times.astype('datetime64[D]')
+    if freq == 'daily':
+        return days
+    if freq == 'weekly':
+        # 1970-01-01 est un jeudi : décalage pour des semaines commençant le lundi
+        weekday = (days.astype(np.int64) + 3) % 7
+        return days - weekday.astype('timedelta64[D]')
+    if freq == 'monthly':
+        return days.astype('datetime64[M]').astype('datetime64[D]')
+    raise ValueError(f"Fréquence inconnue : {freq}")
+
+
+def _reduce(series, bounds):
+    """min / moyenne / max de series (temps, régions) sur des tranches [bounds[i], bounds[i+1])."""
+    starts = bounds[:-1]
+    counts = np.diff(bounds)[:, None]
+    return (np.minimum.reduceat(series, starts, axis=0),
+            np.add.reduceat(series, starts, axis=0) / counts,
+            np.maximum.reduceat(series, starts, axis=0))
+
+
+class Rollup:
+    """Agrégats d'une fréquence : périodes x régions."""
+
+    def __init__(self, freq, periods, bounds, vmin, vmean, vmax):
+        self.freq = freq
+        self.periods = periods      # datetime64[D] (P,)
+        self.bounds = bounds        # indices temporels (P + 1,)
+        self.min = vmin             # (P, R)
+        self.mean = vmean
+        self.max = vmax
+        # (instants, clés) de la série résumée (core.zonal), pour les mises à jour
+        self.basis = None
+
+    @classmethod
+    def build(cls, times, series, freq):
+        keys = period_starts(times, freq)
+        change = np.flatnonzero(keys[1:] != keys[:-1]) + 1
+        bounds = np.concatenate([[0], change, [len(keys)]]).astype(np.int64)
+        if len(keys) == 0:
+            empty = np.empty((0, series.shape[1]))
+            return cls(freq, keys, np.zeros(1, np.int64), empty, empty, empty)
+        vmin, vmean, vmax = _reduce(series, bounds)
+        return cls(freq, keys[bounds[:-1]], bounds, vmin, vmean, vmax)
+
+    def extended(self, times, series, prefix):
+        """Agrégats d'une nouvelle série dont les `prefix` premiers instants sont inchangés.
+
+        Les périodes closes avant l'instant `prefix` sont gardées ; les
+        suivantes, dont celle qui le contient, sont recalculées.
+        """
+        keep = int(np.searchsorted(self.bounds[1:], prefix, side='right'))
+        if (keep and prefix < len(times)
+                and period_starts(times[prefix:prefix + 1], self.freq)[0] == self.periods[keep - 1]):
+            # La dernière période gardée continue après l'instant `prefix`
+            keep -= 1
+        start = int(self.bounds[keep])
+        tail = Rollup.build(times[start:], series[start:], self.freq)
+        return Rollup(self.freq, np.concatenate([self.periods[:keep], tail.periods]),
+                      np.concatenate([self.bounds[:keep], tail.bounds + start]),
+                      *(np.concatenate([old[:keep], new]) for old, new in
+                        ((self.min, tail.min), (self.mean, tail.mean), (self.max, tail.max))))
+
+    def select(self, series, sl, positions):
+        """Agrégats des périodes qui recoupent la tranche `sl` de la série brute.
+
+        Les périodes entièrement incluses viennent des agrégats précalculés ;
+        les périodes coupées par les bornes sont recalculées sur la partie
+        demandée, pour rester exact.
+        """
+        start, stop, _ = sl.indices(len(series))
+        first = max(int(np.searchsorted(self.bounds, start, side='right')) - 1, 0)
+        last = int(np.searchsorted(self.bounds, stop, side='left'))
+        periods = self.periods[first:last]
+        vmin = self.min[first:last][:, positions].copy()
+        vmean = self.mean[first:last][:, positions].copy()
+        vmax = self.max[first:last][:, positions].copy()
+        for k, p in enumerate(range(first, last)):
+            lo, hi = self.bounds[p], self.bounds[p + 1]
+            if lo < start or hi > stop:
+                part = series[max(lo, start):min(hi, stop)][:, positions]
+                vmin[k], vmean[k], vmax[k] = part.min(axis=0), part.mean(axis=0), part.max(axis=0)
+        return periods, vmin, vmean, vmax
+
+
+def build_rollups(zonal, previous=None):
+    """Agrégats de chaque fréquence ; `previous` (agrégats d'une version antérieure) n'est que prolongé."""
+    rollups = {}
+    for freq in FREQUENCIES:
+        old = (previous or {}).get(freq)
+        prefix = zonal.unchanged_prefix(*old.basis) if old is not None and old.basis is not None else 0
+        if prefix:
+            rollups[freq] = old.extended(zonal.times, zonal.region_series, prefix)
+        else:
+            rollups[freq] = Rollup.build(zonal.times, zonal.region_series, freq)
+        rollups[freq].basis = (zonal.times, zonal.keys)
+    return rollups
+
+
+def rollups_path(var_name):
+    return os.path.join(STORE_DIR, f'rollups_{var_name}.npz')
+
+
+def save_rollups(var_name='t2m'):
+    """Construit et écrit les agrégats de la variable dans data/store/ (ingestion)."""
+    zonal = get_zonal(var_name)
+    rollups = build_rollups(zonal)
+    arrays = {'fingerprint': np.array(get_catalog().fingerprint(zonal_sources(var_name)))}
+    for freq, r in rollups.items():
+        arrays.update({f'{freq}_periods': r.periods, f'{freq}_bounds': r.bounds,
+                       f'{freq}_min': r.min, f'{freq}_mean': r.mean, f'{freq}_max': r.max})
+    path = rollups_path(var_name)
+    os.makedirs(STORE_DIR, exist_ok=True)
+    tmp = f'{path}.{os.getpid()}.tmp.npz'
+    np.savez(tmp, **arrays)
+    os.replace(tmp, path)
+    return path
+
+
+def _load_or_build(var_name, zonal, previous=None):
+    path = rollups_path(var_name)
+    fingerprint = get_catalog().fingerprint(zonal_sources(var_name))
+    if os.path.exists(path):
+        with np.load(path) as npz:
+            # Bornes sur l'axe des séries actuelles (le fichier d'une autre version est ignoré)
+            if str(npz['fingerprint']) == fingerprint and int(npz['daily_bounds'][-1]) == len(zonal.times):
+                rollups = {freq: Rollup(freq, npz[f'{freq}_periods'], npz[f'{freq}_bounds'],
+                                        npz[f'{freq}_min'], npz[f'{freq}_mean'], npz[f'{freq}_max'])
+                           for freq in FREQUENCIES}
+                for rollup in rollups.values():
+                    rollup.basis = (zonal.times, zonal.keys)
+                return rollups
+    return build_rollups(zonal, previous)
+
+
+def get_rollups(var_name='t2m'):
+    """Agrégats partagés : fichier d'ingestion s'il est à jour, sinon calcul (ou prolongement) en mémoire."""
+    # Séries lues dans le constructeur : celles de la version des sources en cours
+    build = lambda *_, previous=None: _load_or_build(var_name, get_zonal(var_name), previous)
+    return get_catalog().derived(
+        ('rollups', var_name), zonal_sources(var_name), build,
+        update=lambda previous, *values: build(*values, previous=previous))
+
+
+def auto_resolution(n_points, target):
+    """Résolution la plus fine dont le nombre de points reste sous la cible."""
+    if n_points <= target:
+        return 'raw'
+    # Facteurs approximatifs pour des données journalières ou plus fines
+    for freq, factor in (('daily', 1), ('weekly', 7), ('monthly', 30)):
+        if n_points / factor <= target:
+            return freq
+    return 'monthly'
+
+
+def lttb(y, n_out):
+    """Indices des points retenus par Largest-Triangle-Three-Buckets."""
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    x = np.arange(n, dtype=float)
+    y = np.asarray(y, dtype=float)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    keep = np.empty(n_out, dtype=np.int64)
+    keep[0], keep[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        # Moyenne du seau suivant (le dernier point pour le dernier seau)
+        nlo, nhi = hi, edges[i + 2] if i + 2 < len(edges) else n
+        avg_x, avg_y = x[nlo:nhi].mean(), y[nlo:nhi].mean()
+        bx, by = x[lo:hi], y[lo:hi]
+        area = np.abs((x[a] - avg_x) * (by - y[a]) - (x[a] - bx) * (avg_y - y[a]))
+        a = lo + int(np.argmax(area))
+        keep[i + 1] = a
+    return keep
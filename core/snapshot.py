@@ -0,0 +1,277 @@
+"""Instantané binaire de data/ pour un démarrage à froid rapide.
+
+`python -m core.ingest snapshot` (à lancer à la construction de l'image)
+écrit dans data/snapshot/ :
+
+  - regions.wkb, regions_offsets.npy, regions.json : polygones (WKB,
+    EPSG:4326) et attributs des régions, relus sans GDAL ni geopandas ;
+  - regions_arrays.npz : superficies géodésiques, emprises et centroïdes ;
+  - coverage_<grille>.npy : fractions de maille couvertes par chaque région ;
+  - geometry/<format>_<zoom>.json(.gz) : variantes simplifiées de la carte ;
+  - era5_<flux>/ : axes et variables (temps, lat, lon) en .npy float32
+    ou int16 quantifié (section [memoire] de pywps.cfg), ouverts en mmap
+    (lus à la demande, pages partagées entre workers), et provenance de
+    chaque instant (core.archive) ;
+  - manifest.json : empreinte des fichiers sources de chaque partie.
+
+Une partie n'est utilisée que si son empreinte correspond aux fichiers
+actuels de data/ : sinon le catalogue relit les sources comme avant.
+"""
+import json
+import os
+import shutil
+
+import numpy as np
+
+from core.archive import BLOCK_STEPS
+from core.catalog import (ERA5_FILES, SNAPSHOT_DIR, DataCatalog, RegionLayer, _signature,
+                          era5_paths, signature_digest, source_paths)
+from core.memory import decode_int16, encode_int16, encoding, int16_codec
+
+MANIFEST_FILE = os.path.join(SNAPSHOT_DIR, 'manifest.json')
+# Version du format : un instantané d'un autre format est ignoré
+SNAPSHOT_FORMAT = 1
+
+
+def _path(*names):
+    return os.path.join(SNAPSHOT_DIR, *names)
+
+
+def part_digest(key):
+    """Empreinte actuelle des fichiers sources de 'regions' ou ('era5', flux), None s'ils manquent."""
+    paths, optional = source_paths(key)
+    sig = _signature(paths, optional)
+    return None if sig is None else signature_digest([sig])
+
+
+def _manifest():
+    try:
+        with open(MANIFEST_FILE, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    return manifest if manifest.get('format') == SNAPSHOT_FORMAT else None
+
+
+def _fresh(name, key):
+    """Description de la partie `name` du manifeste si elle correspond aux sources actuelles."""
+    manifest = _manifest()
+    part = manifest['parts'].get(name) if manifest else None
+    if part is None or part['sources'] != part_digest(key):
+        return None
+    return part
+
+
+class NpyArchive:
+    """Flux ERA5 de l'instantané (.npy en mmap), même interface que core.archive.Era5Archive."""
+
+    def __init__(self, stream, part):
+        self.stream = stream
+        self.paths = list(part['paths'])
+        folder = _path(f'era5_{stream}')
+        self.times = np.load(os.path.join(folder, 'time.npy'))
+        self.lats = np.load(os.path.join(folder, 'latitude.npy'))
+        self.lons = np.load(os.path.join(folder, 'longitude.npy'))
+        self.attrs = dict(part['attrs'])
+        self.variables = {name: dict(attrs) for name, attrs in part['variables'].items()}
+        # Variables quantifiées : {nom: (échelle, décalage, min, max)}
+        self.codecs = {name: tuple(codec) for name, codec in part.get('int16', {}).items()}
+        self._arrays = {name: np.load(os.path.join(folder, f'{name}.npy'), mmap_mode='r')
+                        for name in self.variables}
+        ids = os.path.join(folder, 'source_ids.npy')
+        self._source_ids = np.load(ids) if os.path.exists(ids) else None
+
+    @property
+    def data_vars(self):
+        return list(self.variables)
+
+    def source_ids(self, var_name=None):
+        """Provenance de chaque instant (voir core.archive.Era5Archive.source_ids), None si absente."""
+        return self._source_ids
+
+    def iter_blocks(self, var_name, sl=slice(None), block_steps=BLOCK_STEPS, window=None):
+        """Blocs (indices, valeurs (temps, lat, lon)) lus directement dans le fichier mappé."""
+        array = self._arrays[var_name]
+        start, stop, _ = sl.indices(len(self.times))
+        for i in range(start, stop, block_steps):
+            j = min(i + block_steps, stop)
+            block = array[i:j] if window is None else array[i:j, window[0], window[1]]
+            codec = self.codecs.get(var_name)
+            yield np.arange(i, j), np.asarray(block) if codec is None else decode_int16(block, codec)
+
+
+def load_regions():
+    """RegionLayer de l'instantané, ou None s'il n'est pas à jour."""
+    if _fresh('regions', 'regions') is None:
+        return None
+    # Import local : shapely n'est chargé qu'à la lecture des polygones
+    import shapely
+    offsets = np.load(_path('regions_offsets.npy'))
+    with open(_path('regions.wkb'), 'rb') as f:
+        blob = f.read()
+    geometries = shapely.from_wkb([blob[a:b] for a, b in zip(offsets[:-1], offsets[1:])])
+    with open(_path('regions.json'), 'r', encoding='utf-8') as f:
+        records = json.load(f)
+    with np.load(_path('regions_arrays.npz')) as npz:
+        arrays = {name: npz[name] for name in npz.files}
+    return RegionLayer(geometries, records, arrays)
+
+
+def load_coverage(grid):
+    """Fractions de maille (régions, mailles) de la grille `grid` (core.zonal.grid_key), ou None."""
+    part = _fresh('coverage', 'regions')
+    if part is None or grid not in part['grids']:
+        return None
+    return np.load(_path(f'coverage_{grid}.npy'))
+
+
+def load_geometry(tolerances):
+    """Variantes {(format, zoom): (corps, corps gzip)} de la carte, ou None."""
+    part = _fresh('geometry', 'regions')
+    if part is None or part['tolerances'] != {str(z): t for z, t in tolerances.items()}:
+        return None
+    bodies = {}
+    for fmt, z in part['variants']:
+        name = _path('geometry', f'{fmt}_{z}.json')
+        with open(name, 'rb') as f, open(name + '.gz', 'rb') as gz:
+            bodies[(fmt, z)] = (f.read(), gz.read())
+    return bodies
+
+
+def load_era5(stream):
+    """Flux ERA5 de l'instantané (NpyArchive), ou None s'il n'est pas à jour."""
+    part = _fresh(f'era5/{stream}', ('era5', stream))
+    return None if part is None else NpyArchive(stream, part)
+
+
+def _jsonable(attrs):
+    clean = {}
+    for key, value in attrs.items():
+        if isinstance(value, (np.generic, np.ndarray)):
+            value = value.tolist()
+        if value is None or isinstance(value, (str, int, float, bool, list)):
+            clean[key] = value
+    return clean
+
+
+def _replace(path, write, binary=True):
+    """Écrit `path` via un fichier temporaire renommé (lecteurs jamais exposés à un fichier partiel)."""
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'wb' if binary else 'w', **({} if binary else {'encoding': 'utf-8'})) as f:
+        write(f)
+    os.replace(tmp, path)
+
+
+def _write_regions(layer):
+    # Import local : l'écriture calcule ce que la lecture évite (shapely, pyproj, geopandas)
+    import shapely
+    from core.regions import region_arrays
+    blobs = shapely.to_wkb(layer.geometries)
+    offsets = np.concatenate([[0], np.cumsum([len(b) for b in blobs])]).astype(np.int64)
+    _replace(_path('regions.wkb'), lambda f: f.write(b''.join(blobs)))
+    _replace(_path('regions_offsets.npy'), lambda f: np.save(f, offsets))
+    _replace(_path('regions.json'), lambda f: json.dump([_jsonable(r) for r in layer.records], f,
+                                                        ensure_ascii=False), binary=False)
+    arrays = region_arrays(layer)
+    _replace(_path('regions_arrays.npz'), lambda f: np.savez(f, **arrays))
+
+
+def _write_coverage(layer, archives):
+    from core.zonal import coverage_weights, grid_key
+    grids = []
+    for archive in archives:
+        grid = grid_key(archive.lats, archive.lons)
+        if grid not in grids:
+            fraction = coverage_weights(layer.geometries, archive.lats, archive.lons)
+            _replace(_path(f'coverage_{grid}.npy'), lambda f: np.save(f, fraction))
+            grids.append(grid)
+    return grids
+
+
+def _write_geometry(layer):
+    from core.geometry import FORMATS, ZOOM_TOLERANCES, GeometryService
+    service = GeometryService(layer)
+    os.makedirs(_path('geometry'), exist_ok=True)
+    variants = []
+    for fmt in FORMATS:
+        for z in ZOOM_TOLERANCES:
+            payload = service.payload(fmt, z)
+            name = _path('geometry', f'{fmt}_{z}.json')
+            _replace(name, lambda f: f.write(payload.body))
+            _replace(name + '.gz', lambda f: f.write(payload.gzip))
+            variants.append([fmt, z])
+    return {'tolerances': {str(z): t for z, t in ZOOM_TOLERANCES.items()}, 'variants': variants}
+
+
+def _write_era5(stream, archive, dtype):
+    folder = _path(f'era5_{stream}')
+    shutil.rmtree(folder, ignore_errors=True)
+    os.makedirs(folder)
+    np.save(os.path.join(folder, 'time.npy'), archive.times.astype('datetime64[ns]'))
+    np.save(os.path.join(folder, 'latitude.npy'), archive.lats)
+    np.save(os.path.join(folder, 'longitude.npy'), archive.lons)
+    np.save(os.path.join(folder, 'source_ids.npy'), archive.source_ids())
+    shape = (len(archive.times), len(archive.lats), len(archive.lons))
+    codecs = {}
+    for name in archive.variables:
+        if dtype == 'int16':
+            # Premier passage : étendue de la variable pour l'échelle de quantification
+            bounds = [(np.nanmin(block), np.nanmax(block)) for _idx, block in archive.iter_blocks(name)
+                      if np.isfinite(block).any()]
+            codecs[name] = int16_codec(min((b[0] for b in bounds), default=np.nan),
+                                       max((b[1] for b in bounds), default=np.nan))
+        # Écriture bloc par bloc : l'archive n'est jamais chargée en entier
+        out = np.lib.format.open_memmap(os.path.join(folder, f'{name}.npy'), mode='w+',
+                                        dtype=np.dtype(dtype), shape=shape)
+        for idx, block in archive.iter_blocks(name):
+            out[idx] = block if name not in codecs else encode_int16(block, codecs[name])
+        out.flush()
+        del out
+    return {
+        'paths': list(archive.paths),
+        'attrs': _jsonable(archive.attrs),
+        'variables': {name: _jsonable(attrs) for name, attrs in archive.variables.items()},
+        'int16': {name: list(codec) for name, codec in codecs.items()},
+    }
+
+
+def write_snapshot(dtype=None):
+    """Écrit l'instantané complet à partir des sources de data/ ; retourne les parties écrites.
+
+    `dtype` ('float32' ou 'int16') remplace l'encodage de pywps.cfg.
+    """
+    dtype = dtype or encoding()
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    # Sans manifeste, les serveurs relisent les sources pendant l'écriture
+    if os.path.exists(MANIFEST_FILE):
+        os.remove(MANIFEST_FILE)
+    catalog = DataCatalog()
+    regions_digest = part_digest('regions')
+    layer = catalog.region_layer()
+    parts = {}
+
+    _write_regions(layer)
+    parts['regions'] = {'sources': regions_digest}
+    parts['geometry'] = dict(_write_geometry(layer), sources=regions_digest)
+
+    archives = []
+    for stream in ERA5_FILES:
+        if not era5_paths(stream):
+            continue
+        digest = part_digest(('era5', stream))
+        archive = catalog.era5(stream)
+        archives.append(archive)
+        parts[f'era5/{stream}'] = dict(_write_era5(stream, archive, dtype), sources=digest)
+    parts['coverage'] = {'sources': regions_digest, 'grids': _write_coverage(layer, archives)}
+
+    manifest = {'format': SNAPSHOT_FORMAT, 'parts': parts}
+    _replace(MANIFEST_FILE, lambda f: json.dump(manifest, f, ensure_ascii=False, indent=1), binary=False)
+    return parts
+
+
+def snapshot_size():
+    """Taille totale de data/snapshot/ en octets."""
+    total = 0
+    for root, _dirs, files in os.walk(SNAPSHOT_DIR):
+        total += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+    return total
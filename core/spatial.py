@@ -0,0 +1,96 @@
+"""Entrées spatiales des processus : point (lat / lon) et zone GeoJSON.
+
+Un point est rattaché à sa région par l'arbre STRtree de l'index des
+régions (core.regions) puis traité comme une entrée 'region'. Une zone
+quelconque (parcelle dessinée sur la carte) est intersectée avec la
+grille ERA5 ; ses poids par maille sont gardés en cache (core.zonal).
+"""
+import json
+
+from pywps import FORMATS, ComplexInput, LiteralInput
+
+from core.regions import region_inputs
+
+# Types GeoJSON acceptés pour une zone
+ZONE_TYPES = ('Polygon', 'MultiPolygon')
+
+
+def point_inputs():
+    """Entrées optionnelles `lat` / `lon` (WGS84) communes aux processus."""
+    return [
+        LiteralInput('lat', 'Latitude du point (WGS84, remplace region)', data_type='float', min_occurs=0),
+        LiteralInput('lon', 'Longitude du point (WGS84, remplace region)', data_type='float', min_occurs=0),
+    ]
+
+
+def zone_input():
+    """Entrée optionnelle `zone` : polygone GeoJSON en WGS84."""
+    return ComplexInput('zone', 'Zone GeoJSON (Polygon, MultiPolygon, Feature ou FeatureCollection, WGS84)',
+                        supported_formats=[FORMATS.GEOJSON, FORMATS.JSON], min_occurs=0)
+
+
+def point_queries(request, index):
+    """Requête de région (code) du point lat / lon de la requête, [] s'il n'y en a pas."""
+    has_lat, has_lon = 'lat' in request.inputs, 'lon' in request.inputs
+    if not (has_lat or has_lon):
+        return []
+    if not (has_lat and has_lon):
+        raise ValueError("Les entrées 'lat' et 'lon' vont ensemble")
+    lat, lon = float(request.inputs['lat'][0].data), float(request.inputs['lon'][0].data)
+    pos = index.locate(lon, lat)
+    if pos is None:
+        raise ValueError(f"Aucune région au point ({lat}, {lon})")
+    return [str(index.codes[pos])]
+
+
+def location_queries(request, index, required=True):
+    """Entrées 'region' de la requête, complétées par la région du point lat / lon."""
+    queries = region_inputs(request) + point_queries(request, index)
+    if required and not queries:
+        raise ValueError("Région non spécifiée (entrée 'region' ou 'lat' / 'lon')")
+    return queries
+
+
+def parse_zone(text):
+    """Géométrie shapely (Polygon / MultiPolygon valide) d'un texte GeoJSON."""
+    # Import local : shapely n'est chargé qu'à la première zone reçue
+    import shapely
+    try:
+        obj = json.loads(text)
+    except (TypeError, ValueError):
+        raise ValueError("Zone : GeoJSON invalide")
+    if not isinstance(obj, dict):
+        raise ValueError("Zone : objet GeoJSON attendu")
+    if obj.get('type') == 'FeatureCollection':
+        geoms = [shapely.geometry.shape(f['geometry']) for f in obj.get('features', []) if f.get('geometry')]
+        geom = shapely.union_all(geoms) if geoms else None
+    elif obj.get('type') == 'Feature':
+        geom = shapely.geometry.shape(obj['geometry']) if obj.get('geometry') else None
+    else:
+        geom = shapely.geometry.shape(obj)
+    if geom is None or geom.is_empty or geom.geom_type not in ZONE_TYPES:
+        raise ValueError(f"Zone : géométrie {' ou '.join(ZONE_TYPES)} attendue")
+    minx, miny, maxx, maxy = geom.bounds
+    if minx < -180 or maxx > 180 or miny < -90 or maxy > 90:
+        raise ValueError("Zone : coordonnées hors WGS84 (longitude, latitude en degrés)")
+    if not geom.is_valid:
+        # make_valid peut rendre une collection (lignes, points) : seules les surfaces comptent
+        fixed = shapely.make_valid(geom)
+        parts = [g for g in getattr(fixed, 'geoms', [fixed]) if g.geom_type in ZONE_TYPES and not g.is_empty]
+        if not parts:
+            raise ValueError("Zone : géométrie invalide, aucune surface après correction")
+        geom = parts[0] if len(parts) == 1 else shapely.union_all(parts)
+    return geom
+
+
+def zone_geometry(request):
+    """Zone GeoJSON de la requête, ou None."""
+    if 'zone' not in request.inputs:
+        return None
+    return parse_zone(request.inputs['zone'][0].data)
+
+
+def zone_area_km2(geom):
+    """Superficie géodésique (WGS84) de la zone."""
+    from pyproj import Geod
+    return abs(Geod(ellps='WGS84').geometry_area_perimeter(geom)[0]) / 1e6
@@ -0,0 +1,182 @@
+"""Fichiers statiques : page d'accueil et téléchargements de data/.
+
+Chaque fichier servi reçoit un ETag calculé sur son contenu (SHA-256) :
+un navigateur qui revient reçoit un 304 sans corps tant que le fichier
+n'a pas changé, quel que soit le worker qui répond. Les formats texte
+(HTML, GeoJSON, JSON, composants du shapefile) ont des variantes gzip et
+brotli (si le module `brotli` est installé) écrites une fois dans
+data/store/statique/, nommées d'après l'empreinte du contenu, puis
+choisies selon `Accept-Encoding`. `python -m core.ingest static` les
+prépare à la construction de l'image ; sinon elles le sont à la
+première demande. Les NetCDF et l'archive zip, déjà compressés, sont
+servis tels quels et acceptent les requêtes `Range` (reprise d'un
+téléchargement interrompu, lecture partielle).
+
+Les empreintes sont gardées dans `index.json` avec l'état du fichier
+(mtime, taille) : un fichier n'est relu qu'après modification.
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import threading
+from collections import namedtuple
+
+from core.catalog import STORE_DIR
+
+try:
+    import brotli
+except ImportError:  # variantes gzip seulement
+    brotli = None
+
+STATIC_DIR = os.path.join(STORE_DIR, 'statique')
+INDEX_FILE = os.path.join(STATIC_DIR, 'index.json')
+# Formats compressés à l'avance ; les autres (NetCDF, zip) sont servis bruts
+COMPRESSIBLE = {'.html', '.json', '.geojson', '.topojson', '.shp', '.shx', '.dbf', '.prj', '.cpg', '.txt', '.csv'}
+# Taille minimale et gain minimal (fraction de la taille) pour garder une variante
+MIN_BYTES = 1024
+MIN_SAVING = 0.1
+# Durées de cache navigateur (s) : la page est toujours revalidée, les données 1 jour
+PAGE_MAX_AGE = 0
+DATA_MAX_AGE = 86400
+# Dossier servi par /data/ et ses dossiers internes, non préparés par `prepare_all`
+DATA_ROOT = 'data'
+INTERNAL_DIRS = {'store', 'snapshot'}
+
+# Encodages par ordre de préférence : (nom Accept-Encoding, extension, compresseur)
+ENCODINGS = [('gzip', '.gz', lambda data: gzip.compress(data, 9, mtime=0))]
+if brotli is not None:
+    ENCODINGS.insert(0, ('br', '.br', lambda data: brotli.compress(data, quality=11)))
+
+Asset = namedtuple('Asset', 'path state etag mimetype variants')
+
+_assets = {}
+_lock = threading.Lock()
+
+
+def file_state(path):
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size
+
+
+def content_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 ** 2), b''):
+            digest.update(block)
+    return digest.hexdigest()[:32]
+
+
+def _read_index():
+    try:
+        with open(INDEX_FILE, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_index(index):
+    os.makedirs(STATIC_DIR, exist_ok=True)
+    tmp = f'{INDEX_FILE}.{os.getpid()}.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(index, f, indent=1)
+    os.replace(tmp, INDEX_FILE)
+
+
+def variant_path(etag, ext):
+    return os.path.join(STATIC_DIR, etag + ext)
+
+
+def _write_variants(path, etag):
+    """Variantes compressées du fichier (écrites si absentes) : {encodage: chemin}."""
+    variants = {}
+    data = None
+    for encoding, ext, compress in ENCODINGS:
+        target = variant_path(etag, ext)
+        if not os.path.exists(target):
+            if data is None:
+                with open(path, 'rb') as f:
+                    data = f.read()
+            packed = compress(data)
+            if len(packed) > len(data) * (1 - MIN_SAVING):
+                continue
+            os.makedirs(STATIC_DIR, exist_ok=True)
+            tmp = f'{target}.{os.getpid()}.tmp'
+            with open(tmp, 'wb') as f:
+                f.write(packed)
+            os.replace(tmp, target)
+        variants[encoding] = target
+    return variants
+
+
+def _build(path, state, known):
+    """Asset du fichier ; `known` = (état, etag) de l'index s'il est à jour."""
+    etag = known[1] if known and tuple(known[0]) == state else content_hash(path)
+    mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    if path.endswith('.geojson'):
+        mimetype = 'application/geo+json'
+    variants = {}
+    if compressible(path) and state[1] >= MIN_BYTES:
+        variants = _write_variants(path, etag)
+    return Asset(path, state, etag, mimetype, variants)
+
+
+def get_asset(path):
+    """Asset (empreinte, type, variantes) du fichier, recalculé s'il a changé sur disque."""
+    path = os.path.abspath(path)
+    state = file_state(path)
+    asset = _assets.get(path)
+    if asset is not None and asset.state == state:
+        return asset
+    # Empreinte calculée hors verrou : un gros NetCDF ne bloque pas les autres fichiers
+    key = os.path.relpath(path)
+    known = _read_index().get(key)
+    asset = _build(path, state, known)
+    with _lock:
+        _assets[path] = asset
+        if known != [list(state), asset.etag]:
+            index = _read_index()
+            index[key] = [list(state), asset.etag]
+            _write_index(index)
+    return asset
+
+
+def select(asset, accept_encodings, ranged=False):
+    """(chemin, encodage ou None) de la représentation à envoyer.
+
+    Une requête `Range` reçoit le fichier d'origine : les positions
+    demandées sont celles du fichier, pas d'une variante compressée.
+    """
+    if not ranged:
+        for encoding, _ext, _compress in ENCODINGS:
+            if encoding in asset.variants and accept_encodings[encoding] > 0:
+                return asset.variants[encoding], encoding
+    return asset.path, None
+
+
+def page_files():
+    """Fichiers servis à la racine (page d'accueil)."""
+    return ['interface.html']
+
+
+def data_files(data_dir=DATA_ROOT):
+    """Fichiers de data/ servis par /data/, hors dossiers internes."""
+    files = []
+    for root, dirs, names in os.walk(data_dir):
+        if root == data_dir:
+            dirs[:] = [d for d in dirs if d not in INTERNAL_DIRS]
+        files += [os.path.join(root, name) for name in sorted(names)]
+    return sorted(files)
+
+
+def compressible(path):
+    return os.path.splitext(path)[1].lower() in COMPRESSIBLE
+
+
+def prepare_all(paths=None, compressible_only=False):
+    """Empreintes et variantes compressées des fichiers servis ; retourne la liste des assets."""
+    paths = page_files() + data_files() if paths is None else paths
+    if compressible_only:
+        paths = [path for path in paths if compressible(path)]
+    return [get_asset(path) for path in paths if os.path.isfile(path)]
@@ -0,0 +1,71 @@
+"""Stockage ERA5 optimisé pour les séries temporelles.
+
+Les fichiers ERA5 du CDS sont rangés « temps d'abord » : lire l'année
+complète d'un pixel touche toutes les tranches temporelles. La commande
+`python -m core.ingest rechunk` réécrit chaque cube dans data/store/ en
+NetCDF4 découpé en blocs (temps complet x quelques pixels) : la série
+d'un pixel ou d'une région est alors une lecture contiguë.
+
+Le catalogue ouvre ce stockage à la place du fichier source dès qu'il
+existe et correspond encore au fichier source (même mtime et taille) ;
+les processus n'ont rien à changer.
+"""
+import os
+
+import xarray as xr
+
+from core.catalog import ERA5_FILES, STORE_DIR, era5_store_path, normalize_era5
+
+# Taille des blocs spatiaux (pixels x pixels) ; le bloc couvre tout l'axe temps
+DEFAULT_PIXEL_CHUNK = 4
+
+
+def _source_attrs(source):
+    st = os.stat(source)
+    return {
+        'store_source': os.path.basename(source),
+        'store_source_mtime_ns': str(st.st_mtime_ns),
+        'store_source_size': str(st.st_size),
+    }
+
+
+def is_fresh(stream):
+    """Vrai si data/store/ contient une version à jour du flux."""
+    path, source = era5_store_path(stream), ERA5_FILES[stream]
+    if not (os.path.exists(path) and os.path.exists(source)):
+        return False
+    expected = _source_attrs(source)
+    with xr.open_dataset(path, engine='netcdf4') as ds:
+        return all(str(ds.attrs.get(k)) == v for k, v in expected.items())
+
+
+def rechunk(stream, pixel_chunk=DEFAULT_PIXEL_CHUNK, complevel=1):
+    """Réécrit le flux ERA5 en blocs (temps complet, pixel_chunk, pixel_chunk)."""
+    source = ERA5_FILES[stream]
+    os.makedirs(STORE_DIR, exist_ok=True)
+    path = era5_store_path(stream)
+    tmp = f'{path}.{os.getpid()}.tmp'
+
+    with xr.open_dataset(source, engine='netcdf4', decode_times=True) as raw:
+        ds = normalize_era5(raw).load()
+    ds.attrs.update(_source_attrs(source))
+    encoding = {}
+    for name in list(ds.data_vars):
+        var = ds[name]
+        if set(var.dims) >= {'time', 'latitude', 'longitude'}:
+            var = var.transpose('time', 'latitude', 'longitude', ...)
+            ds[name] = var
+            chunks = [var.sizes['time'], min(pixel_chunk, var.sizes['latitude']),
+                      min(pixel_chunk, var.sizes['longitude'])] + list(var.shape[3:])
+            encoding[name] = {'chunksizes': tuple(chunks), 'zlib': True,
+                              'complevel': complevel, 'shuffle': True}
+    ds.to_netcdf(tmp, engine='netcdf4', encoding=encoding, unlimited_dims=['time'])
+    # Remplacement atomique : un lecteur voit l'ancienne ou la nouvelle version
+    os.replace(tmp, path)
+    return path
+
+
+def open_era5(stream):
+    """Dataset ERA5 du flux, depuis data/store/ si à jour, sinon le fichier source."""
+    path = era5_store_path(stream) if is_fresh(stream) else ERA5_FILES[stream]
+    return normalize_era5(xr.open_dataset(path, engine='netcdf4', decode_times=True))
@@ -0,0 +1,60 @@
+"""Préchargement des données partagées avant le fork des workers gunicorn.
+
+Avec `preload_app` (gunicorn.conf.py), server.py est importé une seule
+fois, par le processus maître, qui appelle `warm_up()` avant de créer les
+workers : index des régions, géométries de la carte, séries régionales
+réduites, climatologies et agrégats temporels de chaque variable ERA5,
+enfin empreintes et variantes compressées de la page et des fichiers
+texte de data/ (core/static.py). Les workers héritent de ces objets par
+fork ; leurs pages restent communes (copie à l'écriture) tant qu'elles
+ne sont pas modifiées, et `gc.freeze()` empêche le ramasse-miettes d'y
+écrire. Les flux ERA5 de l'instantané binaire
+(mmap) sont, eux, partagés par le cache de pages du noyau.
+"""
+import time
+
+from core.catalog import get_catalog
+from core.climatology import get_climatology
+from core.geometry import get_geometry_service
+from core.regions import get_region_index
+from core.rollups import get_rollups
+from core.static import prepare_all
+from core.zonal import get_zonal
+
+
+def warm_up(variables=None):
+    """Construit les données partagées ; retourne {étape: durée en s ou message d'erreur}."""
+    catalog = get_catalog()
+    steps = [
+        ('regions', get_region_index),
+        ('geometrie', get_geometry_service),
+        ('agriculture', catalog.agriculture),
+    ]
+    try:
+        names = catalog.era5_variables() if variables is None else variables
+    except FileNotFoundError as e:
+        names = []
+        steps.append(('era5', lambda: _raise(e)))
+    for var_name in names:
+        steps += [
+            (f'zonal/{var_name}', lambda v=var_name: get_zonal(v)),
+            (f'climatologie/{var_name}', lambda v=var_name: get_climatology(v)),
+            (f'agregats/{var_name}', lambda v=var_name: get_rollups(v)),
+        ]
+    steps.append(('statique', lambda: prepare_all(compressible_only=True)))
+
+    timings = {}
+    for name, build in steps:
+        t0 = time.perf_counter()
+        try:
+            build()
+        except Exception as e:
+            # Donnée absente ou illisible : le worker la chargera (ou échouera) à la demande
+            timings[name] = f"erreur : {e}"
+            continue
+        timings[name] = round(time.perf_counter() - t0, 3)
+    return timings
+
+
+def _raise(error):
+    raise error
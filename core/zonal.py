@@ -0,0 +1,403 @@
+"""Statistiques zonales vectorisées sur la grille ERA5.
+
+Chaque région est rastérisée une seule fois en poids de couverture
+fractionnaire sur la grille lat/lon (part de la maille couverte par le
+polygone x cos(latitude) pour tenir compte de la surface des mailles).
+L'archive ERA5 est lue par blocs (temps, mailles) : les moyennes de toutes
+les régions sont un seul produit matriciel par bloc, min / max une
+réduction NumPy sur les mailles couvertes. Seules ces séries réduites
+restent en mémoire, quelle que soit la taille de l'archive.
+
+Une zone quelconque (entrée GeoJSON, core.spatial) n'a pas de série
+précalculée : ses poids par maille sont gardés en cache et l'archive est
+relue sur la seule fenêtre de grille qu'elle couvre.
+
+Les poids des régions sont partagés par les variables de même grille et
+repris de l'instantané binaire (core/snapshot.py) s'il est à jour.
+
+Quand l'archive change (nouveaux fichiers), les séries sont reprises de la
+version précédente (en mémoire, ou état écrit par core/incremental.py)
+pour chaque instant dont la provenance est inchangée : seuls les instants
+nouveaux ou modifiés sont relus et réduits.
+"""
+import hashlib
+import threading
+import warnings
+from collections import OrderedDict
+
+import numpy as np
+
+from core import metrics
+from core.archive import combine_ids, stable_id
+from core.catalog import era5_paths, get_catalog
+from core.cube import SOURCES as CUBE_SOURCES, get_cube
+from core.regions import get_region_index
+from core.snapshot import load_coverage
+
+
+def _cell_edges(centers):
+    """Bornes des mailles à partir des centres (grille régulière ou non)."""
+    centers = np.asarray(centers, dtype=float)
+    mid = (centers[1:] + centers[:-1]) / 2
+    first = centers[0] - (mid[0] - centers[0])
+    last = centers[-1] + (centers[-1] - mid[-1])
+    return np.concatenate([[first], mid, [last]])
+
+
+# Nombre de zones GeoJSON dont les poids restent en cache
+ZONE_CACHE_SIZE = 256
+# Séries réduites par pas de temps (reprises d'une version à l'autre, écrites par core.incremental)
+SERIES = ('region_series', 'region_min', 'region_max', 'grid_sum', 'grid_count', 'grid_min', 'grid_max')
+
+
+class CellGrid:
+    """Mailles de la grille lat/lon (ordre C) et leur arbre STRtree."""
+
+    def __init__(self, lats, lons):
+        # Import local : shapely n'est chargé qu'au premier calcul de couverture
+        import shapely
+        from shapely import STRtree
+        lat_e, lon_e = _cell_edges(lats), _cell_edges(lons)
+        lat_lo, lat_hi = np.minimum(lat_e[:-1], lat_e[1:]), np.maximum(lat_e[:-1], lat_e[1:])
+        lon_lo, lon_hi = np.minimum(lon_e[:-1], lon_e[1:]), np.maximum(lon_e[:-1], lon_e[1:])
+        ymin, xmin = np.meshgrid(lat_lo, lon_lo, indexing='ij')
+        ymax, xmax = np.meshgrid(lat_hi, lon_hi, indexing='ij')
+        self.cells = shapely.box(xmin.ravel(), ymin.ravel(), xmax.ravel(), ymax.ravel())
+        self.cell_area = shapely.area(self.cells)
+        self.tree = STRtree(self.cells)
+
+    def coverage(self, geom):
+        """(indices des mailles touchées, fraction de chaque maille couverte)."""
+        idx = self.tree.query(geom, predicate='intersects')
+        if not idx.size:
+            return idx, np.zeros(0)
+        import shapely
+        return idx, shapely.area(shapely.intersection(self.cells[idx], geom)) / self.cell_area[idx]
+
+    def weights(self, geometries):
+        """Matrice (géométries, mailles) des fractions de maille couvertes."""
+        weights = np.zeros((len(geometries), self.cells.size))
+        for r, geom in enumerate(geometries):
+            idx, fraction = self.coverage(geom)
+            weights[r, idx] = fraction
+        return weights
+
+
+def coverage_weights(geometries, lats, lons):
+    """Matrice (régions, mailles) des fractions de maille couvertes.
+
+    Les mailles sont indexées dans l'ordre C de la grille (lat, lon).
+    """
+    return CellGrid(lats, lons).weights(geometries)
+
+
+def grid_key(lats, lons):
+    """Empreinte courte d'une grille lat/lon."""
+    sha = hashlib.sha1(np.ascontiguousarray(lats, dtype=np.float64).tobytes())
+    sha.update(np.ascontiguousarray(lons, dtype=np.float64).tobytes())
+    return sha.hexdigest()[:12]
+
+
+def region_coverage(lats, lons):
+    """Fractions de maille (régions, mailles) couvertes, partagées entre variables de même grille."""
+    key = grid_key(lats, lons)
+
+    def build(layer):
+        fraction = load_coverage(key)
+        return fraction if fraction is not None else coverage_weights(layer.geometries, lats, lons)
+
+    return get_catalog().derived(('coverage', key), ['regions'], build)
+
+
+class ZonalVariable:
+    """Séries réduites d'une variable ERA5 + poids des régions sur sa grille.
+
+    L'archive est parcourue une fois, bloc par bloc ; on garde pour chaque
+    pas de temps la moyenne pondérée, le min et le max de chaque région,
+    ainsi que la somme, le nombre de valeurs, le min et le max de toute la
+    grille. Toute période se résume ensuite sans relire les fichiers.
+
+    `previous` : versions antérieures (ZonalVariable ou état enregistré)
+    dont on reprend les instants de même clé (instant, fichier source,
+    poids des régions) ; `reduced` compte les instants relus.
+    """
+
+    def __init__(self, archive, var_name, index, previous=()):
+        self.archive = archive
+        self.var_name = var_name
+        self.times = archive.times
+        self.lats = archive.lats
+        self.lons = archive.lons
+
+        self._grid = None
+        fraction = region_coverage(self.lats, self.lons)
+        self.cos_lat = np.repeat(np.cos(np.deg2rad(self.lats)), len(self.lons))
+        weights = fraction * self.cos_lat
+        for r in np.flatnonzero(weights.sum(axis=1) == 0):
+            # Région plus petite qu'une maille : maille la plus proche du centroïde
+            lon, lat = index.centroids[r]
+            i = np.abs(self.lats - lat).argmin()
+            j = np.abs(self.lons - lon).argmin()
+            weights[r, i * len(self.lons) + j] = 1.0
+        self.fraction = fraction
+        self.weights = weights / weights.sum(axis=1, keepdims=True)
+        self.masks = self.weights > 0
+        self.cells = [np.flatnonzero(m) for m in self.masks]
+        self._zones = OrderedDict()
+        self._zones_lock = threading.Lock()
+
+        n_times, n_regions = len(self.times), len(self.cells)
+        self.region_series = np.full((n_times, n_regions), np.nan)
+        self.region_min = np.full((n_times, n_regions), np.nan, dtype=np.float32)
+        self.region_max = np.full((n_times, n_regions), np.nan, dtype=np.float32)
+        self.grid_sum = np.zeros(n_times)
+        self.grid_count = np.zeros(n_times, dtype=np.int64)
+        self.grid_min = np.full(n_times, np.nan, dtype=np.float32)
+        self.grid_max = np.full(n_times, np.nan, dtype=np.float32)
+
+        # Clé de chaque instant : même clé, mêmes valeurs réduites
+        sources = archive.source_ids(var_name)
+        self.keys = None if sources is None else combine_ids(
+            sources, stable_id(var_name, self.weights.shape, hashlib.sha1(self.weights.tobytes()).hexdigest()))
+        todo = np.ones(n_times, dtype=bool)
+        for prev in previous:
+            if prev is not None and todo.any():
+                self._reuse(prev, todo)
+        self.reduced = int(todo.sum())
+        for start, stop in _runs(todo):
+            for idx, block in archive.iter_blocks(var_name, slice(start, stop)):
+                self._reduce_block(idx, block)
+
+    def _reuse(self, prev, todo):
+        """Copie de `prev` les séries des instants de même clé ; les retire de `todo`."""
+        if self.keys is None or getattr(prev, 'keys', None) is None or not len(prev.times):
+            return
+        pos = np.minimum(np.searchsorted(prev.times, self.times), len(prev.times) - 1)
+        match = todo & (prev.times[pos] == self.times) & (prev.keys[pos] == self.keys)
+        for name in SERIES:
+            getattr(self, name)[match] = getattr(prev, name)[pos[match]]
+        todo &= ~match
+
+    def unchanged_prefix(self, times, keys):
+        """Nombre d'instants en tête identiques (instant et clé) à ceux d'une version antérieure."""
+        if self.keys is None or keys is None:
+            return 0
+        n = min(len(times), len(self.times))
+        same = (times[:n] == self.times[:n]) & (keys[:n] == self.keys[:n])
+        return n if same.all() else int(np.argmin(same))
+
+    @property
+    def grid(self):
+        """Mailles de la grille et leur arbre (construits pour la première zone GeoJSON)."""
+        if self._grid is None:
+            with self._zones_lock:
+                if self._grid is None:
+                    self._grid = CellGrid(self.lats, self.lons)
+        return self._grid
+
+    def _reduce_block(self, idx, block):
+        values = np.ascontiguousarray(block.reshape(len(idx), -1), dtype=np.float32)
+        metrics.record_era5_read(self.var_name, values.nbytes)
+        self.region_series[idx] = self._weighted_mean(values)
+        with warnings.catch_warnings():
+            # Pas de temps entièrement manquants : NaN attendu
+            warnings.simplefilter('ignore', RuntimeWarning)
+            for r, cells in enumerate(self.cells):
+                sub = values[:, cells]
+                self.region_min[idx, r] = np.nanmin(sub, axis=1)
+                self.region_max[idx, r] = np.nanmax(sub, axis=1)
+            self.grid_min[idx] = np.nanmin(values, axis=1)
+            self.grid_max[idx] = np.nanmax(values, axis=1)
+        self.grid_sum[idx] = np.nansum(values, axis=1, dtype=np.float64)
+        self.grid_count[idx] = np.count_nonzero(~np.isnan(values), axis=1)
+
+    def _weighted_mean(self, values):
+        valid = ~np.isnan(values)
+        filled = np.where(valid, values, 0).astype(np.float64)
+        num = filled @ self.weights.T
+        den = valid.astype(np.float64) @ self.weights.T
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(den > 0, num / den, np.nan)
+
+    def zone_weights(self, geom):
+        """(mailles, poids normalisés) d'une zone quelconque, gardés en cache (LRU)."""
+        import shapely
+        key = shapely.to_wkb(shapely.normalize(geom))
+        with self._zones_lock:
+            if key in self._zones:
+                self._zones.move_to_end(key)
+                return self._zones[key]
+        cells, fraction = self.grid.coverage(geom)
+        weights = fraction * self.cos_lat[cells]
+        if not weights.sum():
+            # Zone plus petite qu'une maille : maille la plus proche de son centre,
+            # si ce centre est dans l'emprise de la grille
+            point = geom.representative_point()
+            if not (self.lats.min() <= point.y <= self.lats.max() and self.lons.min() <= point.x <= self.lons.max()):
+                raise ValueError("Zone hors de la grille ERA5")
+            i = np.abs(self.lats - point.y).argmin()
+            j = np.abs(self.lons - point.x).argmin()
+            cells, weights = np.array([i * len(self.lons) + j]), np.ones(1)
+        keep = weights > 0
+        entry = (cells[keep], weights[keep] / weights[keep].sum())
+        with self._zones_lock:
+            self._zones[key] = entry
+            while len(self._zones) > ZONE_CACHE_SIZE:
+                self._zones.popitem(last=False)
+        return entry
+
+    def zone_series(self, geom, sl=slice(None)):
+        """Moyenne pondérée, min et max de la zone par pas de temps (tableaux (temps,)).
+
+        L'archive est relue par blocs sur la fenêtre de grille couverte par la zone.
+        """
+        cells, weights = self.zone_weights(geom)
+        rows, cols = np.divmod(cells, len(self.lons))
+        window = (slice(int(rows.min()), int(rows.max()) + 1), slice(int(cols.min()), int(cols.max()) + 1))
+        local = (rows - rows.min()) * (cols.max() - cols.min() + 1) + (cols - cols.min())
+
+        start, stop, _ = sl.indices(len(self.times))
+        mean = np.full(stop - start, np.nan)
+        vmin = np.full(stop - start, np.nan)
+        vmax = np.full(stop - start, np.nan)
+        for idx, block in self.archive.iter_blocks(self.var_name, sl, window=window):
+            metrics.record_era5_read(self.var_name, block.nbytes)
+            values = block.reshape(len(idx), -1)[:, local].astype(np.float64)
+            valid = ~np.isnan(values)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                mean[idx - start] = (np.where(valid, values, 0) @ weights) / (valid @ weights)
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', RuntimeWarning)
+                vmin[idx - start] = np.nanmin(values, axis=1)
+                vmax[idx - start] = np.nanmax(values, axis=1)
+        return mean, vmin, vmax
+
+    def zone_stats(self, geom, sl=slice(None)):
+        """Moyenne, min et max d'une zone quelconque sur la période (flottants)."""
+        mean, vmin, vmax = self.zone_series(geom, sl)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            return {'mean': float(np.nanmean(mean)), 'min': float(np.nanmin(vmin)),
+                    'max': float(np.nanmax(vmax))}
+
+    def time_slice(self, debut=None, fin=None):
+        """Tranche d'indices temporels [debut, fin] (dates incluses, 'YYYY-MM-DD')."""
+        start = 0
+        stop = len(self.times)
+        if debut:
+            start = int(np.searchsorted(self.times, np.datetime64(debut, 'ns'), side='left'))
+        if fin:
+            end = np.datetime64(fin, 'D') + np.timedelta64(1, 'D')
+            stop = int(np.searchsorted(self.times, end.astype('datetime64[ns]'), side='left'))
+        return slice(start, max(start, stop))
+
+    def series(self, sl=slice(None), positions=None):
+        """Moyennes régionales pondérées (temps, régions)."""
+        out = self.region_series[sl]
+        return out if positions is None else out[:, positions]
+
+    def grid_stats(self, sl=slice(None)):
+        """Moyenne, min, max et somme sur toute la grille (équivalent de ds[var].mean() etc.)."""
+        count = self.grid_count[sl].sum()
+        total = float(self.grid_sum[sl].sum())
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            return {
+                'mean': total / count if count else np.nan,
+                'min': float(np.nanmin(self.grid_min[sl])) if count else np.nan,
+                'max': float(np.nanmax(self.grid_max[sl])) if count else np.nan,
+                'sum': total,
+            }
+
+    def stats(self, sl=slice(None), positions=None, percentiles=()):
+        """Moyenne, min, max (et percentiles) pondérés pour chaque région.
+
+        Retourne un dict {nom_stat: tableau (régions,)}. Les percentiles
+        demandent les valeurs par maille : l'archive est relue sur la période.
+        """
+        if positions is None:
+            positions = range(len(self.cells))
+        positions = list(positions)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            result = {
+                'mean': np.nanmean(self.region_series[sl][:, positions], axis=0),
+                'min': np.nanmin(self.region_min[sl][:, positions], axis=0).astype(np.float64),
+                'max': np.nanmax(self.region_max[sl][:, positions], axis=0).astype(np.float64),
+            }
+        if len(self.times[sl]) == 0:
+            for key in result:
+                result[key] = np.full(len(positions), np.nan)
+
+        if percentiles:
+            values = {r: [] for r in positions}
+            for _idx, block in self.archive.iter_blocks(self.var_name, sl):
+                flat = block.reshape(len(block), -1)
+                metrics.record_era5_read(self.var_name, flat.nbytes)
+                for r in positions:
+                    values[r].append(flat[:, self.cells[r]])
+            for q in percentiles:
+                result[f'p{q:g}'] = np.full(len(positions), np.nan)
+            for k, r in enumerate(positions):
+                if not values[r]:
+                    continue
+                vals = np.concatenate(values[r])
+                w = np.broadcast_to(self.weights[r, self.cells[r]], vals.shape)
+                qs = weighted_percentiles(vals.ravel(), w.ravel(), percentiles)
+                for q, v in zip(percentiles, qs):
+                    result[f'p{q:g}'][k] = v
+        return result
+
+
+def _runs(mask):
+    """Tranches [début, fin) des suites de True d'un tableau booléen."""
+    edges = np.flatnonzero(np.diff(np.concatenate([[0], mask.astype(np.int8), [0]])))
+    return zip(edges[::2], edges[1::2])
+
+
+def weighted_percentiles(values, weights, percentiles):
+    """Percentiles pondérés (interpolation sur la fonction de répartition)."""
+    valid = ~np.isnan(values)
+    values, weights = values[valid], weights[valid]
+    if values.size == 0:
+        return [np.nan] * len(percentiles)
+    order = np.argsort(values, kind='stable')
+    values, weights = values[order], weights[order]
+    cdf = np.cumsum(weights) - 0.5 * weights
+    cdf /= weights.sum()
+    return list(np.interp(np.asarray(percentiles, dtype=float) / 100, cdf, values))
+
+
+def date_inputs(request):
+    """(date_debut, date_fin) d'une requête WPS, None si absentes."""
+    return tuple(request.inputs[name][0].data if name in request.inputs else None
+                 for name in ('date_debut', 'date_fin'))
+
+
+def zonal_sources(var_name):
+    """Sources du catalogue dont dépendent les séries réduites de la variable."""
+    stream = get_catalog().stream_for(var_name)
+    if stream is None:
+        raise KeyError(f"Variable ERA5 '{var_name}' introuvable")
+    if stream == 'accum' and era5_paths('instant'):
+        # Variable cumulée : désaccumulée sur l'axe de la température (core.cube)
+        return ['regions'] + CUBE_SOURCES + ['cube']
+    return ['regions', ('era5', stream)]
+
+
+def get_zonal(var_name='t2m'):
+    """ZonalVariable partagée, mise à jour si les régions ou l'archive ERA5 changent.
+
+    Les instants inchangés sont repris de la version précédente puis de
+    l'état écrit par l'ingestion incrémentale : seuls les autres sont relus.
+    """
+    sources = zonal_sources(var_name)
+
+    def build(*values, previous=None):
+        # Import local : core.incremental dépend de ce module
+        from core.incremental import load_state
+        archive = get_cube() if 'cube' in sources else values[1]
+        return ZonalVariable(archive, var_name, get_region_index(), [previous, load_state(var_name)])
+
+    return get_catalog().derived(('zonal', var_name), sources, build,
+                                 update=lambda previous, *values: build(*values, previous=previous))
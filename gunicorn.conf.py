@@ -0,0 +1,28 @@
+"""Configuration gunicorn : `gunicorn -c gunicorn.conf.py server:app` (voir Dockerfile).
+
+Variables d'environnement :
+  PORT             port d'écoute (défaut 8080)
+  WEB_CONCURRENCY  nombre de workers (défaut 2)
+  WPS_PRELOAD      1 (défaut) : server.py et les données sont chargés une
+                   fois dans le maître puis partagés par fork (core/warmup.py) ;
+                   0 : chaque worker charge ses propres copies à la demande.
+"""
+import gc
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8080')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', '2'))
+timeout = 120
+preload_app = os.environ.get('WPS_PRELOAD', '1') != '0'
+
+
+def when_ready(server):
+    # Appelé dans le maître, après le chargement de l'application et avant le premier fork
+    if not preload_app:
+        return
+    from core.warmup import warm_up
+    timings = warm_up()
+    server.log.info("Données préchargées avant fork : %s",
+                    ', '.join(f'{k}={v}' for k, v in timings.items()))
+    # Objets préchargés exclus du ramasse-miettes : leurs pages restent partagées
+    gc.freeze()
@@ -0,0 +1,147 @@
+from pywps import Process, LiteralInput, ComplexOutput, Format
+import numpy as np
+
+from core.archive import period_label
+from core.cache import cached_execute
+from core.climatology import FREQUENCIES, get_climatology
+from core.metrics import debug_timings_input, instrumented
+from core.outputs import SERIES_FORMATS, date_strings, json_output, time_axis
+from core.progress import report
+from core.regions import MAX_REGIONS, get_region_index, is_batch
+from core.spatial import location_queries, point_inputs
+from core.zonal import date_inputs, get_zonal
+
+# Unité de sortie : (libellé, décalage, facteur) appliqués aux valeurs ERA5
+UNITES = {
+    't2m': ('°C', -273.15, 1.0),
+    'tp': ('mm', 0.0, 1000.0),
+}
+
+class AnomaliesClimatiques(Process):
+    def __init__(self):
+        inputs = [
+            LiteralInput('region', "Nom de la region (répétable, '*' = toutes)", data_type='string',
+                         min_occurs=0, max_occurs=MAX_REGIONS),
+            *point_inputs(),
+            LiteralInput('variable', 'Variable ERA5', data_type='string', default='t2m', min_occurs=0),
+            LiteralInput('date_debut', 'Date debut (YYYY-MM-DD)', data_type='string', min_occurs=0),
+            LiteralInput('date_fin', 'Date fin (YYYY-MM-DD)', data_type='string', min_occurs=0),
+            LiteralInput('frequence', 'Pas des anomalies (monthly, daily)', data_type='string',
+                         min_occurs=0, default='monthly', allowed_values=FREQUENCIES),
+            LiteralInput('reference_debut', 'Debut de la periode de reference (defaut : debut de l\'archive)',
+                         data_type='string', min_occurs=0),
+            LiteralInput('reference_fin', 'Fin de la periode de reference (defaut : fin de l\'archive)',
+                         data_type='string', min_occurs=0),
+            LiteralInput('format', 'Format de la serie (objets, colonnes, colonnes_compactes)',
+                         data_type='string', min_occurs=0, default='colonnes', allowed_values=SERIES_FORMATS),
+            debug_timings_input()
+        ]
+        outputs = [
+            ComplexOutput('output', 'Anomalies JSON',
+                          supported_formats=[Format('application/json')])
+        ]
+
+        super(AnomaliesClimatiques, self).__init__(
+            self._handler,
+            identifier='anomalies_climatiques',
+            title='Anomalies Climatiques',
+            abstract='Ecarts a la climatologie regionale (moyenne par mois ou jour calendaire)',
+            inputs=inputs,
+            outputs=outputs,
+            store_supported=True,
+            status_supported=True
+        )
+
+    @instrumented
+    @cached_execute
+    def _handler(self, request, response):
+        try:
+            index = get_region_index()
+            queries = location_queries(request, index)
+            var_name = request.inputs['variable'][0].data if 'variable' in request.inputs else 't2m'
+            freq = request.inputs['frequence'][0].data if 'frequence' in request.inputs else 'monthly'
+            fmt = request.inputs['format'][0].data if 'format' in request.inputs else 'colonnes'
+            date_debut, date_fin = date_inputs(request)
+            ref_debut = request.inputs['reference_debut'][0].data if 'reference_debut' in request.inputs else None
+            ref_fin = request.inputs['reference_fin'][0].data if 'reference_fin' in request.inputs else None
+
+            report(response, 'selection')
+            regions, missing = index.resolve_many(queries)
+            if not regions or (missing and not is_batch(queries)):
+                raise ValueError(f"Région '{(missing or queries)[0]}' non trouvée.")
+
+            # Séries régionales réduites + climatologie en cache (pas de relecture de l'archive)
+            report(response, 'chargement', 'ERA5')
+            zonal = get_zonal(var_name)
+            climatology = get_climatology(var_name, freq, ref_debut, ref_fin)
+            if not len(climatology.keys):
+                raise ValueError("Période de référence sans période complète")
+
+            sl = zonal.time_slice(date_debut, date_fin)
+            if len(zonal.times[sl]) == 0:
+                raise ValueError(f"Aucune donnée ERA5 entre {date_debut or 'le début'} et {date_fin or 'la fin'}")
+
+            report(response, 'reduction')
+            positions = [r.pos for r in regions]
+            periods, values, clim, anomalies, complete = climatology.anomalies(zonal, sl, positions)
+            unite, offset, scale = UNITES.get(var_name, ('', 0.0, 1.0))
+            periode = period_label(zonal.times[sl])
+            reference = period_label(climatology.times)
+
+            report(response, 'serialisation')
+            dates = date_strings(periods)
+            resultats = []
+            for k, region in enumerate(regions):
+                colonnes = {
+                    'valeur': _rounded((values[:, k] + offset) * scale),
+                    'climatologie': _rounded((clim[:, k] + offset) * scale),
+                    'anomalie': _rounded(anomalies[:, k] * scale),
+                    'complet': complete.tolist(),
+                }
+                if fmt == 'objets':
+                    serie = [dict(zip(['date'] + list(colonnes), row))
+                             for row in zip(dates.tolist(), *(_listed(v) for v in colonnes.values()))]
+                else:
+                    serie = time_axis(periods, dates.tolist(), compact=fmt == 'colonnes_compactes')
+                    serie.update(colonnes)
+                with np.errstate(invalid='ignore'):
+                    moyenne = np.nanmean(anomalies[complete, k]) * scale if complete.any() else np.nan
+                resultats.append({
+                    'region': region.nom,
+                    'variable': var_name,
+                    'unite': unite,
+                    'frequence': freq,
+                    'periode': periode,
+                    'reference': reference,
+                    'anomalie_moyenne': None if np.isnan(moyenne) else round(float(moyenne), 2),
+                    'anomalies': serie
+                })
+
+            if is_batch(queries):
+                result = {
+                    'periode': periode,
+                    'reference': reference,
+                    'nombre_regions': len(resultats),
+                    'regions': resultats
+                }
+                if missing:
+                    result['regions_non_trouvees'] = missing
+            else:
+                result = resultats[0]
+
+            return json_output(response, result, compact=True)
+
+        except Exception as e:
+            result = {'error': f"Erreur interne : {str(e)}"}
+            return json_output(response, result)
+
+
+def _rounded(values):
+    return np.round(np.asarray(values, dtype=np.float64), 2)
+
+
+def _listed(values):
+    # Listes Python avec None à la place de NaN (JSON valide)
+    if isinstance(values, list):
+        return values
+    return [None if np.isnan(v) else v for v in values.tolist()]
@@ -1,12 +1,29 @@
 from pywps import Process, LiteralInput, ComplexOutput, Format
-import xarray as xr
-import json
-import os
+
+from core.archive import period_label
+from core.cache import cached_execute
+from core.catalog import era5_paths, get_catalog
+from core.cube import period_days
+from core.metrics import debug_timings_input, instrumented
+from core.outputs import json_output
+from core.progress import report
+from core.regions import get_region_index
+from core.spatial import point_inputs, point_queries, zone_area_km2, zone_geometry, zone_input
+from core.zonal import date_inputs, get_zonal
 
 class MoyenneERA5(Process):
     def __init__(self):
         inputs = [
-            LiteralInput('variable', 'Variable ERA5', data_type='string', default='t2m')
+            LiteralInput('variable', 'Variable ERA5', data_type='string', default='t2m'),
+            LiteralInput('region', 'Nom de la region (optionnel, sinon tout le Maroc)',
+                         data_type='string', min_occurs=0),
+            *point_inputs(),
+            zone_input(),
+            LiteralInput('date_debut', 'Date debut (YYYY-MM-DD, defaut : debut de l\'archive)',
+                         data_type='string', min_occurs=0),
+            LiteralInput('date_fin', 'Date fin (YYYY-MM-DD, defaut : fin de l\'archive)',
+                         data_type='string', min_occurs=0),
+            debug_timings_input()
         ]
         outputs = [
             ComplexOutput('output', 'Resultat JSON', 
@@ -16,7 +33,7 @@ class MoyenneERA5(Process):
         super(MoyenneERA5, self).__init__(
             self._handler,
             identifier='moyenne_era5',
-            title='Statistiques ERA5 Maroc 2024',
+            title='Statistiques ERA5 Maroc',
             abstract='Calcule les statistiques climatiques ERA5',
             inputs=inputs,
             outputs=outputs,
@@ -24,38 +41,66 @@ class MoyenneERA5(Process):
             status_supported=True
         )
     
+    @instrumented
+    @cached_execute
     def _handler(self, request, response):
         try:
-            era5_file = 'data/era5_maroc_2024_real.nc'
-            
-            if not os.path.exists(era5_file):
+            if not era5_paths('instant'):
                 result = {'error': 'Fichier ERA5 introuvable'}
-                output_file = 'outputs/era5_error.json'
-                with open(output_file, 'w') as f:
-                    json.dump(result, f)
-                response.outputs['output'].file = output_file
-                return response
+                return json_output(response, result)
             
-            ds = xr.open_dataset(era5_file, engine='netcdf4')
+            report(response, 'chargement')
+            catalog = get_catalog()
             var_name = request.inputs['variable'][0].data
-            
-            if var_name not in ds.variables:
+            index = get_region_index()
+            region_name = request.inputs['region'][0].data if 'region' in request.inputs else None
+            # Point lat / lon : région qui le contient ; zone GeoJSON : statistiques sur le polygone
+            region_name = region_name or next(iter(point_queries(request, index)), None)
+            zone_geom = zone_geometry(request)
+            date_debut, date_fin = date_inputs(request)
+            stream = catalog.stream_for(var_name)
+            region = index.resolve(region_name) if region_name else None
+            zonal = get_zonal(var_name) if stream else None
+            sl = zonal.time_slice(date_debut, date_fin) if zonal else None
+
+            if zone_geom is not None and region_name:
+                result = {'error': "Entrées 'zone' et 'region' / 'lat' / 'lon' exclusives"}
+            elif region_name and region is None:
+                result = {'error': f"Région '{region_name}' non trouvée."}
+            elif zonal is None:
                 result = {
                     'error': f'Variable {var_name} non trouvee',
-                    'variables_disponibles': list(ds.data_vars.keys())
+                    'variables_disponibles': catalog.era5_variables()
                 }
+            elif len(zonal.times[sl]) == 0:
+                result = {'error': f"Aucune donnée ERA5 entre {date_debut or 'le début'} et {date_fin or 'la fin'}"}
             else:
-                var_data = ds[var_name]
-                mean_val = float(var_data.mean().values)
-                min_val = float(var_data.min().values)
-                max_val = float(var_data.max().values)
+                report(response, 'reduction', var_name)
+                periode = period_label(zonal.times[sl])
+                if zone_geom is not None:
+                    # Zone quelconque : poids en cache, archive relue sur sa fenêtre
+                    stats = zonal.zone_stats(zone_geom, sl)
+                    mean_val, min_val, max_val = stats['mean'], stats['min'], stats['max']
+                    zone = 'Zone personnalisée'
+                elif region is not None:
+                    # Statistiques zonales pondérées (séries réduites précalculées)
+                    stats = zonal.stats(sl, positions=[region.pos])
+                    mean_val = float(stats['mean'][0])
+                    min_val = float(stats['min'][0])
+                    max_val = float(stats['max'][0])
+                    zone = region.nom
+                else:
+                    # Toute la grille : sommes et extrêmes par pas de temps
+                    stats = zonal.grid_stats(sl)
+                    mean_val, min_val, max_val = stats['mean'], stats['min'], stats['max']
+                    zone = 'Maroc'
                 
                 if var_name == 't2m':
                     result = {
                         'variable': 't2m',
                         'description': 'Temperature a 2 metres',
-                        'periode': '2024',
-                        'region': 'Maroc',
+                        'periode': periode,
+                        'region': zone,
                         'source': 'ERA5 Copernicus',
                         'statistiques': {
                             'moyenne_C': round(mean_val - 273.15, 2),
@@ -64,15 +109,18 @@ class MoyenneERA5(Process):
                         }
                     }
                 elif var_name == 'tp':
+                    # tp désaccumulé en m/jour (core.cube) : cumul = taux moyen x durée
+                    jours = period_days(zonal.times[sl])
                     result = {
                         'variable': 'tp',
                         'description': 'Precipitations totales',
-                        'periode': '2024',
-                        'region': 'Maroc',
+                        'periode': periode,
+                        'region': zone,
                         'source': 'ERA5 Copernicus',
                         'statistiques': {
-                            'total_annuel_mm': round(float(var_data.sum()) * 1000, 2),
-                            'moyenne_mm': round(mean_val * 1000, 4)
+                            'total_mm': round(mean_val * jours * 1000, 2),
+                            'moyenne_mm_jour': round(mean_val * 1000, 4),
+                            'maximum_mm_jour': round(max_val * 1000, 2)
                         }
                     }
                 else:
@@ -83,18 +131,12 @@ class MoyenneERA5(Process):
                         'maximum': round(max_val, 4)
                     }
             
-            output_file = 'outputs/era5_result.json'
-            with open(output_file, 'w', encoding='utf-8') as f:
-                json.dump(result, f, ensure_ascii=False, indent=2)
-            
-            response.outputs['output'].file = output_file
-            ds.close()
-            return response
+                if zone_geom is not None:
+                    result['superficie_km2'] = round(zone_area_km2(zone_geom), 2)
+
+            report(response, 'serialisation')
+            return json_output(response, result, indent=2)
             
         except Exception as e:
             result = {'error': str(e)}
-            output_file = 'outputs/era5_error.json'
-            with open(output_file, 'w') as f:
-                json.dump(result, f)
-            response.outputs['output'].file = output_file
-            return response
+            return json_output(response, result)
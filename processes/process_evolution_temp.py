@@ -1,15 +1,32 @@
 from pywps import Process, LiteralInput, ComplexOutput, Format
-import xarray as xr
-import geopandas as gpd
-import json
 import numpy as np
 
+from core.archive import period_label
+from core.cache import cached_execute
+from core.metrics import debug_timings_input, instrumented
+from core.outputs import SERIES_FORMATS, date_strings, json_output, time_axis
+from core.progress import report
+from core.regions import MAX_REGIONS, get_region_index, is_batch
+from core.rollups import AUTO_TARGET_POINTS, RESOLUTIONS, Rollup, auto_resolution, get_rollups, lttb
+from core.spatial import location_queries, point_inputs, zone_area_km2, zone_geometry, zone_input
+from core.zonal import date_inputs, get_zonal
+
 class EvolutionTemperature(Process):
     def __init__(self):
         inputs = [
-            LiteralInput('region', 'Nom de la region', data_type='string'),
+            LiteralInput('region', "Nom de la region (répétable, '*' = toutes)", data_type='string',
+                         min_occurs=0, max_occurs=MAX_REGIONS),
+            *point_inputs(),
+            zone_input(),
             LiteralInput('date_debut', 'Date debut (YYYY-MM-DD)', data_type='string', min_occurs=0),
-            LiteralInput('date_fin', 'Date fin (YYYY-MM-DD)', data_type='string', min_occurs=0)
+            LiteralInput('date_fin', 'Date fin (YYYY-MM-DD)', data_type='string', min_occurs=0),
+            LiteralInput('resolution', 'Resolution temporelle (raw, daily, weekly, monthly, auto)',
+                         data_type='string', min_occurs=0, default='raw', allowed_values=RESOLUTIONS),
+            LiteralInput('max_points', 'Nombre maximal de points (sous-echantillonnage LTTB)',
+                         data_type='integer', min_occurs=0),
+            LiteralInput('format', 'Format de la serie (objets, colonnes, colonnes_compactes)',
+                         data_type='string', min_occurs=0, default='objets', allowed_values=SERIES_FORMATS),
+            debug_timings_input()
         ]
         outputs = [
             ComplexOutput('output', 'Evolution temporelle JSON',
@@ -27,88 +44,134 @@ class EvolutionTemperature(Process):
             status_supported=True
         )
 
+    @instrumented
+    @cached_execute
     def _handler(self, request, response):
         try:
-            region_name = request.inputs['region'][0].data
-            date_debut = request.inputs['date_debut'][0].data if 'date_debut' in request.inputs else None
-            date_fin = request.inputs['date_fin'][0].data if 'date_fin' in request.inputs else None
-
-            # 1. Charger le Shapefile
-            gdf = gpd.read_file('data/regions.shp')
-            subset = gdf[gdf['nom_region'].str.contains(region_name, case=False, na=False)]
-            
-            if subset.empty:
-                raise ValueError(f"Région '{region_name}' non trouvée.")
-
-            # Calcul du centroïde
-            centroid = subset.to_crs("EPSG:4326").geometry.centroid.iloc[0]
-            lat_target, lon_target = centroid.y, centroid.x
-
-            # 2. Charger ERA5 (Correction du problème 'time')
-            ds = xr.open_dataset('data/era5_maroc_2024_real.nc', engine='netcdf4', decode_times=True)
+            index = get_region_index()
+            zone_geom = zone_geometry(request)
+            queries = location_queries(request, index, required=zone_geom is None)
+            date_debut, date_fin = date_inputs(request)
+            resolution = request.inputs['resolution'][0].data if 'resolution' in request.inputs else 'raw'
+            max_points = request.inputs['max_points'][0].data if 'max_points' in request.inputs else None
+            fmt = request.inputs['format'][0].data if 'format' in request.inputs else 'objets'
 
-            # --- CORRECTION DIMENSIONS ---
-            # Si 'valid_time' existe, on le renomme en 'time'
-            if 'valid_time' in ds.variables or 'valid_time' in ds.coords:
-                ds = ds.rename({'valid_time': 'time'})
-            
-            # Si 'expver' existe (données expérimentales/récentes), on combine ou on prend le premier
-            if 'expver' in ds.coords:
-                # On prend la première version (souvent les données consolidées)
-                try:
-                    ds = ds.isel(expver=0)
-                except:
-                    pass
-            # -----------------------------
+            # 1. Région(s) (index partagé) ou zone GeoJSON
+            report(response, 'selection')
+            if zone_geom is not None:
+                if queries:
+                    raise ValueError("Entrées 'zone' et 'region' / 'lat' / 'lon' exclusives")
+                regions, missing, noms = [], [], ['Zone personnalisée']
+            else:
+                regions, missing = index.resolve_many(queries)
+                if not regions or (missing and not is_batch(queries)):
+                    raise ValueError(f"Région '{(missing or queries)[0]}' non trouvée.")
+                noms = [r.nom for r in regions]
 
-            # 3. Extraction Spatiale
-            point_ds = ds.sel(latitude=lat_target, longitude=lon_target, method='nearest')
+            # 2. ERA5 : moyenne pondérée sur la région (séries précalculées)
+            report(response, 'chargement', 'ERA5')
+            zonal = get_zonal('t2m')
 
-            # 4. Filtrage Temporel
+            # 3. Filtrage Temporel
+            sl = slice(None)
             if date_debut or date_fin:
                 try:
-                    point_ds = point_ds.sel(time=slice(date_debut, date_fin))
+                    sl = zonal.time_slice(date_debut, date_fin)
                     msg_periode = f"De {date_debut if date_debut else 'début'} à {date_fin if date_fin else 'fin'}"
                 except Exception as e:
                     msg_periode = f"Erreur filtre ({str(e)}). Année complète affichée."
+                if len(zonal.times[sl]) == 0:
+                    raise ValueError(f"Aucune donnée ERA5 entre {date_debut or 'le début'} et {date_fin or 'la fin'}")
+            else:
+                label = period_label(zonal.times)
+                msg_periode = f"Année complète {label}" if len(label) == 4 else f"Période complète {label}"
+
+            # 4. Préparation des données : (temps, régions) en une seule extraction
+            report(response, 'reduction')
+            positions = [r.pos for r in regions]
+            times = zonal.times[sl]
+            if zone_geom is not None:
+                # Zone quelconque : série calculée sur sa fenêtre de grille (poids en cache)
+                zone_series = zonal.zone_series(zone_geom, sl)[0][:, None]
+                temps_c = zone_series - 273.15
+            else:
+                temps_c = zonal.series(sl, positions) - 273.15
+            moyennes = np.mean(temps_c, axis=0)
+            mins = np.min(temps_c, axis=0)
+            maxs = np.max(temps_c, axis=0)
+
+            # 5. Résolution : série brute ou agrégats précalculés (jour/semaine/mois)
+            if resolution == 'auto':
+                resolution = auto_resolution(len(times), max_points or AUTO_TARGET_POINTS)
+            if resolution == 'raw':
+                valeurs, valeurs_min, valeurs_max = temps_c, None, None
+            elif zone_geom is not None:
+                rollup = Rollup.build(times, zone_series, resolution)
+                times = rollup.periods
+                valeurs, valeurs_min, valeurs_max = rollup.mean - 273.15, rollup.min - 273.15, rollup.max - 273.15
             else:
-                msg_periode = "Année complète 2024"
+                times, vmin, vmean, vmax = get_rollups('t2m')[resolution].select(
+                    zonal.region_series, sl, positions)
+                valeurs, valeurs_min, valeurs_max = vmean - 273.15, vmin - 273.15, vmax - 273.15
 
-            # 5. Préparation des données
-            times = point_ds['time'].values
-            temps_c = point_ds['t2m'].values - 273.15 
-            
-            evolution = []
-            for t, temp in zip(times, temps_c):
-                date_str = str(t).split('T')[0] 
-                evolution.append({
-                    'date': date_str,
-                    'temperature_c': round(float(temp), 2)
+            report(response, 'serialisation')
+            dates = date_strings(times)
+            resultats = []
+            for k, nom in enumerate(noms):
+                # Sous-échantillonnage qui préserve la forme de la courbe
+                keep = lttb(valeurs[:, k], max_points) if max_points else np.arange(len(dates))
+                colonnes = {'t2m_c': _rounded(valeurs[keep, k])}
+                if valeurs_min is not None:
+                    colonnes['t2m_min_c'] = _rounded(valeurs_min[keep, k])
+                    colonnes['t2m_max_c'] = _rounded(valeurs_max[keep, k])
+                if fmt == 'objets':
+                    evolution = self._records(dates[keep].tolist(), colonnes)
+                else:
+                    evolution = time_axis(times[keep], dates[keep].tolist(),
+                                          compact=fmt == 'colonnes_compactes')
+                    evolution.update(colonnes)
+                resultats.append({
+                    'region': nom,
+                    'periode': msg_periode,
+                    'resolution': resolution,
+                    'nombre_mesures': len(keep),
+                    'statistiques': {
+                        'moyenne': round(float(moyennes[k]), 2),
+                        'min': round(float(mins[k]), 2),
+                        'max': round(float(maxs[k]), 2)
+                    },
+                    'evolution': evolution
                 })
 
-            result = {
-                'region': subset['nom_region'].values[0],
-                'periode': msg_periode,
-                'nombre_mesures': len(evolution),
-                'statistiques': {
-                    'moyenne': round(float(np.mean(temps_c)), 2),
-                    'min': round(float(np.min(temps_c)), 2),
-                    'max': round(float(np.max(temps_c)), 2)
-                },
-                'evolution': evolution
-            }
+            if zone_geom is not None:
+                result = dict(resultats[0], superficie_km2=round(zone_area_km2(zone_geom), 2))
+            elif is_batch(queries):
+                result = {
+                    'periode': msg_periode,
+                    'nombre_regions': len(resultats),
+                    'regions': resultats
+                }
+                if missing:
+                    result['regions_non_trouvees'] = missing
+            else:
+                result = resultats[0]
 
-            output_file = 'outputs/evolution_result.json'
-            with open(output_file, 'w', encoding='utf-8') as f:
-                json.dump(result, f, ensure_ascii=False, indent=2)
-            
-            response.outputs['output'].file = output_file
-            ds.close()
-            return response
+            if fmt == 'objets':
+                return json_output(response, result, indent=2)
+            return json_output(response, result, compact=True)
 
         except Exception as e:
             result = {'error': f"Erreur interne : {str(e)}"}
-            with open('outputs/evolution_error.json', 'w') as f:
-                json.dump(result, f)
-            response.outputs['output'].file = 'outputs/evolution_error.json'
-            return response
+            return json_output(response, result)
+
+    @staticmethod
+    def _records(dates, colonnes):
+        """Un objet par pas de temps (format historique)."""
+        keys = {'t2m_c': 'temperature_c', 't2m_min_c': 'min_c', 't2m_max_c': 'max_c'}
+        names = [keys[c] for c in colonnes]
+        rows = zip(dates, *(v.tolist() for v in colonnes.values()))
+        return [dict(zip(['date'] + names, row)) for row in rows]
+
+
+def _rounded(values):
+    return np.round(np.asarray(values, dtype=np.float64), 2)
@@ -1,123 +1,255 @@
 from pywps import Process, LiteralInput, ComplexOutput, Format
-import geopandas as gpd
-import xarray as xr
-import json
 import numpy as np
 
-# Cache Global
-IMPACT_CACHE = None
+from core.archive import period_label
+from core.cache import cached_execute
+from core.catalog import get_catalog
+from core.climatology import get_climatology
+from core.cube import period_days
+from core.indices import SEUIL_VAGUE, SEUILS_CHALEUR, VAGUE_MIN_JOURS, get_indices, region_indices
+from core.metrics import debug_timings_input, instrumented
+from core.outputs import json_output
+from core.progress import report
+from core.regions import MAX_REGIONS, get_region_index, is_batch
+from core.spatial import location_queries, point_inputs
+from core.zonal import date_inputs, get_zonal
+
+# Niveaux de risque (indice 0 à 3) : libellé, couleur
+NIVEAUX = [("Faible", "vert"), ("Modéré", "jaune"), ("Élevé", "orange"), ("Critique", "rouge")]
+# Niveau d'un risque qui ne peut pas être évalué (indice -1)
+NON_EVALUE = ("Non évalué", "gris")
+# Seuils de déficit pluviométrique (%) des niveaux 1 à 3 (seuils thermiques : core.indices)
+SEUILS_DEFICIT = [10, 25, 50]
+# Plus longue période sèche (jours) signalée en alerte
+JOURS_SECS_ALERTE = 30
+# Percentiles demandés au plus (chacun relit l'archive sur la période, voir ZonalVariable.stats)
+MAX_PERCENTILES = 5
 
 class ImpactClimatique(Process):
     def __init__(self):
-        inputs = [LiteralInput('region', 'Nom de la region', data_type='string')]
+        inputs = [LiteralInput('region', "Nom de la region (répétable, '*' = toutes)", data_type='string',
+                               min_occurs=0, max_occurs=MAX_REGIONS),
+                  *point_inputs(),
+                  LiteralInput('date_debut', 'Date debut (YYYY-MM-DD)', data_type='string', min_occurs=0),
+                  LiteralInput('date_fin', 'Date fin (YYYY-MM-DD)', data_type='string', min_occurs=0),
+                  LiteralInput('percentiles', 'Percentiles (0-100) de la température par maille (répétable)',
+                               data_type='float', min_occurs=0, max_occurs=MAX_PERCENTILES),
+                  debug_timings_input()]
         outputs = [ComplexOutput('output', 'JSON', supported_formats=[Format('application/json')])]
         
         super(ImpactClimatique, self).__init__(
             self._handler,
             identifier='impact_climatique',
             title='Impact Climatique',
-            abstract='Analyse intégrée (Sans Précipitations)',
+            abstract='Analyse intégrée (température et précipitations)',
             inputs=inputs,
             outputs=outputs,
             store_supported=True,
             status_supported=True
         )
 
+    @instrumented
+    @cached_execute
     def _handler(self, request, response):
-        global IMPACT_CACHE
         try:
-            # --- CHARGEMENT UNIQUE ---
-            if IMPACT_CACHE is None:
-                print("⏳ Chargement Impact (Première fois)...")
-                try:
-                    gdf = gpd.read_file('data/regions.shp')
-                    with open('data/agriculture_maroc_2024.json', 'r', encoding='utf-8') as f:
-                        agri = json.load(f)
-                    ds = xr.open_dataset('data/era5_maroc_2024_real.nc', engine='netcdf4', decode_times=True)
-                    
-                    IMPACT_CACHE = {'gdf': gdf, 'agri': agri, 'ds': ds}
-                    print("✅ Données Impact chargées !")
-                except Exception as e:
-                    raise Exception(f"Erreur fichiers : {str(e)}")
-
-            region_name = request.inputs['region'][0].data
-            
-            # Données du cache
-            gdf = IMPACT_CACHE['gdf']
-            agri_data = IMPACT_CACHE['agri']
-            ds = IMPACT_CACHE['ds']
-
-            # Recherche Région
-            subset = gdf[gdf['nom_region'].str.contains(region_name, case=False, na=False)]
-            if subset.empty: raise ValueError(f"Région '{region_name}' non trouvée.")
-            
-            region_exacte = subset['nom_region'].values[0]
-            
-            # 1. Spatial
-            subset_proj = subset.to_crs('EPSG:3857')
-            superficie_totale = float(subset_proj.geometry.area.sum() / 1e6)
-
-            # 2. Agricole
-            agri_info = agri_data.get(region_exacte, {})
-            cultures = agri_info.get('cultures_principales', ['Non spécifié'])
-
-            # 3. Climat (Température uniquement)
-            bounds = subset.total_bounds
-            region_climate = ds.sel(latitude=slice(bounds[3], bounds[1]), longitude=slice(bounds[0], bounds[2]))
-            
-            temp_moyenne = float(region_climate['t2m'].mean().values) - 273.15
-            temp_max = float(region_climate['t2m'].max().values) - 273.15
-            
-            # 4. Analyse Impact (Uniquement basée sur la température)
-            risque = "Faible"
-            coul = "vert"
-            if temp_max > 40: risque, coul = "Critique", "rouge"
-            elif temp_max > 35: risque, coul = "Élevé", "orange"
-            elif temp_max > 30: risque, coul = "Modéré", "jaune"
-
-            alertes = []
-            recommandations = []
-
-            # Logique simplifiée sans pluie
-            if temp_max > 35:
-                alertes.append(f"Pic de chaleur détecté ({round(temp_max,1)}°C)")
-                recommandations.append("Irrigation d'appoint nécessaire")
+            # --- DONNÉES DU CATALOGUE PARTAGÉ (chargées une seule fois) ---
+            report(response, 'chargement')
+            catalog = get_catalog()
+            try:
+                index = get_region_index()
+                agri_data = catalog.agriculture()
+                zonal = get_zonal('t2m')
+                # Précipitations désaccumulées, alignées sur la température (core.cube)
+                pluie = get_zonal('tp') if catalog.stream_for('tp') else None
+            except Exception as e:
+                raise Exception(f"Erreur fichiers : {str(e)}")
+
+            queries = location_queries(request, index)
+            date_debut, date_fin = date_inputs(request)
+            percentiles = sorted({float(inp.data) for inp in request.inputs.get('percentiles', [])})
+            if any(not 0 <= q <= 100 for q in percentiles):
+                raise ValueError("Percentiles attendus entre 0 et 100")
+            sl = zonal.time_slice(date_debut, date_fin)
+            if len(zonal.times[sl]) == 0:
+                raise ValueError(f"Aucune donnée ERA5 entre {date_debut or 'le début'} et {date_fin or 'la fin'}")
+            periode = period_label(zonal.times[sl])
+
+            # Recherche Région(s)
+            report(response, 'selection')
+            regions, missing = index.resolve_many(queries)
+            if not regions or (missing and not is_batch(queries)):
+                raise ValueError(f"Région '{(missing or queries)[0]}' non trouvée.")
+
+            # Climat : toutes les régions demandées en une seule réduction
+            # (moyennes pondérées par la couverture des mailles)
+            report(response, 'reduction')
+            positions = [r.pos for r in regions]
+            # Percentiles pondérés des valeurs par maille : l'archive est relue sur la période
+            stats = zonal.stats(sl, positions=positions, percentiles=percentiles)
+            temp_moyennes = stats['mean'] - 273.15
+            # Maille la plus chaude de la région (les indices portent sur la moyenne régionale)
+            temp_maxs = stats['max'] - 273.15
+            pluies = self._precipitations(pluie, sl, positions)
+            # Indices agro-climatiques de la fenêtre (en cache, partagés avec indices_climatiques)
+            indices = get_indices(date_debut, date_fin)
+            valeurs = indices.select(positions)
+            niveaux = risk_levels(valeurs, pluies['deficit_pct'])
+
+            report(response, 'serialisation')
+            resultats = [
+                self._region_result(r, agri_data, float(temp_moyennes[k]), float(temp_maxs[k]), periode,
+                                    {key: values[k] for key, values in pluies.items()},
+                                    {key: int(values[k]) for key, values in niveaux.items()},
+                                    {key: values[k] for key, values in valeurs.items()}, indices.rainfall,
+                                    indices.daily_extremes,
+                                    {f'p{q:g}': _rounded(stats[f'p{q:g}'][k] - 273.15, 2) for q in percentiles})
+                for k, r in enumerate(regions)
+            ]
+            if is_batch(queries):
+                result = {'nombre_regions': len(resultats), 'regions': resultats}
+                if missing:
+                    result['regions_non_trouvees'] = missing
             else:
-                recommandations.append("Conditions thermiques favorables")
-
-            if 'Céréales' in cultures and temp_moyenne > 25:
-                alertes.append("Température moyenne élevée pour les céréales")
-
-            # Résultat Final
-            result = {
-                'region': region_exacte,
-                'donnees_spatiales': {'superficie_totale_km2': round(superficie_totale, 2)},
-                'donnees_agricoles': {
-                    'superficie_agricole_km2': agri_info.get('superficie_agricole_km2', 0),
-                    'pourcentage_agricole': agri_info.get('pourcentage_agricole', 0),
-                    'cultures_principales': cultures
-                },
-                'donnees_climatiques': {
-                    'temperature_moyenne_C': round(temp_moyenne, 2),
-                    'temperature_max_C': round(temp_max, 2),
-                    'precipitations': "Non analysé (mode simplifié)"
-                },
-                'analyse_impact': {
-                    'risque_thermique': {'niveau': risque, 'couleur': coul},
-                    'alertes': alertes if alertes else ["Aucune alerte thermique"],
-                    'recommandations': recommandations
-                },
-                'synthese': {'impact_global': f"Analyse thermique terminée pour {region_exacte}"}
-            }
+                result = resultats[0]
 
-            output_file = 'outputs/impact_result.json'
-            with open(output_file, 'w', encoding='utf-8') as f:
-                json.dump(result, f, ensure_ascii=False)
-            response.outputs['output'].file = output_file
-            return response
+            return json_output(response, result)
 
         except Exception as e:
             err = {'error': str(e)}
-            with open('outputs/impact_error.json', 'w') as f: json.dump(err, f)
-            response.outputs['output'].file = 'outputs/impact_error.json'
-            return response
\ No newline at end of file
+            return json_output(response, err)
+
+    @staticmethod
+    def _precipitations(pluie, sl, positions):
+        """Cumul observé, cumul normal (mm) et déficit (%) des régions sur la période.
+
+        La normale est calculée sur les années de l'archive hors période
+        analysée : sans référence disjointe, normale et déficit sont NaN.
+        """
+        n = len(positions)
+        if pluie is None:
+            return {key: np.full(n, np.nan) for key in ('total_mm', 'normale_mm', 'deficit_pct')}
+        times = pluie.times[sl]
+        window = (str(np.datetime64(times[0], 'D')), str(np.datetime64(times[-1], 'D')))
+        normales = get_climatology('tp', exclude=window)
+        jours = period_days(times)
+        total = pluie.stats(sl, positions=positions)['mean'] * jours * 1000
+        normale = normales.daily_normals(times, positions) * jours * 1000
+        with np.errstate(invalid='ignore', divide='ignore'):
+            deficit = np.where(normale > 0, (1 - total / normale) * 100, np.nan)
+        return {'total_mm': total, 'normale_mm': normale, 'deficit_pct': deficit,
+                'reference': np.full(n, normales.reference_label(), dtype=object)}
+
+    @staticmethod
+    def _region_result(region, agri_data, temp_moyenne, temp_max, periode, pluie, niveaux, indices,
+                       avec_pluie, extremes_journaliers, percentiles):
+        region_exacte = region.nom
+
+        # 1. Spatial (superficie géodésique précalculée)
+        superficie_totale = region.area_km2
+
+        # 2. Agricole
+        agri_info = agri_data.get(region_exacte, {})
+        cultures = agri_info.get('cultures_principales', ['Non spécifié'])
+
+        # 3. Analyse Impact (niveaux calculés pour toutes les régions par risk_levels)
+        alertes = []
+        recommandations = []
+
+        jours_chauds = int(indices[f'jours_sup_{SEUIL_VAGUE}'])
+        if jours_chauds:
+            # Jours et pic sur la même base : max journalier de la moyenne régionale
+            alertes.append(f"{jours_chauds} jour(s) au-dessus de {SEUIL_VAGUE}°C en moyenne régionale "
+                           f"(pic de la moyenne régionale à {round(float(indices['tmax_pic_C']), 2)}°C)")
+            recommandations.append("Irrigation d'appoint nécessaire")
+        else:
+            recommandations.append("Conditions thermiques favorables")
+
+        vague = int(indices['vague_chaleur_max_jours'])
+        if vague >= VAGUE_MIN_JOURS:
+            alertes.append(f"Vague de chaleur : {vague} jours consécutifs au-dessus de {SEUIL_VAGUE}°C")
+            recommandations.append("Décaler les travaux aux heures fraîches, ombrer les jeunes plants")
+
+        if 'Céréales' in cultures and temp_moyenne > 25:
+            alertes.append("Température moyenne élevée pour les céréales")
+
+        deficit = pluie['deficit_pct']
+        if niveaux['hydrique'] >= 2:
+            alertes.append(f"Déficit pluviométrique de {round(deficit)}% par rapport à la normale")
+            if "Irrigation d'appoint nécessaire" not in recommandations:
+                recommandations.append("Irrigation d'appoint nécessaire")
+            recommandations.append("Gestion économe de l'eau (goutte-à-goutte, paillage)")
+            if 'Céréales' in cultures:
+                alertes.append("Déficit hydrique pénalisant pour les céréales")
+
+        if avec_pluie and indices['jours_secs_max'] >= JOURS_SECS_ALERTE:
+            alertes.append(f"Période sèche de {int(indices['jours_secs_max'])} jours consécutifs")
+
+        if 'reference' in pluie:
+            precipitations = {
+                'total_mm': _rounded(pluie['total_mm'], 1),
+                'normale_mm': _rounded(pluie['normale_mm'], 1),
+                'ecart_pct': _rounded(-deficit, 1),
+                'reference': pluie['reference'] if not np.isnan(deficit) else None
+            }
+            if np.isnan(deficit):
+                precipitations['note'] = ("Pas d'années de référence hors de la période analysée : "
+                                          "déficit pluviométrique non évalué")
+        else:
+            precipitations = "Non analysé (données de précipitations absentes)"
+
+        # Résultat Final
+        return {
+            'region': region_exacte,
+            'donnees_spatiales': {'superficie_totale_km2': round(superficie_totale, 2)},
+            'donnees_agricoles': {
+                'superficie_agricole_km2': agri_info.get('superficie_agricole_km2', 0),
+                'pourcentage_agricole': agri_info.get('pourcentage_agricole', 0),
+                'cultures_principales': cultures
+            },
+            'donnees_climatiques': {
+                'periode': periode,
+                'temperature_moyenne_C': round(temp_moyenne, 2),
+                'temperature_max_C': round(temp_max, 2),
+                'temperature_max_moyenne_regionale_C': _rounded(indices['tmax_pic_C'], 2),
+                **({'temperature_percentiles_C': percentiles} if percentiles else {}),
+                'precipitations': precipitations,
+                'indices': region_indices(indices, avec_pluie, extremes_journaliers)
+            },
+            'analyse_impact': {
+                'risque_thermique': _niveau(niveaux['thermique']),
+                'risque_hydrique': _niveau(niveaux['hydrique']),
+                'risque_global': _niveau(niveaux['global']),
+                'alertes': alertes if alertes else ["Aucune alerte climatique"],
+                'recommandations': recommandations
+            },
+            'synthese': {'impact_global': f"Analyse thermique et pluviométrique terminée pour {region_exacte}"}
+        }
+
+
+def risk_levels(indices, deficits):
+    """Niveaux 0-3 thermique, hydrique et global de toutes les régions (tableaux).
+
+    Le niveau thermique compte les seuils de température max journalière
+    de la moyenne régionale dépassés au moins un jour (core.indices),
+    relevé d'un cran en cas de vague de chaleur. Le niveau global est le
+    plus élevé des deux, relevé d'un cran quand chaleur et sécheresse sont
+    toutes deux au moins élevées. Sans normale disjointe de la période, le
+    niveau hydrique vaut -1 (non évalué) et le niveau global est thermique.
+    """
+    depasses = sum((indices[f'jours_sup_{s}'] > 0).astype(int) for s in SEUILS_CHALEUR)
+    thermique = np.minimum(depasses + (indices['vagues_chaleur'] > 0), len(NIVEAUX) - 1)
+    # Déficit inconnu (pas de normale disjointe) : risque hydrique non évalué (-1)
+    hydrique = np.where(np.isnan(deficits), -1, np.digitize(np.nan_to_num(deficits), SEUILS_DEFICIT))
+    cumul = (thermique >= 2) & (hydrique >= 2)
+    global_ = np.minimum(np.maximum(thermique, hydrique) + cumul, len(NIVEAUX) - 1)
+    return {'thermique': thermique, 'hydrique': hydrique, 'global': global_}
+
+
+def _niveau(level):
+    niveau, couleur = NIVEAUX[level] if level >= 0 else NON_EVALUE
+    return {'niveau': niveau, 'couleur': couleur}
+
+
+def _rounded(value, digits):
+    # + 0.0 : évite d'afficher -0.0
+    return None if np.isnan(value) else round(float(value), digits) + 0.0
@@ -0,0 +1,79 @@
+from pywps import Process, LiteralInput, ComplexOutput, Format
+
+from core.archive import period_label
+from core.cache import cached_execute
+from core.indices import DEFINITIONS, get_indices, region_indices
+from core.metrics import debug_timings_input, instrumented
+from core.outputs import json_output
+from core.progress import report
+from core.regions import MAX_REGIONS, get_region_index, is_batch
+from core.spatial import location_queries, point_inputs
+from core.zonal import date_inputs, get_zonal
+
+class IndicesClimatiques(Process):
+    def __init__(self):
+        inputs = [LiteralInput('region', "Nom de la region (répétable, '*' = toutes)", data_type='string',
+                               min_occurs=0, max_occurs=MAX_REGIONS),
+                  *point_inputs(),
+                  LiteralInput('date_debut', 'Date debut (YYYY-MM-DD)', data_type='string', min_occurs=0),
+                  LiteralInput('date_fin', 'Date fin (YYYY-MM-DD)', data_type='string', min_occurs=0),
+                  debug_timings_input()]
+        outputs = [ComplexOutput('output', 'JSON', supported_formats=[Format('application/json')])]
+
+        super(IndicesClimatiques, self).__init__(
+            self._handler,
+            identifier='indices_climatiques',
+            title='Indices Climatiques',
+            abstract='Indices agro-climatiques (jours chauds, vagues de chaleur, degrés-jours, '
+                     'percentiles, jours secs) par région',
+            inputs=inputs,
+            outputs=outputs,
+            store_supported=True,
+            status_supported=True
+        )
+
+    @instrumented
+    @cached_execute
+    def _handler(self, request, response):
+        try:
+            index = get_region_index()
+            queries = location_queries(request, index)
+            date_debut, date_fin = date_inputs(request)
+
+            report(response, 'selection')
+            regions, missing = index.resolve_many(queries)
+            if not regions or (missing and not is_batch(queries)):
+                raise ValueError(f"Région '{(missing or queries)[0]}' non trouvée.")
+
+            report(response, 'chargement', 'ERA5')
+            zonal = get_zonal('t2m')
+            sl = zonal.time_slice(date_debut, date_fin)
+            if len(zonal.times[sl]) == 0:
+                raise ValueError(f"Aucune donnée ERA5 entre {date_debut or 'le début'} et {date_fin or 'la fin'}")
+
+            # Indices de toutes les régions, en cache pour la fenêtre
+            report(response, 'reduction')
+            indices = get_indices(date_debut, date_fin)
+            values = indices.select([r.pos for r in regions])
+            periode = period_label(zonal.times[sl])
+
+            report(response, 'serialisation')
+            resultats = [
+                {'region': r.nom, 'periode': periode, 'jours': indices.days,
+                 **region_indices({name: v[k] for name, v in values.items()}, indices.rainfall,
+                                  indices.daily_extremes)}
+                for k, r in enumerate(regions)
+            ]
+            if is_batch(queries):
+                result = {'periode': periode, 'definitions': DEFINITIONS,
+                          'nombre_regions': len(resultats), 'regions': resultats}
+                if missing:
+                    result['regions_non_trouvees'] = missing
+            else:
+                result = dict(resultats[0], definitions=DEFINITIONS)
+
+            return json_output(response, result)
+
+        except Exception as e:
+            return json_output(response, {'error': str(e)})
+
@@ -1,12 +1,21 @@
 from pywps import Process, LiteralInput, ComplexOutput, Format
-import geopandas as gpd
-import json
 import os
 
+from core.cache import cached_execute
+from core.catalog import get_catalog
+from core.metrics import debug_timings_input, instrumented
+from core.outputs import json_output
+from core.progress import report
+from core.regions import MAX_REGIONS, get_region_index, is_batch
+from core.spatial import location_queries, point_inputs
+
 class SurfaceAgricole(Process):
     def __init__(self):
         inputs = [
-            LiteralInput('region', 'Nom de la region', data_type='string')
+            LiteralInput('region', "Nom de la region (répétable, '*' = toutes)", data_type='string',
+                         min_occurs=0, max_occurs=MAX_REGIONS),
+            *point_inputs(),
+            debug_timings_input()
         ]
         outputs = [
             ComplexOutput('output', 'Resultat JSON', 
@@ -24,56 +33,57 @@ class SurfaceAgricole(Process):
             status_supported=True
         )
     
+    @instrumented
+    @cached_execute
     def _handler(self, request, response):
         try:
-            gdf = gpd.read_file('data/regions.shp')
-            
-            with open('data/agriculture_maroc_2024.json', 'r', encoding='utf-8') as f:
-                agri_data = json.load(f)
+            report(response, 'chargement')
+            index = get_region_index()
+            agri_data = get_catalog().agriculture()
             
-            region_name = request.inputs['region'][0].data
+            report(response, 'selection')
+            queries = location_queries(request, index)
+            regions, missing = index.resolve_many(queries)
             
-            subset = gdf[gdf['nom_region'].str.contains(region_name, case=False, na=False)]
-            
-            if subset.empty:
+            if not regions or (missing and not is_batch(queries)):
                 result = {
                     'error': 'Region non trouvee',
-                    'regions_disponibles': sorted(gdf['nom_region'].tolist())
+                    'regions_disponibles': sorted(index.names)
+                }
+            elif is_batch(queries):
+                result = {
+                    'nombre_regions': len(regions),
+                    'regions': [self._region_result(r, agri_data) for r in regions]
                 }
+                if missing:
+                    result['regions_non_trouvees'] = missing
             else:
-                region_exacte = subset['nom_region'].values[0]
-                subset_proj = subset.to_crs('EPSG:3857')
-                superficie_totale = float(subset_proj.geometry.area.sum() / 1e6)
-                
-                if region_exacte in agri_data:
-                    agri = agri_data[region_exacte]
-                    result = {
-                        'region': region_exacte,
-                        'annee': 2024,
-                        'superficie_totale_km2': round(superficie_totale, 2),
-                        'superficie_agricole_km2': agri['superficie_agricole_km2'],
-                        'pourcentage_agricole': agri['pourcentage_agricole'],
-                        'cultures_principales': agri['cultures_principales'],
-                        'source': 'Ministere Agriculture Maroc 2024'
-                    }
-                else:
-                    result = {
-                        'region': region_exacte,
-                        'superficie_totale_km2': round(superficie_totale, 2),
-                        'note': 'Donnees agricoles non disponibles'
-                    }
-            
-            output_file = 'outputs/surface_result.json'
-            with open(output_file, 'w', encoding='utf-8') as f:
-                json.dump(result, f, ensure_ascii=False, indent=2)
+                result = self._region_result(regions[0], agri_data)
             
-            response.outputs['output'].file = output_file
-            return response
+            return json_output(response, result, indent=2)
             
         except Exception as e:
             result = {'error': str(e)}
-            output_file = 'outputs/surface_error.json'
-            with open(output_file, 'w') as f:
-                json.dump(result, f)
-            response.outputs['output'].file = output_file
-            return response
+            return json_output(response, result)
+
+    @staticmethod
+    def _region_result(region, agri_data):
+        region_exacte = region.nom
+        superficie_totale = region.area_km2
+        
+        if region_exacte in agri_data:
+            agri = agri_data[region_exacte]
+            return {
+                'region': region_exacte,
+                'annee': 2024,
+                'superficie_totale_km2': round(superficie_totale, 2),
+                'superficie_agricole_km2': agri['superficie_agricole_km2'],
+                'pourcentage_agricole': agri['pourcentage_agricole'],
+                'cultures_principales': agri['cultures_principales'],
+                'source': 'Ministere Agriculture Maroc 2024'
+            }
+        return {
+            'region': region_exacte,
+            'superficie_totale_km2': round(superficie_totale, 2),
+            'note': 'Donnees agricoles non disponibles'
+        }
@@ -1,7 +1,18 @@
 #!/usr/bin/env python3
+import gzip
+import hashlib
 import os
+import posixpath
+import time
 from pywps import Service
-from flask import Flask, send_from_directory, request
+from flask import Flask, Response, abort, jsonify, send_file, send_from_directory, request
+from werkzeug.security import safe_join
+
+from core import memory, metrics, rest, static
+from core.cache import _is_error
+from core.catalog import get_catalog
+from core.geometry import DEFAULT_ZOOM, get_geometry_service
+from core.outputs import start_janitor
 
 # Import des processus
 from processes.process_surface import SurfaceAgricole
@@ -9,6 +20,8 @@ from processes.process_era5 import MoyenneERA5
 from processes.process_stats import StatsRegions
 from processes.process_evolution_temp import EvolutionTemperature
 from processes.process_impact_climatique import ImpactClimatique
+from processes.process_anomalies import AnomaliesClimatiques
+from processes.process_indices import IndicesClimatiques
 
 # Liste des processus
 processes = [
@@ -16,34 +29,155 @@ processes = [
     MoyenneERA5(),
     StatsRegions(),
     EvolutionTemperature(),
-    ImpactClimatique()
+    ImpactClimatique(),
+    AnomaliesClimatiques(),
+    IndicesClimatiques()
 ]
 
+PROCESSES_BY_ID = {p.identifier: p for p in processes}
+PROCESS_IDS = set(PROCESSES_BY_ID)
+
+# Réponses JSON de /processes : gzip au-delà de cette taille, durée de cache navigateur (s)
+GZIP_MIN_BYTES = 1024
+RESULT_MAX_AGE = 300
+
 app = Flask(__name__)
 wps_service = Service(processes, ['pywps.cfg'])
 
+# Nettoyage périodique des sorties de jobs (outputs/)
+start_janitor()
+
 # 1. PAGE D'ACCUEIL 
 @app.route('/')
 def home():
     # Envoie le fichier interface.html quand on va sur http://localhost:8080
-    return send_from_directory('.', 'interface.html')
+    # (revalidé à chaque visite : 304 sans corps tant qu'il n'a pas changé)
+    return static_file('.', 'interface.html', static.PAGE_MAX_AGE)
 
 # 2. Route WPS
 @app.route('/wps', methods=['GET', 'POST'])
 def wps():
-    return wps_service
+    # Exécution explicite de l'application pywps pour mesurer la requête complète
+    start = time.perf_counter()
+    response = Response.from_app(wps_service, request.environ)
+    metrics.observe_http(request.args, time.perf_counter() - start, PROCESS_IDS)
+    return response
 
 # 3. Route pour les Données 
 @app.route('/data/<path:filename>')
 def data_files(filename):
-    return send_from_directory('data', filename)
+    # data/store et data/snapshot (cubes, instantané, index) ne sont pas des téléchargements
+    if posixpath.normpath(filename).split('/')[0] in static.INTERNAL_DIRS:
+        abort(404)
+    return static_file(static.DATA_ROOT, filename, static.DATA_MAX_AGE)
+
+def static_file(directory, filename, max_age):
+    """Fichier statique : variante gzip / brotli précalculée, ETag du contenu, Range."""
+    path = safe_join(directory, filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    asset = static.get_asset(path)
+    ranged = request.range is not None
+    chosen, encoding = static.select(asset, request.accept_encodings, ranged)
+    etag = asset.etag + (f'-{encoding}' if encoding else '')
+    response = send_file(chosen, mimetype=asset.mimetype, conditional=True, etag=etag,
+                         max_age=max_age, last_modified=asset.state[0] / 1e9)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    if asset.variants:
+        response.headers['Vary'] = 'Accept-Encoding'
+    if max_age == 0:
+        response.cache_control.no_cache = True
+    return response
 
 # 4. Route pour les Résultats
 @app.route('/outputs/<path:filename>')
 def output_files(filename):
-    return send_from_directory('outputs', filename)
+    # ETag + Last-Modified : les requêtes répétées reçoivent un 304
+    return send_from_directory('outputs', filename, conditional=True, etag=True, max_age=0)
+
+# 5. Géométries simplifiées des régions (TopoJSON / GeoJSON par niveau de zoom)
+@app.route('/geometry/regions.<fmt>')
+def region_geometry(fmt):
+    try:
+        payload = get_geometry_service().payload(fmt, request.args.get('z', DEFAULT_ZOOM, type=int))
+    except KeyError:
+        abort(404)
+    # Variante gzip précalculée si le client l'accepte
+    if 'gzip' in request.accept_encodings:
+        response = Response(payload.gzip, mimetype=payload.mimetype)
+        response.headers['Content-Encoding'] = 'gzip'
+        response.set_etag(payload.etag + '-gz')
+    else:
+        response = Response(payload.body, mimetype=payload.mimetype)
+        response.set_etag(payload.etag)
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.cache_control.public = True
+    response.cache_control.max_age = 86400
+    return response.make_conditional(request)
+
+# 6. Métriques (format d'exposition Prometheus)
+@app.route('/metrics')
+def metrics_endpoint():
+    memory.publish(get_catalog(), metrics.REGISTRY)
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+# 7. Empreinte mémoire par jeu de données (JSON)
+@app.route('/memory')
+def memory_endpoint():
+    return jsonify(memory.report(get_catalog()))
+
+# 8. Exécution JSON directe (style OGC API - Processes), sans XML ni fichier de sortie
+@app.route('/processes')
+def process_list():
+    return jsonify({'processes': [
+        {'id': p.identifier, 'title': p.title, 'description': p.abstract,
+         'links': [{'rel': 'execute', 'href': f'/processes/{p.identifier}/execution'}]}
+        for p in processes]})
+
+@app.route('/processes/<process_id>/execution', methods=['GET', 'POST'])
+def process_execution(process_id):
+    process = PROCESSES_BY_ID.get(process_id)
+    if process is None:
+        return jsonify({'error': f"Processus inconnu : {process_id}"}), 404
+    start = time.perf_counter()
+    try:
+        if request.method == 'POST':
+            inputs = rest.body_inputs(request.get_json(silent=True) if request.data else {})
+        else:
+            inputs = rest.query_inputs(request.args)
+        payload = rest.execute(wps_service, process, inputs)
+    except rest.InputError as e:
+        return jsonify({'error': str(e)}), 400
+    if payload is None:
+        response = jsonify({'error': "Serveur occupé : nombre maximal d'exécutions simultanées atteint"})
+        response.headers['Retry-After'] = '1'
+        return response, 503
+    metrics.observe_http({'request': 'execute', 'identifier': process_id},
+                         time.perf_counter() - start, PROCESS_IDS)
+    return json_result(payload)
+
+def json_result(payload):
+    """Réponse JSON compressée (gzip si accepté), avec ETag et durée de cache."""
+    body = payload.encode('utf-8')
+    etag = hashlib.sha256(body).hexdigest()[:32]
+    if 'gzip' in request.accept_encodings and len(body) >= GZIP_MIN_BYTES:
+        response = Response(gzip.compress(body, 6), mimetype='application/json')
+        response.headers['Content-Encoding'] = 'gzip'
+        response.set_etag(etag + '-gz')
+    else:
+        response = Response(body, mimetype='application/json')
+        response.set_etag(etag)
+    response.headers['Vary'] = 'Accept-Encoding'
+    if _is_error(payload):
+        # Les erreurs (région inconnue, données absentes) ne sont pas gardées
+        response.cache_control.no_store = True
+    else:
+        response.cache_control.public = True
+        response.cache_control.max_age = RESULT_MAX_AGE
+    return response.make_conditional(request)
 
-# 5. Configuration CORS
+# 9. Configuration CORS
 @app.after_request
 def after_request(response):
     response.headers.add('Access-Control-Allow-Origin', '*')
@@ -3,12 +3,16 @@ import os
 from pywps import Service
 from flask import Flask, send_from_directory, request
 
+from core.outputs import start_janitor
+
 # Import des processus
 from processes.process_surface import SurfaceAgricole
 from processes.process_era5 import MoyenneERA5
 from processes.process_stats import StatsRegions
 from processes.process_evolution_temp import EvolutionTemperature
 from processes.process_impact_climatique import ImpactClimatique
+from processes.process_anomalies import AnomaliesClimatiques
+from processes.process_indices import IndicesClimatiques
 
 # Liste des processus
 processes = [
@@ -16,12 +20,17 @@ processes = [
     MoyenneERA5(),
     StatsRegions(),
     EvolutionTemperature(),
-    ImpactClimatique()
+    ImpactClimatique(),
+    AnomaliesClimatiques(),
+    IndicesClimatiques()
 ]
 
 app = Flask(__name__)
 wps_service = Service(processes, ['pywps.cfg'])
 
+# Nettoyage périodique des sorties de jobs (outputs/)
+start_janitor()
+
 # 1. Route principale du WPS
 @app.route('/wps', methods=['GET', 'POST'])
 def wps():